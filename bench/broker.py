@@ -0,0 +1,289 @@
+"""
+An in-memory stand-in for the parts of aio_pika the services use, so both apps can talk to
+each other inside one process without a RabbitMQ server.
+
+Queues, the default exchange, fanout and direct exchanges, per-channel prefetch,
+ack/reject, single active consumer queues and direct reply-to are modelled; every hop can be delayed by a fixed latency
+to mimic the network.
+"""
+import asyncio
+import itertools
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from aio_pika import ExchangeType
+
+DIRECT_REPLY_TO = "amq.rabbitmq.reply-to"
+
+
+class InMemoryBroker:
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.queues: dict[str, QueueState] = {}
+        self.exchanges: dict[str, "InMemoryExchange"] = {}
+        self.published = 0
+
+    async def connect(self, url: str | None = None, **kwargs) -> "InMemoryConnection":
+        return InMemoryConnection(self)
+
+    def route(self, exchange: "InMemoryExchange", message, routing_key: str) -> None:
+        self.published += 1
+        if exchange.name == "":
+            queues = [self.queues[routing_key]] if routing_key in self.queues else []
+        elif exchange.type == ExchangeType.FANOUT:
+            queues = [queue for queue, _ in exchange.bindings]
+        else:
+            queues = [queue for queue, key in exchange.bindings if key == routing_key]
+
+        for queue in queues:
+            queue.put(message, exchange.name, routing_key)
+
+
+class CallbackCollection:
+
+    """
+    Holds the reconnect/reopen callbacks of a robust connection or channel; the in-memory broker never fails, so they never run.
+    """
+
+    def __init__(self) -> None:
+        self.callbacks: list = []
+
+    def add(self, callback, weak: bool = False) -> None:
+        self.callbacks.append(callback)
+
+    def remove(self, callback) -> None:
+        self.callbacks.remove(callback)
+
+
+class InMemoryConnection:
+
+    def __init__(self, broker: InMemoryBroker) -> None:
+        self.broker = broker
+        self.is_closed = False
+        self.channels: list[InMemoryChannel] = []
+        self.reconnect_callbacks = CallbackCollection()
+
+    async def channel(self, **kwargs) -> "InMemoryChannel":
+        channel = InMemoryChannel(self)
+        self.channels.append(channel)
+        return channel
+
+    async def close(self) -> None:
+        for channel in self.channels:
+            await channel.close()
+        self.is_closed = True
+
+
+class InMemoryChannel:
+
+    ids = itertools.count()
+
+    def __init__(self, connection: InMemoryConnection) -> None:
+        self.connection = connection
+        self.broker = connection.broker
+        self.prefetch_count = 0
+        self.is_closed = False
+        self.reply_to = f"{DIRECT_REPLY_TO}.{next(self.ids)}"
+        self.default_exchange = ChannelExchange(InMemoryExchange(self.broker, "", ExchangeType.DIRECT), self)
+        self.reopen_callbacks = CallbackCollection()
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs) -> None:
+        self.prefetch_count = prefetch_count
+
+    async def declare_queue(self, name: str | None = None, *, passive: bool = False, exclusive: bool = False,
+                            **kwargs) -> "InMemoryQueue":
+        if passive and name not in self.broker.queues:
+            raise LookupError(f"no queue '{name}'")
+
+        name = name or f"amq.gen-{uuid.uuid4().hex}"
+        state = self.broker.queues.get(name)
+        if state is None:
+            state = self.broker.queues[name] = QueueState(name, kwargs.get("arguments") or {})
+        return InMemoryQueue(self, state)
+
+    async def get_queue(self, name: str, *, ensure: bool = True) -> "InMemoryQueue":
+        if name == DIRECT_REPLY_TO:
+            # replies to requests published on this channel are routed to a queue of its own
+            state = self.broker.queues.setdefault(self.reply_to, QueueState(self.reply_to, {}))
+            return InMemoryQueue(self, state)
+        return await self.declare_queue(name, passive=ensure)
+
+    async def declare_exchange(self, name: str, type: ExchangeType = ExchangeType.DIRECT, **kwargs) -> "ChannelExchange":
+        exchange = self.broker.exchanges.get(name)
+        if exchange is None:
+            exchange = self.broker.exchanges[name] = InMemoryExchange(self.broker, name, ExchangeType(type))
+        return ChannelExchange(exchange, self)
+
+    async def close(self) -> None:
+        self.is_closed = True
+
+
+class InMemoryExchange:
+
+    def __init__(self, broker: InMemoryBroker, name: str, type: ExchangeType) -> None:
+        self.broker = broker
+        self.name = name
+        self.type = type
+        self.bindings: list[tuple[QueueState, str]] = []
+
+
+class ChannelExchange:
+
+    """
+    An exchange as seen from one channel, which publishes through it.
+    """
+
+    def __init__(self, exchange: InMemoryExchange, channel: InMemoryChannel) -> None:
+        self.exchange = exchange
+        self.channel = channel
+        self.name = exchange.name
+        self.type = exchange.type
+        self.bindings = exchange.bindings
+
+    async def publish(self, message, routing_key: str, **kwargs) -> None:
+        if message.reply_to == DIRECT_REPLY_TO:
+            message.reply_to = self.channel.reply_to
+        self.exchange.broker.route(self.exchange, message, routing_key)
+
+
+class QueueState:
+
+    """
+    The messages and consumers of a queue, shared by every channel that declared it.
+    """
+
+    def __init__(self, name: str, arguments: dict) -> None:
+        self.name = name
+        self.arguments = arguments
+        self.messages: deque = deque()
+        self.consumers: list[Consumer] = []
+        self.next_consumer = 0
+
+    def put(self, message, exchange: str, routing_key: str) -> None:
+        self.messages.append((message, exchange, routing_key))
+        self.pump()
+
+    def pump(self) -> None:
+        consumers = self.consumers
+        if self.arguments.get("x-single-active-consumer"):
+            # the earliest consumer gets every message; the others stand by until it cancels
+            consumers = consumers[:1]
+        while self.messages and consumers:
+            for _ in range(len(consumers)):
+                consumer = consumers[self.next_consumer % len(consumers)]
+                self.next_consumer += 1
+                if consumer.ready():
+                    break
+            else:
+                return
+
+            message, exchange, routing_key = self.messages.popleft()
+            incoming = IncomingMessage(self, consumer, message, exchange, routing_key)
+            consumer.unacked += 0 if consumer.no_ack else 1
+            asyncio.get_running_loop().call_later(consumer.latency, consumer.deliver, incoming)
+
+    def settle(self, consumer: "Consumer", message, exchange: str, routing_key: str, requeue: bool) -> None:
+        consumer.unacked -= 1
+        if requeue:
+            self.messages.appendleft((message, exchange, routing_key))
+        self.pump()
+
+
+class InMemoryQueue:
+
+    """
+    A queue as seen from one channel, which supplies the prefetch count of its consumers.
+    """
+
+    def __init__(self, channel: InMemoryChannel, state: QueueState) -> None:
+        self.channel = channel
+        self.state = state
+        self.name = state.name
+
+    @property
+    def declaration_result(self) -> SimpleNamespace:
+        return SimpleNamespace(message_count=len(self.state.messages), consumer_count=len(self.state.consumers))
+
+    async def bind(self, exchange: "ChannelExchange", routing_key: str | None = None, **kwargs) -> None:
+        exchange.bindings.append((self.state, routing_key or ""))
+
+    async def unbind(self, exchange: "ChannelExchange", routing_key: str | None = None, **kwargs) -> None:
+        exchange.bindings.remove((self.state, routing_key or ""))
+
+    async def consume(self, callback, no_ack: bool = False, **kwargs) -> str:
+        consumer = Consumer(callback, no_ack, self.channel.prefetch_count, self.channel.broker.latency)
+        self.state.consumers.append(consumer)
+        self.state.pump()
+        return consumer.tag
+
+    async def cancel(self, consumer_tag: str, **kwargs) -> None:
+        self.state.consumers = [consumer for consumer in self.state.consumers if consumer.tag != consumer_tag]
+        self.state.pump()
+
+
+class Consumer:
+
+    tags = itertools.count()
+
+    def __init__(self, callback, no_ack: bool, prefetch_count: int, latency: float) -> None:
+        self.callback = callback
+        self.no_ack = no_ack
+        self.prefetch_count = prefetch_count
+        self.latency = latency
+        self.unacked = 0
+        self.tag = f"ctag-{next(self.tags)}"
+        self.tasks: set[asyncio.Task] = set()
+
+    def ready(self) -> bool:
+        return self.no_ack or not self.prefetch_count or self.unacked < self.prefetch_count
+
+    def deliver(self, incoming: "IncomingMessage") -> None:
+        task = asyncio.create_task(self.callback(incoming))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+
+class IncomingMessage:
+
+    def __init__(self, queue: QueueState, consumer: Consumer, message, exchange: str, routing_key: str) -> None:
+        self.queue = queue
+        self.consumer = consumer
+        self.message = message
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.body = message.body
+        self.headers = message.headers
+        self.content_type = message.content_type
+        self.content_encoding = message.content_encoding
+        self.correlation_id = message.correlation_id
+        self.reply_to = message.reply_to
+        self.message_id = message.message_id
+        self.delivery_tag = id(self)
+        self.processed = consumer.no_ack
+
+    async def ack(self, multiple: bool = False) -> None:
+        self.settle(False)
+
+    async def reject(self, requeue: bool = False) -> None:
+        self.settle(requeue)
+
+    async def nack(self, multiple: bool = False, requeue: bool = True) -> None:
+        self.settle(requeue)
+
+    def settle(self, requeue: bool) -> None:
+        if self.processed:
+            return
+        self.processed = True
+        self.queue.settle(self.consumer, self.message, self.exchange, self.routing_key, requeue)
+
+    @asynccontextmanager
+    async def process(self, requeue: bool = False, reject_on_redelivered: bool = False, ignore_processed: bool = False):
+        try:
+            yield self
+        except BaseException:
+            self.settle(requeue)
+            raise
+        else:
+            self.settle(False)
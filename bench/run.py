@@ -0,0 +1,396 @@
+"""
+End-to-end benchmark of the product and payment services.
+
+Both FastAPI apps run in this process, talking to each other through an in-memory broker
+and sharing one fakeredis store, and are driven over ASGI at the given concurrency levels.
+Run from the project root:
+
+    python -m bench.run --concurrency 1 10 50 --requests 500 --output bench-results.json
+    python -m bench.run --baseline bench-results.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
+import fakeredis
+import httpx
+from .broker import InMemoryBroker
+from .store import CountingRedis, RedisOps
+
+import payment.app.main as payment_main
+import payment.app.amqp as payment_amqp
+import payment.app.publisher as payment_publisher
+import product.app.consumer as product_consumer
+import product.app.main as product_main
+from payment.app import worker as payment_worker
+from payment.app.metrics import instrument_redis
+from payment.app.config import Evariable as payment_settings
+from product.app.config import Evariable as product_settings
+from product.app.partitions import partition_queue
+from payment.schema.payment import Payment
+from product.schema.product import Product
+
+FINAL_STATUSES = ("Completed", "Failed")
+
+
+class Context:
+
+    """
+    What the scenarios share: the HTTP clients of both apps and the IDs created so far.
+    """
+
+    def __init__(self, product: httpx.AsyncClient, payment: httpx.AsyncClient, rng: random.Random) -> None:
+        self.product = product
+        self.payment = payment
+        self.rng = rng
+        self.product_ids: list[str] = []
+        self.created_ids: list[str] = []
+        self.order_ids: list[str] = []
+
+    def product_body(self) -> dict:
+        return {"Product_Name": f"bench-{self.rng.randrange(10 ** 6):06d}", "Product_Info": "benchmark product",
+                "Product_Inventory": 10 ** 9, "Product_Price": round(self.rng.uniform(1, 1000), 2)}
+
+
+async def create_product(ctx: Context) -> int:
+    response = await ctx.product.post("/v1/create_product", json=ctx.product_body())
+    if response.status_code == 201 and "proID" in response.json():
+        ctx.created_ids.append(response.json()["proID"])
+    return response.status_code
+
+
+async def read_product(ctx: Context) -> int:
+    return (await ctx.product.get(f"/v1/read_product/{ctx.rng.choice(ctx.product_ids)}")).status_code
+
+
+async def update_product(ctx: Context) -> int:
+    return (await ctx.product.put(f"/v1/update_product/{ctx.rng.choice(ctx.product_ids)}", json=ctx.product_body())).status_code
+
+
+async def list_products(ctx: Context) -> int:
+    low = ctx.rng.uniform(1, 900)
+    params = {"limit": 20, "min_price": low, "max_price": low + 100, "in_stock": "true"}
+    return (await ctx.product.get("/v1/products", params=params)).status_code
+
+
+async def delete_product(ctx: Context) -> int:
+    if not ctx.created_ids:
+        return 0
+    return (await ctx.product.delete(f"/v1/delete_product/{ctx.created_ids.pop()}")).status_code
+
+
+async def order(ctx: Context) -> int:
+    response = await ctx.payment.post("/v1/orders/", json={"Product_id": ctx.rng.choice(ctx.product_ids), "Quantity": 1})
+    if response.status_code == 201:
+        ctx.order_ids.append(response.json()["order_id"])
+    return response.status_code
+
+
+async def check_order(ctx: Context) -> int:
+    return (await ctx.payment.get(f"/v1/check_order/{ctx.rng.choice(ctx.order_ids)}")).status_code
+
+
+async def order_completion(ctx: Context) -> int:
+    """
+    Places an order and long-polls it until the payment is final, so the latency covers the whole payment.
+    """
+    response = await ctx.payment.post("/v1/orders/", json={"Product_id": ctx.rng.choice(ctx.product_ids), "Quantity": 1})
+    if response.status_code != 201:
+        return response.status_code
+
+    order_id = response.json()["order_id"]
+    ctx.order_ids.append(order_id)
+    status = "pending"
+    while status not in FINAL_STATUSES:
+        response = await ctx.payment.get(f"/v1/check_order/{order_id}/wait", params={"since": status})
+        if response.status_code != 200:
+            return response.status_code
+        status = response.json()["message"]
+    return 200 if status == "Completed" else 500
+
+
+SCENARIOS = {
+    "create_product": create_product,
+    "read_product": read_product,
+    "update_product": update_product,
+    "list_products": list_products,
+    "order": order,
+    "check_order": check_order,
+    "order_completion": order_completion,
+    "delete_product": delete_product,
+}
+
+
+def percentiles(samples: list[float]) -> dict:
+    """
+    Nearest-rank percentiles of a list of durations in seconds, in milliseconds.
+    """
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "max": None, "mean": None}
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, max(0, int(len(ordered) * p + 0.5) - 1))] * 1000, 3)
+
+    return {"p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99), "max": round(ordered[-1] * 1000, 3),
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3)}
+
+
+class Bench:
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.broker = InMemoryBroker(args.broker_latency)
+        self.ops = RedisOps()
+        self.redis = CountingRedis(server=fakeredis.FakeServer(), decode_responses=True, ops=self.ops)
+        self.rpc: list[tuple[str, float]] = []
+        self.stack = AsyncExitStack()
+
+    def instrument(self) -> None:
+        """
+        Points both services at the in-memory broker and the counting store, and times every RPC.
+        """
+        payment_amqp.connect_robust = self.broker.connect
+        product_consumer.connect = self.broker.connect
+        payment_main.redis = self.redis
+        product_main.redis = self.redis
+        # in production each service times its own client; here they share one, so it is timed once
+        instrument_redis(self.redis)
+        payment_settings.payment_gateway_delay = self.args.gateway_delay
+        payment_settings.simulated_gateway_latency_sigma = self.args.gateway_sigma
+        payment_settings.simulated_gateway_decline_rate = self.args.gateway_decline_rate
+        payment_settings.simulated_gateway_error_rate = self.args.gateway_error_rate
+
+        call = payment_publisher.Publisher.call
+        rpc = self.rpc
+
+        async def timed_call(publisher, value: dict, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await call(publisher, value, *args, **kwargs)
+            finally:
+                rpc.append((value.get("method", "?"), time.perf_counter() - started))
+
+        payment_publisher.Publisher.call = timed_call
+
+    async def start(self) -> Context:
+        self.instrument()
+        for app in (product_main.app, payment_main.app):
+            await self.stack.enter_async_context(app.router.lifespan_context(app))
+
+        # the product consumer declares and claims its partition queues in a background task
+        partitions = [partition_queue(partition) for partition in range(product_settings.inventory_partitions)]
+        while not all(name in self.broker.queues and self.broker.queues[name].consumers for name in partitions):
+            await asyncio.sleep(0.01)
+
+        clients = [await self.stack.enter_async_context(
+            httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60))
+            for app in (product_main.app, payment_main.app)]
+        ctx = Context(*clients, random.Random(self.args.seed))
+
+        async with Product.db().pipeline(transaction=False) as pipe:
+            for _ in range(self.args.products):
+                product = Product(**ctx.product_body())
+                await product.save(pipeline=pipe)
+                ctx.product_ids.append(product.pk)
+            await pipe.execute()
+        return ctx
+
+    async def drain(self) -> None:
+        """
+        Waits until the payment workers have processed every queued payment.
+        """
+        pool = payment_worker.payment_worker_pool
+        deadline = time.monotonic() + self.args.drain_timeout
+        while time.monotonic() < deadline:
+            if not await Payment.db().llen(payment_worker.jobs_key()) and (pool is None or not pool.in_flight):
+                return
+            await asyncio.sleep(0.05)
+        print("warning: payment queue did not drain in time", file=sys.stderr)
+
+    async def run_load(self, ctx: Context, scenario, concurrency: int, requests: int) -> tuple[list[float], Counter]:
+        latencies: list[float] = []
+        statuses: Counter = Counter()
+        counter = itertools.count()
+
+        async def client() -> None:
+            while next(counter) < requests:
+                started = time.perf_counter()
+                try:
+                    status = await scenario(ctx)
+                except Exception as E:
+                    status = type(E).__name__
+                latencies.append(time.perf_counter() - started)
+                statuses[str(status)] += 1
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return latencies, statuses
+
+    async def measure(self, ctx: Context, name: str, concurrency: int) -> dict:
+        scenario = SCENARIOS[name]
+        requests = self.args.requests
+        if name == "delete_product":
+            requests = min(requests, len(ctx.created_ids))
+        if name == "check_order" and not ctx.order_ids:
+            await self.run_load(ctx, order, concurrency, self.args.warmup or 1)
+
+        await self.run_load(ctx, scenario, concurrency, self.args.warmup if name != "delete_product" else 0)
+        await self.drain()
+
+        commands, round_trips = self.ops.snapshot()
+        rpc_start = len(self.rpc)
+        started = time.perf_counter()
+        latencies, statuses = await self.run_load(ctx, scenario, concurrency, requests)
+        duration = time.perf_counter() - started
+        commands, round_trips = self.ops.commands - commands, self.ops.round_trips - round_trips
+        rpc = self.rpc[rpc_start:]
+        await self.drain()
+
+        errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+        rpc_methods = {}
+        for method in sorted({method for method, _ in rpc}):
+            samples = [duration for rpc_method, duration in rpc if rpc_method == method]
+            rpc_methods[method] = {"calls": len(samples), "rtt_ms": percentiles(samples)}
+
+        return {
+            "scenario": name,
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "duration_s": round(duration, 4),
+            "throughput_rps": round(len(latencies) / duration, 2) if duration else None,
+            "latency_ms": percentiles(latencies),
+            "errors": errors,
+            "status_codes": dict(statuses),
+            "rpc": {
+                "calls_per_request": round(len(rpc) / len(latencies), 3) if latencies else None,
+                "rtt_ms": percentiles([duration for _, duration in rpc]),
+                "methods": rpc_methods,
+            },
+            "redis": {
+                "commands_per_request": round(commands / len(latencies), 3) if latencies else None,
+                "round_trips_per_request": round(round_trips / len(latencies), 3) if latencies else None,
+            },
+        }
+
+    async def run(self) -> list[dict]:
+        results = []
+        async with self.stack:
+            ctx = await self.start()
+            for concurrency in self.args.concurrency:
+                for name in self.args.scenarios:
+                    result = await self.measure(ctx, name, concurrency)
+                    print_result(result)
+                    results.append(result)
+        return results
+
+
+def print_result(result: dict) -> None:
+    latency = result["latency_ms"]
+    print(f"{result['scenario']:<17} c={result['concurrency']:<4} n={result['requests']:<6} "
+          f"{result['throughput_rps'] or 0:>9.1f} req/s  p50={latency['p50'] or 0:>8.2f}ms  p95={latency['p95'] or 0:>8.2f}ms  "
+          f"p99={latency['p99'] or 0:>8.2f}ms  rpc/req={result['rpc']['calls_per_request'] or 0:<6} "
+          f"redis/req={result['redis']['commands_per_request'] or 0:<7} errors={result['errors']}", flush=True)
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compares throughput and p95 latency with a baseline run.
+
+    Returns:
+        list[str]: A line per scenario and concurrency level that got worse by more than `tolerance`.
+    """
+    previous = {(result["scenario"], result["concurrency"]): result for result in baseline["results"]}
+    regressions = []
+    print(f"\n{'scenario':<17} {'conc':<5} {'throughput':>12} {'p95':>12}")
+    for result in results:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if before is None or not before["throughput_rps"] or not before["latency_ms"]["p95"]:
+            continue
+        throughput = result["throughput_rps"] / before["throughput_rps"] - 1
+        p95 = result["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1
+        print(f"{result['scenario']:<17} {result['concurrency']:<5} {throughput:>+11.1%} {p95:>+11.1%}")
+        if throughput < -tolerance or p95 > tolerance:
+            regressions.append(f"{result['scenario']} c={result['concurrency']}: throughput {throughput:+.1%}, p95 {p95:+.1%}")
+    return regressions
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the product and payment services.")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS),
+                        help="scenarios to run, in this order (default: all)")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 10, 50], help="concurrent clients per run")
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests before each measurement")
+    parser.add_argument("--products", type=int, default=200, help="products seeded before the runs")
+    parser.add_argument("--gateway-delay", type=float, default=0.0, help="median seconds the simulated payment gateway takes")
+    parser.add_argument("--gateway-sigma", type=float, default=0.0, help="spread of the log-normal latency of the simulated gateway")
+    parser.add_argument("--gateway-decline-rate", type=float, default=0.0, help="share of payments the simulated gateway declines")
+    parser.add_argument("--gateway-error-rate", type=float, default=0.0, help="share of charges the simulated gateway fails")
+    parser.add_argument("--broker-latency", type=float, default=0.0, help="seconds added to every broker delivery")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="seconds to wait for queued payments between runs")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the request generator")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this earlier JSON output")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change counted as a regression (default 0.10)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if a regression is found")
+    parser.add_argument("--log-dir", help="directory for the service logs (default: a temporary directory)")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    # the services log to logs/ under the working directory
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix="bench-")
+    os.makedirs(os.path.join(log_dir, "logs"), exist_ok=True)
+    os.chdir(log_dir)
+
+    results = asyncio.run(Bench(args).run())
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "log_dir")},
+        },
+        "results": results,
+    }
+
+    if output:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"\nresults written to {output}")
+
+    if baseline:
+        with open(baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
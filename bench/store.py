@@ -0,0 +1,50 @@
+"""
+A fakeredis client that counts the commands and round trips it sends, so a benchmark can
+report the Redis work done per request.
+"""
+import fakeredis
+from redis.asyncio.client import Pipeline
+
+
+class RedisOps:
+
+    def __init__(self) -> None:
+        self.commands = 0
+        self.round_trips = 0
+
+    def snapshot(self) -> tuple[int, int]:
+        return self.commands, self.round_trips
+
+
+class CountingPipeline(Pipeline):
+
+    ops: RedisOps
+
+    async def execute(self, raise_on_error: bool = True):
+        if self.command_stack:
+            self.ops.commands += len(self.command_stack)
+            self.ops.round_trips += 1
+        return await super().execute(raise_on_error)
+
+
+class CountingRedis(fakeredis.FakeAsyncRedis):
+
+    def __init__(self, *args, ops: RedisOps, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.ops = ops
+
+    async def execute_command(self, *args, **options):
+        self.ops.commands += 1
+        self.ops.round_trips += 1
+        return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> Pipeline:
+        pipeline = CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipeline.ops = self.ops
+        return pipeline
+
+    async def blmove(self, first_list, second_list, timeout, src="LEFT", dest="RIGHT"):
+        # fakeredis answers BLMOVE without blocking, which would turn the payment workers into a busy loop
+        if (src.upper(), dest.upper()) == ("RIGHT", "LEFT"):
+            return await self.brpoplpush(first_list, second_list, timeout)
+        return await super().blmove(first_list, second_list, timeout, src, dest)
@@ -0,0 +1,124 @@
+import contextlib
+import logging
+import math
+from fastapi import HTTPException , Request , status
+from ..schema.payment import Payment
+from ..schema.payment_scripts import run_script
+from .config import Evariable
+from .metrics import admission_decisions
+
+logger_error = logging.getLogger('error_logger')
+
+# Takes one token from every bucket, or from none of them if one is empty. Buckets refill at their
+# rate from the Redis clock, so every API worker sees the same time.
+# KEYS: bucket hashes. ARGV: a (rate per second, burst) pair per bucket.
+# Returns {0, 0} when admitted, or {bucket_index, milliseconds until it holds a token} with a 1-based index.
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local levels = {}
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[i * 2 - 1]) / 1000
+    local burst = tonumber(ARGV[i * 2])
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'at')
+    local tokens = burst
+    if bucket[1] then
+        tokens = math.min(burst, tonumber(bucket[1]) + (now - tonumber(bucket[2])) * rate)
+    end
+    if tokens < 1 then
+        return {i, math.ceil((1 - tokens) / rate)}
+    end
+    levels[i] = tokens
+end
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[i * 2 - 1]) / 1000
+    redis.call('HSET', KEYS[i], 'tokens', levels[i] - 1, 'at', now)
+    redis.call('PEXPIRE', KEYS[i], math.ceil(tonumber(ARGV[i * 2]) / rate) + 1000)
+end
+return {0, 0}
+"""
+
+
+def bucket_key(*parts: str) -> str:
+    return Payment.payments_key("ratelimit", *parts)
+
+
+# Orders of this process that passed admission and are still being handled.
+orders_in_flight = 0
+
+
+def client_id(request: Request) -> str:
+    """
+    Identifies the client of a request by its address.
+
+    The `rate_limit_client_header` header is only trusted on requests coming from one of the
+    `rate_limit_trusted_proxies`, which set it; any other caller could pick a fresh identity per request.
+    """
+    address = request.client.host if request.client else "unknown"
+    if address in Evariable.rate_limit_trusted_proxies:
+        return request.headers.get(Evariable.rate_limit_client_header) or address
+    return address
+
+
+def reject(endpoint: str, reason: str, retry_after: float, detail: str) -> HTTPException:
+    admission_decisions.labels(endpoint, reason).inc()
+    return HTTPException(detail=detail, status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+@contextlib.asynccontextmanager
+async def admit_order(request: Request):
+    """
+    Admission control of the order endpoints, entered around the work of an order once retries
+    with an Idempotency-Key were answered from the cache, so replays are never turned away.
+
+    A request is turned away right away, before it reaches the inventory service or the payment
+    queue, when `rpc_max_in_flight` orders of this process are already being handled, or when its
+    client or the service as a whole ran out of tokens. An admitted order holds its slot until it
+    leaves the context, so the inventory RPCs of this process never belong to more orders than that.
+    The token buckets are kept in Redis and shared by every API worker; one script checks and takes
+    both tokens in a single round trip. If Redis cannot be reached, requests are let through.
+
+    Raises:
+        HTTPException: 429 TOO MANY REQUESTS with a Retry-After header.
+    """
+    global orders_in_flight
+    endpoint = request.scope["route"].path
+
+    # checked and taken without an await in between, so concurrent requests cannot overshoot the limit
+    if Evariable.rpc_max_in_flight > 0 and orders_in_flight >= Evariable.rpc_max_in_flight:
+        raise reject(endpoint, "rejected_rpc", 1, "Too many orders are being processed, retry shortly")
+    orders_in_flight += 1
+    try:
+        await take_tokens(request, endpoint)
+        admission_decisions.labels(endpoint, "accepted").inc()
+        yield
+    finally:
+        orders_in_flight -= 1
+
+
+async def take_tokens(request: Request, endpoint: str) -> None:
+    """
+    Takes a token from the bucket of the client and from the global bucket, where those limits are on.
+
+    Raises:
+        HTTPException: 429 TOO MANY REQUESTS if a bucket is empty.
+    """
+    scopes, keys, args = [], [], []
+    if Evariable.order_rate_limit_per_client > 0:
+        scopes.append("client")
+        keys.append(bucket_key("client", client_id(request)))
+        args += [Evariable.order_rate_limit_per_client, Evariable.order_rate_limit_burst_per_client]
+    if Evariable.order_rate_limit_global > 0:
+        scopes.append("global")
+        keys.append(bucket_key("global"))
+        args += [Evariable.order_rate_limit_global, Evariable.order_rate_limit_burst_global]
+
+    if keys:
+        try:
+            exhausted, wait_ms = await run_script(Payment.db(), TOKEN_BUCKET_SCRIPT, keys, args)
+        except Exception as E:
+            logger_error.error(f"Rate limiter unavailable, admitting the request | Error: {E}")
+            exhausted = 0
+        if exhausted:
+            raise reject(endpoint, f"rejected_{scopes[exhausted - 1]}", wait_ms / 1000, "Too many orders, retry later")
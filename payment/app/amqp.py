@@ -0,0 +1,176 @@
+import asyncio
+import itertools
+import logging
+import time
+from aio_pika import ExchangeType, Message, connect_robust
+from aio_pika.abc import AbstractExchange, AbstractIncomingMessage, AbstractRobustChannel, AbstractRobustConnection
+from .config import Evariable
+from .metrics import amqp_publishes , amqp_replies
+
+logger = logging.getLogger("publisher_logger")
+
+# RabbitMQ pseudo-queue for RPC replies: replies are pushed straight to the consuming channel, no queue is declared.
+DIRECT_REPLY_TO = "amq.rabbitmq.reply-to"
+
+
+class PooledChannel:
+
+    """
+    A channel of the pool with its throughput counters.
+
+    With publisher confirms on, up to `amqp_confirm_window` publishes may wait for their
+    confirm at once; RabbitMQ acknowledges the outstanding ones together, so the confirms
+    of concurrent publishes arrive in batches instead of one round trip each.
+    """
+
+    def __init__(self, index: int, channel: AbstractRobustChannel, confirm_window: int) -> None:
+        self.index = index
+        self.label = str(index)
+        self.channel = channel
+        self.exchanges: dict[str, AbstractExchange] = {"": channel.default_exchange}
+        self.confirm_window = asyncio.Semaphore(confirm_window) if confirm_window else None
+        self.on_reply = None
+        self.in_flight = 0
+        self.published = 0
+        self.failed = 0
+        self.replies = 0
+        self.window_published = 0
+        self.window_started = time.monotonic()
+        self.last_window_rate: float | None = None
+
+    async def consume_replies(self, on_reply) -> None:
+        """
+        Consumes the direct reply-to pseudo-queue, which must be done on the channel the requests are published on.
+        The consumer is set up again whenever the channel is reopened after a reconnect.
+
+        Args:
+            on_reply: Coroutine function called with every reply.
+        """
+        if self.on_reply is None:
+            self.channel.reopen_callbacks.add(self.restore_replies)
+        self.on_reply = on_reply
+        queue = await self.channel.get_queue(DIRECT_REPLY_TO, ensure=False)
+        await queue.consume(self.receive_reply, no_ack=True)
+
+    async def restore_replies(self, channel: AbstractRobustChannel) -> None:
+        await self.consume_replies(self.on_reply)
+        logger.info("Reply consumer restored on channel %s.", self.index)
+
+    async def receive_reply(self, message: AbstractIncomingMessage) -> None:
+        self.replies += 1
+        amqp_replies.labels(self.label).inc()
+        await self.on_reply(message)
+
+    async def publish(self, message: Message, routing_key: str, exchange: str = "") -> None:
+        """
+        Publishes a message, waiting for its confirm if confirms are on.
+
+        Args:
+            message (Message): The message to publish.
+            routing_key (str): The routing key; the queue name for the default exchange.
+            exchange (str): The name of an exchange declared through the pool, the default exchange if empty.
+        """
+        target = self.exchanges[exchange]
+        self.in_flight += 1
+        try:
+            if self.confirm_window is None:
+                await target.publish(message, routing_key=routing_key)
+            else:
+                async with self.confirm_window:
+                    await target.publish(message, routing_key=routing_key)
+        except Exception:
+            self.failed += 1
+            amqp_publishes.labels(self.label, "failed").inc()
+            raise
+        finally:
+            self.in_flight -= 1
+
+        self.published += 1
+        self.count_publish(time.monotonic())
+        amqp_publishes.labels(self.label, "ok").inc()
+
+    def count_publish(self, now: float) -> None:
+        elapsed = now - self.window_started
+        if elapsed >= Evariable.amqp_stats_window:
+            self.last_window_rate = self.window_published / elapsed
+            self.window_published = 0
+            self.window_started = now
+        self.window_published += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the channel, with the publish rate over the last complete stats
+        window, or over the current one until a window is complete. Reading them changes nothing.
+        """
+        elapsed = max(time.monotonic() - self.window_started, 1e-9)
+        if self.last_window_rate is None or elapsed >= Evariable.amqp_stats_window:
+            rate = self.window_published / elapsed
+        else:
+            rate = self.last_window_rate
+        return {
+            "channel": self.index,
+            "is_closed": self.channel.is_closed,
+            "in_flight": self.in_flight,
+            "published": self.published,
+            "failed": self.failed,
+            "replies": self.replies,
+            "publishes_per_sec": rate,
+        }
+
+
+class ChannelPool:
+
+    """
+    A shared, auto-reconnecting AMQP connection with a fixed pool of channels.
+
+    Publishes are spread over the channels round-robin, so they are not serialised on one
+    channel. Channels and their consumers are restored by aio-pika when the connection
+    comes back after a failure.
+    """
+
+    connection: AbstractRobustConnection
+
+    def __init__(self, size: int, publisher_confirms: bool, confirm_window: int) -> None:
+        self.size = max(1, size)
+        self.publisher_confirms = publisher_confirms
+        self.confirm_window = confirm_window if publisher_confirms else 0
+        self.channels: list[PooledChannel] = []
+        self.next_channel = itertools.cycle(range(self.size))
+
+    async def connect(self) -> "ChannelPool":
+        """
+        Opens the connection and the channels of the pool.
+
+        Returns:
+            ChannelPool: The pool once every channel is open.
+        """
+        self.connection = await connect_robust(f"amqp://{Evariable.RabbitMQ_user}:{Evariable.RabbitMQ_password}@{Evariable.RabbitMQ_host}:{Evariable.RabbitMQ_port}/")
+        for index in range(self.size):
+            channel = await self.connection.channel(publisher_confirms=self.publisher_confirms)
+            self.channels.append(PooledChannel(index, channel, self.confirm_window))
+        logger.info("AMQP channel pool opened | channels : %s | publisher_confirms : %s", self.size, self.publisher_confirms)
+        return self
+
+    async def declare_exchange(self, name: str, type: ExchangeType) -> None:
+        """
+        Declares an exchange on every channel of the pool, so messages can be published to it by name.
+        """
+        for channel in self.channels:
+            channel.exchanges[name] = await channel.channel.declare_exchange(name, type)
+
+    def channel(self) -> PooledChannel:
+        """
+        Returns the next channel to publish on.
+        """
+        return self.channels[next(self.next_channel)]
+
+    def stats(self) -> dict:
+        return {
+            "is_closed": self.connection.is_closed,
+            "publisher_confirms": self.publisher_confirms,
+            "channels": [channel.stats() for channel in self.channels],
+        }
+
+    async def close(self) -> None:
+        await self.connection.close()
+        logger.info("AMQP channel pool closed.")
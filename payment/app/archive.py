@@ -0,0 +1,285 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import uuid
+import zstandard
+from ..schema.payment import Payment , FINAL_STATUSES
+from ..schema.payment_scripts import run_script , REFRESH_LOCK_SCRIPT
+from .config import Evariable
+from .metrics import payments_archived
+
+logger = logging.getLogger("archive_logger")
+logger_error = logging.getLogger('error_logger')
+
+# Records per compressed frame: a lookup decompresses one frame, so smaller frames make cold reads cheaper.
+FRAME_RECORDS = 100
+
+INDEX_FILE = "index.sqlite3"
+
+# Filesystems the SQLite index cannot live on: its WAL needs memory shared by the processes of one host.
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "ceph", "glusterfs", "fuse.sshfs", "fuse.s3fs")
+
+
+def lock_key() -> str:
+    return Payment.payments_key("archive", "lock")
+
+
+class PaymentArchive:
+
+    """
+    Append-only archive of finished payments on disk.
+
+    Payments are stored as NDJSON in zstd-compressed segment files, each written frame holding
+    up to FRAME_RECORDS payments. A SQLite index maps every order ID to the segment, offset and
+    length of its frame, so a lookup reads and decompresses a single frame. A new segment is
+    started once the current one reaches `payment_archive_segment_size` bytes.
+
+    Writes come from one archiver at a time; any number of processes can read, each lookup on a
+    read-only connection of its own, so reads do not wait for writes. The index runs in WAL mode,
+    which needs the writer and the readers on the host the archive directory is on: the archive
+    works on a local disk of a single host, not on NFS or SMB.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.index: sqlite3.Connection | None = None
+        self.compressor = zstandard.ZstdCompressor(level=3)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def open_index(self) -> sqlite3.Connection:
+        if self.index is None:
+            self.index = sqlite3.connect(os.path.join(self.directory, INDEX_FILE), check_same_thread=False)
+            self.index.execute("PRAGMA journal_mode=WAL")
+            self.index.execute("CREATE TABLE IF NOT EXISTS payments (order_id TEXT PRIMARY KEY, segment TEXT, offset INTEGER, length INTEGER)")
+        return self.index
+
+    def current_segment(self) -> str:
+        segments = sorted(name for name in os.listdir(self.directory) if name.endswith(".ndjson.zst"))
+        if segments and os.path.getsize(os.path.join(self.directory, segments[-1])) < Evariable.payment_archive_segment_size:
+            return segments[-1]
+        number = int(segments[-1].split("-")[1].split(".")[0]) + 1 if segments else 1
+        return f"segment-{number:06d}.ndjson.zst"
+
+    def append(self, payments: list[dict]) -> None:
+        """
+        Appends payments to the current segment and indexes them. Blocking, run it in a thread.
+
+        The frames are synced to disk before they are indexed, so an indexed payment is always readable.
+
+        Args:
+            payments (list[dict]): The payment hashes, each with its 'pk'.
+        """
+        with self.lock:
+            index = self.open_index()
+            segment = self.current_segment()
+            entries = []
+            with open(os.path.join(self.directory, segment), "ab") as out:
+                for i in range(0, len(payments), FRAME_RECORDS):
+                    frame_payments = payments[i:i + FRAME_RECORDS]
+                    frame = self.compressor.compress("".join(json.dumps(payment) + "\n" for payment in frame_payments).encode())
+                    offset = out.tell()
+                    out.write(frame)
+                    entries.extend((payment["pk"], segment, offset, len(frame)) for payment in frame_payments)
+                out.flush()
+                os.fsync(out.fileno())
+
+            with index:
+                index.executemany("INSERT OR REPLACE INTO payments VALUES (?, ?, ?, ?)", entries)
+
+    def find(self, order_id: str) -> dict | None:
+        """
+        Looks up an archived payment. Blocking, run it in a thread.
+
+        Returns:
+            dict | None: The payment hash as it was archived, None if it is not in the archive.
+        """
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        index = sqlite3.connect(f"{pathlib.Path(path).as_uri()}?mode=ro", uri=True)
+        try:
+            entry = index.execute("SELECT segment, offset, length FROM payments WHERE order_id = ?", (order_id,)).fetchone()
+        finally:
+            index.close()
+        if entry is None:
+            return None
+
+        segment, offset, length = entry
+        with open(os.path.join(self.directory, segment), "rb") as source:
+            source.seek(offset)
+            frame = self.decompressor.decompress(source.read(length))
+        for line in frame.splitlines():
+            payment = json.loads(line)
+            if payment["pk"] == order_id:
+                return payment
+        return None
+
+    def close(self) -> None:
+        with self.lock:
+            if self.index is not None:
+                self.index.close()
+                self.index = None
+
+
+payment_archive = PaymentArchive(Evariable.payment_archive_dir)
+
+
+def filesystem_type(path: str) -> str | None:
+    """
+    Reads the type of the filesystem a path is on from /proc/mounts, None where that is not available.
+    """
+    try:
+        with open("/proc/mounts") as mounts:
+            entries = [line.split()[1:3] for line in mounts]
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    matches = [(mount_point, fs_type) for mount_point, fs_type in entries
+               if path == mount_point or path.startswith(mount_point.rstrip("/") + "/")]
+    return max(matches, key=lambda match: len(match[0]))[1] if matches else None
+
+
+def check_payment_archive() -> None:
+    """
+    Checks that the archive directory is usable when archiving is on, so a process does not archive
+    into, or read from, a directory its index cannot work in.
+
+    Raises:
+        SystemExit: If `payment_archive_dir` is not the absolute path of an existing directory on a local filesystem.
+    """
+    if Evariable.payment_archive_after <= 0:
+        return
+    directory = Evariable.payment_archive_dir
+    if not os.path.isabs(directory) or not os.path.isdir(directory):
+        raise SystemExit(f"payment_archive_dir must be the absolute path of an existing directory when archiving is on "
+                         f"| payment_archive_dir : {directory!r}")
+    fs_type = filesystem_type(directory)
+    if fs_type in NETWORK_FILESYSTEMS:
+        raise SystemExit(f"payment_archive_dir must be on a local disk, the archive index does not work on a network filesystem "
+                         f"| payment_archive_dir : {directory!r} | filesystem : {fs_type}")
+
+
+async def find_archived_payment(order_id: str) -> dict | None:
+    """
+    Reads a payment from the archive, None if archiving is off or the payment was never archived.
+    """
+    if Evariable.payment_archive_after <= 0:
+        return None
+    return await asyncio.to_thread(payment_archive.find, order_id)
+
+
+class PaymentArchiver:
+
+    """
+    Moves finished payments out of Redis once they are older than `payment_archive_after` seconds.
+
+    Every `payment_archive_interval` seconds it walks the payment hashes with SCAN, reads each
+    batch in one pipeline, appends the finished, old enough payments to the archive, drops them
+    from the search indexes and then sets an expiry of `payment_archive_key_ttl` seconds on their
+    keys and audit streams, so readers that started before the move still find them. A Redis lock
+    keeps a single archiver running at a time; it is extended after every batch, and a run that
+    lost its lock stops.
+    """
+
+    def __init__(self) -> None:
+        self.task: asyncio.Task | None = None
+        self.token = uuid.uuid4().hex
+        self.archived = 0
+
+    async def start(self) -> "PaymentArchiver":
+        self.task = asyncio.create_task(self.run())
+        logger.info("Payment archiver started")
+        return self
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        payment_archive.close()
+        logger.info("Payment archiver stopped")
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if await Payment.db().set(lock_key(), self.token, nx=True, ex=self.lock_ttl()):
+                    started = time.monotonic()
+                    archived = await self.archive()
+                    if archived:
+                        logger.info("Payments archived | count : %s | seconds : %.1f", archived, time.monotonic() - started)
+            except Exception as E:
+                logger_error.error(f"Archiving payments failed | Error: {E}")
+            await asyncio.sleep(Evariable.payment_archive_interval)
+
+    @staticmethod
+    def lock_ttl() -> int:
+        return max(1, int(Evariable.payment_archive_interval))
+
+    async def archive(self) -> int:
+        """
+        Archives every finished payment older than the cut-off.
+
+        Returns:
+            int: The number of payments archived.
+        """
+        db = Payment.db()
+        cutoff = (datetime.datetime.now() - datetime.timedelta(seconds=Evariable.payment_archive_after)).isoformat()
+        archived = 0
+        cursor = 0
+        while True:
+            cursor, keys = await db.scan(cursor, match=Payment.make_primary_key("*"), count=Evariable.payment_archive_batch)
+            if keys:
+                async with db.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.hgetall(key)
+                        pipe.ttl(key)
+                    results = await pipe.execute()
+
+                # keys that already expire were archived in an earlier run
+                due = [(key, payment) for key, payment, ttl in zip(keys, results[::2], results[1::2])
+                       if ttl == -1 and payment.get("status") in FINAL_STATUSES
+                       and payment.get("Purchase_time", "") < cutoff and "pk" in payment]
+                if due:
+                    await asyncio.to_thread(payment_archive.append, [payment for _, payment in due])
+                    async with db.pipeline(transaction=False) as pipe:
+                        for key, payment in due:
+                            pipe.expire(key, Evariable.payment_archive_key_ttl)
+                            pipe.expire(Payment.audit_key(payment["pk"]), Evariable.payment_archive_key_ttl)
+                            indexed = Payment.model_validate(payment)
+                            for index in indexed.index_keys():
+                                pipe.zrem(index, indexed.index_member())
+                        await pipe.execute()
+                    archived += len(due)
+                    self.archived += len(due)
+                    payments_archived.inc(len(due))
+
+            if cursor == 0:
+                return archived
+            if not await run_script(db, REFRESH_LOCK_SCRIPT, [lock_key()], [self.token, self.lock_ttl()]):
+                logger.warning("Archiver lock lost, stopping the run | archived : %s", archived)
+                return archived
+
+
+payment_archiver: PaymentArchiver | None = None
+
+
+async def start_payment_archiver() -> PaymentArchiver | None:
+    """
+    Starts the payment archiver of this process, unless archiving is turned off.
+
+    Raises:
+        SystemExit: If archiving is on and the archive directory is not usable.
+    """
+    global payment_archiver
+    if Evariable.payment_archive_after <= 0:
+        return None
+    check_payment_archive()
+    payment_archiver = await PaymentArchiver().start()
+    return payment_archiver
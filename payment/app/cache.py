@@ -0,0 +1,167 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from aio_pika import ExchangeType
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage
+from .config import Evariable
+
+logger = logging.getLogger("publisher_logger")
+
+PRODUCT_EVENTS_EXCHANGE = "product_events"
+
+NOT_FOUND = "NOT FOUND"
+
+
+class ProductCache:
+
+    """
+    An in-process LRU cache of product read results with a TTL.
+
+    Products that do not exist are cached as NOT_FOUND with a shorter TTL. Entries are
+    patched or dropped by the change events the product service publishes, so reads of
+    hot products are answered without a broker round trip.
+    """
+
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries: OrderedDict[str, tuple[float, dict | str]] = OrderedDict()
+        self.reading: dict[str, int] = {}
+        self.stale: set[str] = set()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, product_id: str) -> dict | str | None:
+        """
+        Looks up a product.
+
+        Args:
+            product_id (str): The unique identifier of the product.
+
+        Returns:
+            dict | str | None: A copy of the cached product, NOT_FOUND for a cached miss, or None if nothing is cached.
+        """
+        entry = self.entries.get(product_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, product = entry
+        if expires_at < time.monotonic():
+            del self.entries[product_id]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(product_id)
+        if product == NOT_FOUND:
+            self.negative_hits += 1
+            return NOT_FOUND
+        self.hits += 1
+        return dict(product)
+
+    def start_read(self, product_id: str) -> None:
+        """
+        Marks a read of the product from the inventory as in flight.
+
+        Args:
+            product_id (str): The unique identifier of the product.
+        """
+        self.reading[product_id] = self.reading.get(product_id, 0) + 1
+
+    def finish_read(self, product_id: str, product: dict | str | None) -> None:
+        """
+        Caches a read result unless a change event for the product arrived while it was in flight.
+
+        Args:
+            product_id (str): The unique identifier of the product.
+            product (dict | str | None): The product details, NOT_FOUND, or None if the read failed.
+        """
+        if product is not None and product_id not in self.stale and self.max_size > 0:
+            ttl = self.negative_ttl if product == NOT_FOUND else self.ttl
+            self.entries[product_id] = (time.monotonic() + ttl, product)
+            self.entries.move_to_end(product_id)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+        remaining = self.reading[product_id] - 1
+        if remaining:
+            self.reading[product_id] = remaining
+        else:
+            del self.reading[product_id]
+            self.stale.discard(product_id)
+
+    def apply_event(self, event: dict) -> None:
+        """
+        Patches or drops the cached copy of a product from a product change event.
+
+        Args:
+            event (dict): The event published by the product service.
+        """
+        product_id = event["product_id"]
+        if product_id in self.reading:
+            self.stale.add(product_id)
+
+        entry = self.entries.get(product_id)
+        if entry is None:
+            return
+
+        expires_at, product = entry
+        if event["event"] in ("updated", "inventory") and product != NOT_FOUND:
+            self.entries[product_id] = (expires_at, {**product, **event["fields"]})
+        else:
+            del self.entries[product_id]
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        """
+        Drops every entry, e.g. after the event subscription was lost.
+        """
+        self.stale.update(self.reading)
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+product_cache = ProductCache(Evariable.product_cache_size, Evariable.product_cache_ttl, Evariable.product_cache_negative_ttl)
+
+
+async def on_product_event(message: AbstractIncomingMessage) -> None:
+    try:
+        product_cache.apply_event(json.loads(message.body))
+    except (ValueError, KeyError) as error:
+        logger.warning(f"Ignoring malformed product event: {error}")
+
+
+async def subscribe_product_events(channel: AbstractChannel) -> None:
+    """
+    Binds an exclusive queue of this worker to the product events exchange.
+
+    The cache is cleared first, since events may have been missed while unsubscribed.
+
+    Args:
+        channel (AbstractChannel): The channel used to consume the events.
+    """
+    product_cache.clear()
+    exchange = await channel.declare_exchange(PRODUCT_EVENTS_EXCHANGE, ExchangeType.FANOUT)
+    queue = await channel.declare_queue(exclusive=True)
+    await queue.bind(exchange)
+    await queue.consume(on_product_event, no_ack=True)
+    logger.info("Subscribed to product change events.")
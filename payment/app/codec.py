@@ -0,0 +1,50 @@
+"""
+Wire format of the inventory RPC messages.
+
+Bodies are encoded according to the AMQP content_type of the message: msgpack for
+'application/msgpack' and JSON for 'application/json'. The product service answers in
+the content type of the request, with an envelope that is either {"result": ...} or
+{"error": CODE, "message": ...} plus details of the failure.
+"""
+import msgpack
+import orjson
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+NOT_FOUND = "NOT_FOUND"
+INSUFFICIENT_INVENTORY = "INSUFFICIENT_INVENTORY"
+
+CODECS = {
+    JSON: (orjson.dumps, orjson.loads),
+    MSGPACK: (msgpack.packb, msgpack.unpackb),
+}
+
+
+def register_codec(content_type: str, encode, decode) -> None:
+    """
+    Adds a codec for a content type, or replaces the one registered for it.
+
+    Args:
+        content_type (str): The AMQP content type the codec handles.
+        encode: Function turning a value into bytes.
+        decode: Function turning bytes back into a value; it should raise ValueError on bad input.
+    """
+    CODECS[content_type] = (encode, decode)
+
+
+def decode(body: bytes, content_type: str | None):
+    """
+    Decodes a message body according to its content type.
+
+    Raises:
+        ValueError: If the content type is unknown or the body cannot be decoded.
+    """
+    codec = CODECS.get(content_type)
+    if codec is None:
+        raise ValueError(f"Unsupported content type '{content_type}'")
+    return codec[1](body)
+
+
+def encode(value, content_type: str) -> bytes:
+    return CODECS[content_type][0](value)
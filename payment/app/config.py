@@ -11,8 +11,71 @@ class ENV (BaseSettings):
     RabbitMQ_port  : str = ""
     RabbitMQ_user : str = "guest"
     RabbitMQ_password : str = "guest"
+    amqp_channel_pool_size : int = 4
+    rpc_content_type : str = "application/msgpack"
+    inventory_partitions : int = 8
+    amqp_publisher_confirms : bool = True
+    amqp_confirm_window : int = 256
+    amqp_stats_window : float = 60.0
+    inventory_read_batch_size : int = 100
+    inventory_read_batch_window : float = 0.0
+    product_cache_size : int = 10000
+    product_cache_ttl : float = 30.0
+    product_cache_negative_ttl : float = 5.0
+    payment_worker_embedded : bool = True
+    payment_worker_concurrency : int = 100
+    payment_worker_stats_interval : float = 60.0
+    payment_gateway_delay : float = 10.0
+    default_payment_gateway : str = "simulated"
+    gateway_concurrency : int = 100
+    gateway_timeout : float = 30.0
+    gateway_hedge_delay : float = 0.0
+    gateway_breaker_failures : int = 5
+    gateway_breaker_reset : float = 30.0
+    gateway_overrides : dict[str, dict[str, float]] = {}
+    simulated_gateway_latency_sigma : float = 0.0
+    simulated_gateway_decline_rate : float = 0.0
+    simulated_gateway_error_rate : float = 0.0
+    order_rate_limit_per_client : float = 0.0
+    order_rate_limit_burst_per_client : int = 20
+    order_rate_limit_global : float = 0.0
+    order_rate_limit_burst_global : int = 200
+    rate_limit_client_header : str = "X-Client-Id"
+    rate_limit_trusted_proxies : list[str] = []
+    rpc_max_in_flight : int = 1000
+    idempotency_ttl : int = 86400
+    idempotency_lock_ttl : int = 60
+    idempotency_wait_timeout : float = 30.0
+    order_status_wait_timeout : float = 30.0
+    order_status_keepalive : float = 15.0
+    order_status_stream_timeout : float = 600.0
+    webhook_timeout : float = 10.0
+    webhook_max_connections : int = 100
+    webhook_endpoint_concurrency : int = 4
+    webhook_batch_size : int = 1
+    webhook_claim_batch : int = 100
+    webhook_poll_interval : float = 1.0
+    webhook_max_attempts : int = 8
+    webhook_backoff_base : float = 1.0
+    webhook_backoff_max : float = 3600.0
+    webhook_allow_private_hosts : bool = False
+    payment_archive_after : float = 0.0
+    payment_archive_interval : float = 3600.0
+    payment_archive_batch : int = 500
+    payment_archive_dir : str = ""
+    payment_archive_segment_size : int = 268435456
+    payment_archive_key_ttl : int = 3600
+    payment_search_max_limit : int = 100
+    payment_search_max_scan : int = 1000
+    payment_search_backfill_batch : int = 500
+    log_queue_enabled : bool = True
+    log_queue_size : int = 10000
+    log_json : bool = False
+    log_sample_rates : dict[str, float] = {}
 
     class Config :
         env_file = ".env"
 
-Evariable=ENV()
\ No newline at end of file
+Evariable=ENV()
+
+REDIS_DATA_URL = f"redis://{Evariable.redis_username}:{Evariable.redis_password}@{Evariable.redis_host}:{Evariable.redis_port}/{Evariable.redis_database}"
\ No newline at end of file
@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import random
+import time
+from .config import Evariable
+from .metrics import gateway_call_duration , gateway_calls , gateway_hedges , gateway_circuit_open
+
+logger = logging.getLogger("payment_gateway")
+
+
+class GatewayError(Exception):
+
+    """
+    Raised when a gateway could not charge a payment. Counts against the circuit breaker of the gateway.
+    """
+
+
+class PaymentDeclinedError(GatewayError):
+
+    """
+    Raised when a gateway answered and refused the payment. The gateway itself is healthy.
+    """
+
+
+class GatewayUnavailableError(GatewayError):
+
+    """
+    Raised without calling the gateway when its circuit is open.
+    """
+
+
+class PaymentGateway:
+
+    """
+    Interface of a payment gateway. Subclasses set `name` and implement `charge`.
+
+    `charge` may be called more than once for the same payment when hedging is on, so
+    implementations must pass the idempotency key on to the gateway, which charges at most
+    once per key.
+    """
+
+    name: str
+
+    async def charge(self, payment, idempotency_key: str) -> None:
+        """
+        Charges a payment.
+
+        Args:
+            payment (Payment): The payment to charge, with its 'Total_price'.
+            idempotency_key (str): The same for every attempt on the payment.
+
+        Raises:
+            PaymentDeclinedError: If the gateway refused the payment.
+            GatewayError: If the gateway failed to handle the request.
+        """
+        raise NotImplementedError
+
+
+class SimulatedGateway(PaymentGateway):
+
+    """
+    Gateway for local runs and benchmarks: it waits a log-normal time around `payment_gateway_delay`
+    seconds, spread by `simulated_gateway_latency_sigma`, then declines `simulated_gateway_decline_rate`
+    of the payments and fails `simulated_gateway_error_rate` of them.
+    """
+
+    name = "simulated"
+
+    async def charge(self, payment, idempotency_key: str) -> None:
+        delay = Evariable.payment_gateway_delay
+        if Evariable.simulated_gateway_latency_sigma > 0:
+            delay *= random.lognormvariate(0, Evariable.simulated_gateway_latency_sigma)
+        await asyncio.sleep(delay)
+
+        draw = random.random()
+        if draw < Evariable.simulated_gateway_error_rate:
+            raise GatewayError("Simulated gateway error")
+        if draw < Evariable.simulated_gateway_error_rate + Evariable.simulated_gateway_decline_rate:
+            raise PaymentDeclinedError("Simulated decline")
+
+
+class CircuitBreaker:
+
+    """
+    Opens after `failures` consecutive failed calls and fails calls fast for `reset_timeout`
+    seconds. Then a single trial call is let through: the circuit closes if it succeeds and
+    opens again if it fails.
+    """
+
+    def __init__(self, failures: int, reset_timeout: float) -> None:
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self.trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def record(self, success: bool) -> None:
+        self.trial = False
+        if success:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            return
+        self.consecutive_failures += 1
+        if self.opened_at is not None or self.consecutive_failures >= self.failures:
+            self.opened_at = time.monotonic()
+
+
+class GatewayAdapter:
+
+    """
+    Calls one gateway within its limits.
+
+    At most `concurrency` charges run at once; payments beyond that wait for a slot instead of
+    piling up on the gateway. Each attempt is cut off after `timeout` seconds at the gateway;
+    the wait for a slot does not count, so local queueing never trips the breaker. With a hedge
+    delay set, a charge still running after that delay is raced by a second attempt, provided
+    a slot is free, and the first to finish wins. Failures and timeouts feed a circuit breaker,
+    which fails the charges fast while the gateway is degraded; declines do not.
+    """
+
+    def __init__(self, gateway: PaymentGateway, concurrency: int, timeout: float, hedge_delay: float,
+                 breaker_failures: int, breaker_reset: float) -> None:
+        self.gateway = gateway
+        self.name = gateway.name
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.declines = 0
+        self.rejected = 0
+        self.hedges = 0
+
+    async def charge(self, payment) -> None:
+        """
+        Charges a payment through the gateway.
+
+        Raises:
+            GatewayUnavailableError: If the circuit is open.
+            PaymentDeclinedError: If the gateway refused the payment.
+            GatewayError: If the gateway failed or did not answer within the timeout.
+        """
+        if not self.breaker.allow():
+            self.rejected += 1
+            gateway_calls.labels(self.name, "rejected").inc()
+            raise GatewayUnavailableError(f"Payment gateway '{self.name}' is unavailable")
+
+        started = time.monotonic()
+        outcome = "ok"
+        try:
+            await self.hedged(payment)
+        except PaymentDeclinedError:
+            outcome = "declined"
+            self.declines += 1
+            raise
+        except TimeoutError:
+            outcome = "timeout"
+            self.errors += 1
+            raise GatewayError(f"Payment gateway '{self.name}' timed out")
+        except Exception:
+            outcome = "error"
+            self.errors += 1
+            raise
+        finally:
+            self.calls += 1
+            self.breaker.record(outcome in ("ok", "declined"))
+            gateway_circuit_open.labels(self.name).set(self.breaker.state != "closed")
+            gateway_calls.labels(self.name, outcome).inc()
+            gateway_call_duration.labels(self.name).observe(time.monotonic() - started)
+
+    async def hedged(self, payment) -> None:
+        attempts = [asyncio.create_task(self.attempt(payment))]
+        try:
+            if self.hedge_delay > 0:
+                done, _ = await asyncio.wait(attempts, timeout=self.hedge_delay)
+                if not done and not self.semaphore.locked():
+                    self.hedges += 1
+                    gateway_hedges.labels(self.name).inc()
+                    attempts.append(asyncio.create_task(self.attempt(payment)))
+
+            pending = set(attempts)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    # a decline is the gateway's answer, while a failed attempt only counts once the other one failed too
+                    error = finished.exception()
+                    if error is None or isinstance(error, PaymentDeclinedError) or not pending:
+                        return finished.result()
+        finally:
+            for task in attempts:
+                task.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
+
+    async def attempt(self, payment) -> None:
+        async with self.semaphore:
+            self.in_flight += 1
+            try:
+                async with asyncio.timeout(self.timeout):
+                    await self.gateway.charge(payment, payment.pk)
+            finally:
+                self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "gateway": self.name,
+            "circuit": self.breaker.state,
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "errors": self.errors,
+            "declines": self.declines,
+            "rejected": self.rejected,
+            "hedges": self.hedges,
+            "error_rate": self.errors / self.calls if self.calls else 0.0,
+        }
+
+
+GATEWAYS: dict[str, GatewayAdapter] = {}
+
+
+def register_gateway(gateway: PaymentGateway) -> GatewayAdapter:
+    """
+    Adds a gateway to the registry, so orders can select it by name.
+
+    The gateway gets the limits of the gateway_* settings, overridden by its entry in
+    `gateway_overrides`, e.g. {"stripe": {"concurrency": 50, "timeout": 5}}.
+
+    Returns:
+        GatewayAdapter: The adapter the gateway is called through.
+    """
+    settings = {
+        "concurrency": Evariable.gateway_concurrency,
+        "timeout": Evariable.gateway_timeout,
+        "hedge_delay": Evariable.gateway_hedge_delay,
+        "breaker_failures": Evariable.gateway_breaker_failures,
+        "breaker_reset": Evariable.gateway_breaker_reset,
+    }
+    settings.update(Evariable.gateway_overrides.get(gateway.name, {}))
+    adapter = GATEWAYS[gateway.name] = GatewayAdapter(
+        gateway, concurrency=int(settings["concurrency"]), timeout=settings["timeout"], hedge_delay=settings["hedge_delay"],
+        breaker_failures=int(settings["breaker_failures"]), breaker_reset=settings["breaker_reset"])
+    logger.info("Payment gateway registered | gateway : %s | settings : %s", gateway.name, settings)
+    return adapter
+
+
+def get_gateway(name: str | None) -> GatewayAdapter:
+    """
+    Returns the adapter of a registered gateway, the `default_payment_gateway` when no name is given.
+
+    Raises:
+        KeyError: If no gateway is registered under the name.
+    """
+    return GATEWAYS[name or Evariable.default_payment_gateway]
+
+
+register_gateway(SimulatedGateway())
@@ -0,0 +1,55 @@
+"""
+HTTP validators for conditional GET requests.
+
+Responses carry an ETag, and a Last-Modified date when one is known; a request whose
+If-None-Match, or failing that If-Modified-Since, shows the client already holds the
+current representation is answered with 304 Not Modified and no body.
+"""
+import email.utils
+import time
+from fastapi import Request , Response , status
+
+
+def is_conditional(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """
+    Compares an If-None-Match header with an ETag, weakly as RFC 9110 requires for it.
+    """
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag.removeprefix("W/") for tag in header.split(","))
+
+
+def is_not_modified(request: Request, etag: str, last_modified: float | None) -> bool:
+    """
+    Tells whether the client already holds the representation with this ETag and modification time.
+    If-Modified-Since is only looked at when the request carries no If-None-Match, and never
+    answers 304 for a representation modified in the current second.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # dates have one-second precision: a second write in the current second would keep the date
+        return int(last_modified) <= since and int(last_modified) < int(time.time())
+    return False
+
+
+def validator_headers(etag: str, last_modified: float | None, cache_control: str) -> dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified:
+        headers["Last-Modified"] = email.utils.formatdate(last_modified, usegmt=True)
+    return headers
+
+
+def not_modified(headers: dict[str, str]) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import json
+import logging
+from fastapi import HTTPException , Response , status
+from ..schema.payment import Payment
+from .config import Evariable
+from .metrics import idempotent_requests
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+# Failures that stay the same however often the request is retried; the key is released after any other one,
+# since a product may be restocked or created and a rejected or timed out order may get through later.
+CACHED_ERROR_STATUS = {status.HTTP_422_UNPROCESSABLE_ENTITY}
+
+# Requests of this process that are being handled, so duplicates arriving here wait without polling Redis.
+in_flight: dict[str, asyncio.Future] = {}
+
+
+def idempotency_key(scope: str, key: str) -> str:
+    return Payment.payments_key("idempotency", scope, key)
+
+
+def fingerprint(payload: str) -> str:
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def run_idempotent(scope: str, key: str, payload: str, handler, response: Response) -> dict:
+    """
+    Runs a request handler at most once per idempotency key and replays its outcome to retries.
+
+    The first request claims the key with SET NX and runs the handler; its response, or its
+    validation error, is cached for `idempotency_ttl` seconds, and any other error releases the
+    key for a retry. Duplicates that arrive while it runs wait for that outcome, and later ones
+    are answered from the cache without touching admission control, the broker or the payment
+    workers. Replayed responses carry an 'Idempotent-Replayed: true' header.
+
+    Args:
+        scope (str): The endpoint the key belongs to, so the same key can be used on different endpoints.
+        key (str): The value of the Idempotency-Key header.
+        payload (str): The request body; reusing a key with a different body is rejected.
+        handler: Coroutine function running the request and returning the response body.
+        response (Response): The response of the endpoint, used to mark replays.
+
+    Returns:
+        dict: The response body.
+
+    Raises:
+        HTTPException:
+            - The cached error of the first request, when it failed.
+            - 409 CONFLICT: If the first request with the key is still running after `idempotency_wait_timeout`.
+            - 422 UNPROCESSABLE ENTITY: If the key was used with a different request body or is too long.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters long",
+                            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    redis_key = idempotency_key(scope, key)
+    request_fingerprint = fingerprint(payload)
+    db = Payment.db()
+
+    while True:
+        local = in_flight.get(redis_key)
+        if local is not None:
+            record = await asyncio.shield(local)
+        elif await db.set(redis_key, json.dumps({"state": "pending", "fingerprint": request_fingerprint}),
+                          nx=True, ex=Evariable.idempotency_lock_ttl):
+            idempotent_requests.labels(scope, "executed").inc()
+            return await execute(redis_key, request_fingerprint, handler)
+        else:
+            record = await wait_for_record(redis_key, request_fingerprint)
+
+        # no record means the first request failed in a way worth retrying, so claim the key again
+        if record is not None:
+            idempotent_requests.labels(scope, "replayed").inc()
+            return replay(record, request_fingerprint, response)
+
+
+async def execute(redis_key: str, request_fingerprint: str, handler) -> dict:
+    future = in_flight[redis_key] = asyncio.get_running_loop().create_future()
+    record = None
+    try:
+        body = await handler()
+        record = {"state": "done", "fingerprint": request_fingerprint, "status_code": status.HTTP_201_CREATED, "body": body}
+        return body
+
+    except HTTPException as E:
+        if E.status_code in CACHED_ERROR_STATUS:
+            record = {"state": "done", "fingerprint": request_fingerprint, "status_code": E.status_code, "detail": E.detail}
+        raise
+
+    finally:
+        del in_flight[redis_key]
+        future.set_result(record)
+        if record is None:
+            await Payment.db().delete(redis_key)
+        else:
+            await Payment.db().set(redis_key, json.dumps(record), ex=Evariable.idempotency_ttl)
+
+
+async def wait_for_record(redis_key: str, request_fingerprint: str) -> dict | None:
+    """
+    Polls for the outcome of a request another process is running with the same key.
+
+    Returns:
+        dict | None: The cached outcome, or None if the key was released.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + Evariable.idempotency_wait_timeout
+    delay = 0.01
+    while True:
+        value = await Payment.db().get(redis_key)
+        if value is None:
+            return None
+        record = json.loads(value)
+        if record["fingerprint"] != request_fingerprint:
+            raise HTTPException(detail="Idempotency-Key was already used with a different request",
+                                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if record["state"] == "done":
+            return record
+
+        if loop.time() + delay > deadline:
+            logger.warning("Gave up waiting for the request holding idempotency key %s", redis_key)
+            raise HTTPException(detail="A request with this Idempotency-Key is still being processed",
+                                status_code=status.HTTP_409_CONFLICT, headers={"Retry-After": "1"})
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+
+def replay(record: dict, request_fingerprint: str, response: Response) -> dict:
+    if record["fingerprint"] != request_fingerprint:
+        raise HTTPException(detail="Idempotency-Key was already used with a different request",
+                            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if "detail" in record:
+        raise HTTPException(detail=record["detail"], status_code=record["status_code"],
+                            headers={"Idempotent-Replayed": "true"})
+    response.headers["Idempotent-Replayed"] = "true"
+    return record["body"]
@@ -1,9 +1,21 @@
-
+import atexit
+import datetime
+import json
+import logging
+import queue
+import random
 from logging.config import dictConfig
+from logging.handlers import QueueHandler , QueueListener
+from .config import Evariable
+from .metrics import log_records_dropped , log_records_sampled
 
 
 def configure_logging() -> None:
-    dictConfig({
+    """
+    Sets up the log files. Unless `log_queue_enabled` is off, the event loop only queues records
+    and a background thread formats and writes them; `log_json` switches the files to JSON lines.
+    """
+    config = {
         'version': 1,
         'disable_existing_loggers': False,
         'formatters': {
@@ -73,6 +85,136 @@ def configure_logging() -> None:
                 'handlers': ['paymentGateway_file_handler'],
                 'level': 'INFO',
                 'propagate': False,
-            }
+            },
+            'webhook_logger': {
+                'handlers': ['info_file_handler'],
+                'level': 'INFO',
+                'propagate': False,
+            },
+            'archive_logger': {
+                'handlers': ['info_file_handler'],
+                'level': 'INFO',
+                'propagate': False,
+            },
         },
-    })
\ No newline at end of file
+    }
+
+    if Evariable.log_json:
+        config['formatters']['file'] = {'()': JsonLinesFormatter}
+
+    dictConfig(config)
+
+    if Evariable.log_queue_enabled:
+        install_log_queue(list(config['loggers']))
+
+
+class JsonLinesFormatter(logging.Formatter):
+
+    """
+    Formats a record as one JSON object per line, carrying any `extra` fields given to the log call.
+    """
+
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "destination"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self.RESERVED})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingQueueHandler(QueueHandler):
+
+    """
+    Hands records of one logger to the background listener without blocking the event loop.
+
+    Records below WARNING are sampled at the rate configured for their logger in
+    `log_sample_rates`. When the queue is full the record is dropped and counted instead of
+    waiting. Messages are formatted on the listener thread, so log calls should pass their
+    values as arguments rather than pre-formatted strings.
+    """
+
+    def __init__(self, log_queue: queue.Queue, destination: str, sample_rates: dict[str, float]) -> None:
+        super().__init__(log_queue)
+        self.destination = destination
+        self.sample_rates = sample_rates
+        self.dropped = 0
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            rate = self.sample_rates.get(record.name, self.sample_rates.get(self.destination, 1.0))
+            if rate < 1.0 and random.random() >= rate:
+                log_records_sampled.labels(self.destination).inc()
+                return False
+        return super().handle(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.destination = self.destination
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            log_records_dropped.labels(record.levelname).inc()
+
+
+class RoutingHandler(logging.Handler):
+
+    """
+    Runs on the listener thread and passes each record to the handlers of the logger it was logged to.
+    """
+
+    def __init__(self, routes: dict[str, list[logging.Handler]]) -> None:
+        super().__init__()
+        self.routes = routes
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        for handler in self.routes.get(record.destination, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+
+listener: QueueListener | None = None
+
+
+def install_log_queue(logger_names: list[str]) -> None:
+    """
+    Moves the handlers of the given loggers behind one bounded queue served by a background thread.
+    """
+    global listener
+    stop_logging()
+
+    log_queue: queue.Queue = queue.Queue(Evariable.log_queue_size)
+    routes = {}
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        routes[name] = list(logger.handlers)
+        for handler in routes[name]:
+            logger.removeHandler(handler)
+        logger.addHandler(SamplingQueueHandler(log_queue, name, Evariable.log_sample_rates))
+
+    listener = QueueListener(log_queue, RoutingHandler(routes))
+    listener.start()
+
+
+def stop_logging() -> None:
+    """
+    Writes out the queued records and stops the listener thread.
+    """
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+atexit.register(stop_logging)
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from fastapi import FastAPI , HTTPException
 from fastapi.exception_handlers import http_exception_handler
@@ -6,12 +7,18 @@ from aredis_om import get_redis_connection
 from aio_pika.exceptions import AMQPConnectionError
 from ..router.payment import payment_router
 from ..schema.payment import Payment
-from .config import Evariable
-from .publisher import Publisher
+from .config import Evariable , REDIS_DATA_URL
+from .publisher import start_publisher
+from .worker import start_payment_workers
+from .status_events import status_broker
+from .webhooks import start_webhook_dispatcher
+from .archive import start_payment_archiver , check_payment_archive
+from .search import ensure_payment_indexes
+from .metrics import MetricsMiddleware , instrument_redis , metrics_endpoint
 from .logging_config import configure_logging
 
-REDIS_DATA_URL = f"redis://{Evariable.redis_username}:{Evariable.redis_password}@{Evariable.redis_host}:{Evariable.redis_port}/{Evariable.redis_database}"
 redis = get_redis_connection(url=REDIS_DATA_URL , decode_responses=True)
+instrument_redis(redis)
 
 logger = logging.getLogger(__name__)
 logger_error = logging.getLogger('error_logger')
@@ -21,12 +28,18 @@ async def check_database_is_up(app: FastAPI):
     """
     Asynchronous context manager to check the connection status of Redis and RabbitMQ.
 
-    This function checks if Redis is available by pinging it and ensures a RabbitMQ
-    consumer is running. It raises a ConnectionError if either service is unreachable.
+    This function checks if Redis is available by pinging it and opens the AMQP channel
+    pool shared by every inventory request of the process. It raises a ConnectionError
+    if either service is unreachable.
+    Unless `payment_worker_embedded` is disabled, it also runs the payment worker pool,
+    the webhook dispatcher and the payment archiver in this process.
 
     """
     configure_logging()
     publisher = None
+    worker_pool = None
+    dispatcher = None
+    archiver = None
     
     try:
 
@@ -34,8 +47,19 @@ async def check_database_is_up(app: FastAPI):
         if not await redis.ping():
             raise ConnectionError("Unable to ping the Redis database!")
 
-        
-        publisher = await Publisher().connect()
+        # status reads fall back on the archive even when the archiver runs in another process
+        check_payment_archive()
+
+        publisher = await start_publisher()
+
+        await status_broker.start()
+
+        asyncio.create_task(ensure_payment_indexes())
+
+        if Evariable.payment_worker_embedded:
+            worker_pool = await start_payment_workers()
+            dispatcher = await start_webhook_dispatcher()
+            archiver = await start_payment_archiver()
 
         # If both checks pass, yield to continue execution
         yield
@@ -49,6 +73,13 @@ async def check_database_is_up(app: FastAPI):
         raise SystemExit(f"Cannot connect to the Redis database! Error: {redis_error}")
     
     finally:
+        if worker_pool:
+            await worker_pool.stop()
+        if dispatcher:
+            await dispatcher.stop()
+        if archiver:
+            await archiver.stop()
+        await status_broker.stop()
         if publisher:
             await publisher.close_connection()
 
@@ -57,6 +88,9 @@ app = FastAPI(lifespan=check_database_is_up)
 
 app.include_router(payment_router , prefix="/v1" ,tags=['Payment'])
 
+app.add_middleware(MetricsMiddleware)
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler_logging(request , exc):
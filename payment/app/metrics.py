@@ -0,0 +1,120 @@
+import time
+from prometheus_client import (CONTENT_TYPE_LATEST , CollectorRegistry , Counter , Gauge , Histogram , GCCollector ,
+                               PlatformCollector , ProcessCollector , generate_latest)
+from starlette.requests import Request
+from starlette.responses import Response
+
+# The service keeps its own registry, so it can share a process with the product service in benchmarks.
+registry = CollectorRegistry()
+ProcessCollector(registry=registry)
+PlatformCollector(registry=registry)
+GCCollector(registry=registry)
+
+# Buckets from 0.5ms up to 10s, shared by every latency histogram so they can be compared.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+http_request_duration = Histogram("http_request_duration_seconds", "Latency of HTTP requests by route.",
+                                  ["method", "route", "status"], buckets=LATENCY_BUCKETS, registry=registry)
+rpc_duration = Histogram("inventory_rpc_duration_seconds", "Round-trip time of inventory RPCs by method.",
+                         ["method"], buckets=LATENCY_BUCKETS, registry=registry)
+rpc_pending = Gauge("inventory_rpc_pending", "Inventory RPCs waiting for their reply.", registry=registry)
+rpc_timeouts = Counter("inventory_rpc_timeouts_total", "Inventory RPCs that got no reply in time, by method.", ["method"], registry=registry)
+rpc_not_found = Counter("inventory_rpc_not_found_total", "Inventory RPCs answered with NOT FOUND, by method.", ["method"], registry=registry)
+amqp_publishes = Counter("amqp_channel_publishes_total", "Messages published, by pooled channel and outcome.",
+                         ["channel", "outcome"], registry=registry)
+amqp_replies = Counter("amqp_channel_replies_total", "RPC replies received, by pooled channel.", ["channel"], registry=registry)
+gateway_call_duration = Histogram("payment_gateway_call_duration_seconds", "Latency of payment gateway charges, hedged attempts included, by gateway.",
+                                  ["gateway"], buckets=LATENCY_BUCKETS, registry=registry)
+gateway_calls = Counter("payment_gateway_calls_total", "Payment gateway charges by gateway and outcome: ok, declined, error, timeout or rejected by the open circuit.",
+                        ["gateway", "outcome"], registry=registry)
+gateway_hedges = Counter("payment_gateway_hedges_total", "Hedged second attempts started, by gateway.", ["gateway"], registry=registry)
+gateway_circuit_open = Gauge("payment_gateway_circuit_open", "1 while the circuit breaker of a gateway is open or half-open.", ["gateway"], registry=registry)
+log_records_dropped = Counter("log_records_dropped_total", "Log records dropped because the log queue was full, by level.",
+                              ["level"], registry=registry)
+log_records_sampled = Counter("log_records_sampled_out_total", "Log records skipped by per-logger sampling, by logger.",
+                              ["logger"], registry=registry)
+redis_command_duration = Histogram("redis_command_duration_seconds", "Latency of Redis commands, pipelines counted as one.",
+                                   ["command"], buckets=LATENCY_BUCKETS, registry=registry)
+admission_decisions = Counter("order_admission_decisions_total", "Order requests accepted or turned away with 429, by endpoint and reason.",
+                              ["endpoint", "outcome"], registry=registry)
+idempotent_requests = Counter("idempotent_requests_total", "Requests carrying an Idempotency-Key, by endpoint and whether they ran or were replayed.",
+                              ["endpoint", "outcome"], registry=registry)
+payments_in_flight = Gauge("payments_in_flight", "Payments being processed by the worker pool of this process.", registry=registry)
+payments_archived = Counter("payments_archived_total", "Finished payments moved from Redis to the archive.", registry=registry)
+payment_transitions_rejected = Counter("payment_transitions_rejected_total", "Payment status transitions rejected because another attempt already made them.",
+                                       registry=registry)
+payment_jobs_skipped = Counter("payment_jobs_skipped_total", "Payment jobs dropped without processing, by reason: finished, owned by a live worker or duplicate.",
+                               ["reason"], registry=registry)
+payment_transitions = Counter("payment_transitions_total", "Payment status transitions made by this process, by the status entered; 'pending' counts payments created.",
+                              ["status"], registry=registry)
+
+
+class MetricsMiddleware:
+
+    """
+    ASGI middleware recording the latency of every HTTP request under its route template,
+    so '/v1/check_order/{order_id}' is one series however many orders there are.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            http_request_duration.labels(scope["method"], route.path if route else "unmatched", status).observe(
+                time.perf_counter() - started)
+
+
+def instrument_redis(client) -> None:
+    """
+    Times every command and pipeline sent through a Redis client.
+
+    Args:
+        client: The redis.asyncio client to instrument. Pub/sub connections are not covered.
+    """
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    async def timed_execute_command(*args, **options):
+        started = time.perf_counter()
+        try:
+            return await execute_command(*args, **options)
+        finally:
+            redis_command_duration.labels(str(args[0]).split(" ")[0].upper()).observe(time.perf_counter() - started)
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def timed_execute(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await execute(*args, **kwargs)
+            finally:
+                redis_command_duration.labels("PIPELINE").observe(time.perf_counter() - started)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    client.execute_command = timed_execute_command
+    client.pipeline = timed_pipeline
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
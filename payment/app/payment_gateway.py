@@ -1,43 +1,86 @@
-import asyncio
 import logging
 from fastapi import HTTPException , status
+from .gateways import get_gateway , GatewayError
 from .publisher import message_to_inventory
+from .status_events import publish_status
+from .webhooks import enqueue_webhook_event
+from .metrics import payment_transitions
 
 logger = logging.getLogger("payment_gateway")
 
-async def process_payment(new_payment) -> None:
+async def process_payment(new_payment, worker_id: str) -> None:
 
     """
-    Background task to handle payment processing.
+    Payment worker job to handle payment processing.
 
-    This function is triggered after an order is placed. It simulates the time taken 
-    for payment to be processed by waiting for 5 seconds (using asyncio.sleep).
-    You can easily modify this function to connect to any gateway you want. Just make sure to change "PaymentGatewayName" accordingly and logging
+    This function is run by the payment worker pool after an order is placed. It charges the payment
+    through the gateway chosen with the order (see `gateways.py`; register an adapter there to
+    connect another gateway), then commits the reserved stock with the inventory service.
     
     Args:
     new_payment (Payment): The payment object which contains details of the transaction 
-    like product ID, quantity, and total price.
+    like product ID (or the line items of a cart), quantity, and total price.
+    worker_id (str): The worker pool running the payment, recorded as its owner while it is 'processing'.
 
     Raises:
+    GatewayError: If the gateway declined or failed the payment, or its circuit is open; the payment is failed.
     HTTPException: If there is an error while interacting with the inventory service, 
     a 500 Internal Server Error is raised with a message asking the user to retry.
     """
 
-    PaymentGatewayName = "XXX"
+    gateway = get_gateway(new_payment.Payment_Gateway)
 
-    await new_payment.update(Payment_Gateway = PaymentGatewayName) 
-    await asyncio.sleep(10)
+    # a payment already 'processing' was claimed from a pool that died after calling the gateway, so it is resumed;
+    # the gateway charges once per idempotency key and the inventory commits once per order
+    if new_payment.status == "pending":
+        await new_payment.transition("processing", Payment_Gateway = gateway.name, Worker_id = worker_id)
+        payment_transitions.labels("processing").inc()
+    try :
+        await gateway.charge(new_payment)
+    except GatewayError as E :
+        logger.warning('The payment failed | gateway : %s | order_id : %s | Error: %s', gateway.name, new_payment.pk, E)
+        await finish_payment(new_payment, "Failed")
+        raise
     logger.info('The payment was successful')
     subtract_message = {
         "method":"subtract",
-        "product_id":new_payment.Product_id, 
-        "Quantity": new_payment.Quantity}
+        "order_id":new_payment.pk,
+        "items":new_payment.items()}
     
     try : 
         await message_to_inventory(subtract_message)
     except Exception :
         logger.critical('sending message to inventory failed , so updating inventory failed')
-        await new_payment.update(status = "Failed")
+        await finish_payment(new_payment, "Failed")
         raise HTTPException(detail="something went wrong!!! Try again in a few minutes", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    await new_payment.update(status = "Completed")
\ No newline at end of file
+    await finish_payment(new_payment, "Completed")
+
+
+async def finish_payment(new_payment, final_status: str) -> None:
+    """
+    Moves a payment to its final status and announces it to status waiters and webhook endpoints.
+
+    The stock reserved for a failed payment is released right away, so it does not stay held until
+    the reservation expires; the release is best effort, and the reservation sweeper of the inventory
+    service returns the stock should it not get through.
+
+    Raises:
+    InvalidTransitionError: If another attempt already finished the payment; nothing is announced then.
+    """
+    await new_payment.transition(final_status)
+    if final_status == "Failed":
+        await release_stock(new_payment)
+    await publish_status(new_payment.pk, final_status)
+    payment_transitions.labels(final_status).inc()
+    await enqueue_webhook_event(new_payment)
+
+
+async def release_stock(new_payment) -> None:
+    """
+    Asks the inventory service to release the stock reserved for a payment, logging instead of raising on failure.
+    """
+    try:
+        await message_to_inventory({"method": "release", "order_id": new_payment.pk})
+    except Exception as E:
+        logger.warning('Releasing the reservation failed, it is left to expire | order_id : %s | Error: %s', new_payment.pk, E)
@@ -1,160 +1,384 @@
 import asyncio
-import json
+import time
 import uuid
+import zlib
 import logging    
 from typing import MutableMapping
 from .config import Evariable
-from aio_pika import Message, connect
-from aio_pika.abc import AbstractChannel, AbstractConnection, AbstractIncomingMessage, AbstractQueue
+from .cache import product_cache , subscribe_product_events , NOT_FOUND
+from .amqp import ChannelPool , DIRECT_REPLY_TO
+from .codec import decode , encode , NOT_FOUND as NOT_FOUND_REPLY , INSUFFICIENT_INVENTORY
+from .metrics import rpc_duration , rpc_pending , rpc_timeouts , rpc_not_found
+from aio_pika import ExchangeType, Message
+from aio_pika.abc import AbstractIncomingMessage
 
 logger = logging.getLogger("publisher_logger") 
 
+INVENTORY_EXCHANGE = "inventory"
+
+
+class InsufficientInventoryError(Exception):
+    """
+    Raised when the inventory cannot hold the requested quantity for an order.
+    """
+
+
+class ReplyDecodeError(Exception):
+    """
+    Raised when a reply of the inventory service cannot be decoded or is not a reply object.
+
+    It is deliberately not a ValueError, which callers take as NOT FOUND.
+    """
+
+
+def partition_of(value: dict) -> int:
+    """
+    Picks the inventory partition a request is routed to.
+
+    Requests about a single product go to the partition of that product, so the product service
+    handles them in order; requests spanning several products go by order ID, or by their first
+    product for batched reads.
+
+    This is a deliberate limitation: a multi-item reserve or subtract is not ordered with the
+    single-product requests of its products, which may sit in other partitions. Splitting it
+    per product would give up its all-or-nothing semantics, and ordering is not needed for
+    correctness, since every stock change is a single atomic script in Redis that checks the
+    levels it changes. What is not guaranteed is the order in which such requests, sent
+    concurrently, are applied.
+
+    Args:
+        value (dict): The inventory request.
+
+    Returns:
+        int: The partition, between 0 and `inventory_partitions` - 1.
+    """
+    key = value.get("product_id")
+    if key is None and len(value.get("items", ())) == 1:
+        key = value["items"][0]["product_id"]
+    if key is None:
+        key = value.get("order_id") or next(iter(value.get("product_ids", ())), "")
+    return zlib.crc32(key.encode()) % Evariable.inventory_partitions
+
+
+# Exceptions raised for the error codes of inventory replies; unknown codes raise a plain Exception.
+REPLY_ERRORS = {NOT_FOUND_REPLY: ValueError, INSUFFICIENT_INVENTORY: InsufficientInventoryError}
+
+
 class Publisher:
 
     """
     A Publisher class to send and receive messages via RabbitMQ using aio-pika.
     This class handles request/response communication with the message queue.
-    """
-
-    connection: AbstractConnection
-    channel: AbstractChannel
-    callback_queue: AbstractQueue
 
+    Requests are spread over the channels of a ChannelPool and their replies come back
+    through RabbitMQ direct reply-to on the channel each request was published on.
+    """
 
-    def __init__(self) -> None:
+    def __init__(self, pool: ChannelPool) -> None:
+        self.pool = pool
         self.futures: MutableMapping[str, asyncio.Future] = {}
+        self.read_futures: MutableMapping[str, asyncio.Future] = {}
+        self.read_batch: list[str] = []
+        self.read_flush_handle: asyncio.TimerHandle | None = None
+        self.read_tasks: set[asyncio.Task] = set()
         logger.info("Publisher initialized with empty futures dictionary.")
 
     async def connect(self) -> "Publisher":
         """
-        Connects to the RabbitMQ server and sets up the callback queue for responses.
+        Sets up the reply consumer on every channel of the pool and subscribes to product change events.
 
         Returns:
-            Publisher: The instance of the Publisher after connection is established.
+            Publisher: The instance of the Publisher once it can send requests.
         """
-        logger.debug("Attempting to connect to RabbitMQ server.")
-        self.connection = await connect(f"amqp://{Evariable.RabbitMQ_user}:{Evariable.RabbitMQ_password}@{Evariable.RabbitMQ_host}:{Evariable.RabbitMQ_port}/")
-        self.channel = await self.connection.channel()
-        self.callback_queue = await self.channel.declare_queue(exclusive=True)
-        await self.callback_queue.consume(self.on_response, no_ack=True)
-        logger.info("Connected to RabbitMQ server and callback queue set up.")
+        await self.pool.declare_exchange(INVENTORY_EXCHANGE, ExchangeType.DIRECT)
+        for channel in self.pool.channels:
+            await channel.consume_replies(self.on_response)
+        await subscribe_product_events(self.pool.channels[0].channel)
+        # events published while the connection was down are lost, so cached products cannot be trusted
+        self.pool.connection.reconnect_callbacks.add(self.on_reconnect)
+        logger.info("Publisher reply consumers set up on %s channel(s).", len(self.pool.channels))
         return self
 
-    async def on_response(self, message: AbstractIncomingMessage) -> str|None:
+    def on_reconnect(self, connection) -> None:
+        logger.warning("RabbitMQ connection restored, clearing the product cache.")
+        product_cache.clear()
+
+    async def on_response(self, message: AbstractIncomingMessage) -> None:
         """
-        Callback function that processes incoming responses to published messages.
+        Callback function that decodes incoming responses and resolves the future of the request they answer.
+
+        A reply carrying an error resolves the future with the matching exception: ValueError for
+        NOT_FOUND, InsufficientInventoryError for INSUFFICIENT_INVENTORY. A reply that cannot be
+        decoded, or is not an object with a result or an error, resolves it with ReplyDecodeError.
 
         Args:
             message (AbstractIncomingMessage): The incoming message from RabbitMQ.
-
-        Returns:
-            str | None: The decoded response body, or None if no correlation ID exists.
         """
         if message.correlation_id is None:
             logger.warning("Received message without a correlation ID.")
             return 
-        
-        future: asyncio.Future = self.futures.pop(message.correlation_id)
-        logger.debug(f"Processing response with correlation ID: {message.correlation_id}")
-        future.set_result(message.body.decode())
 
-        if message.body.decode() == "NOT FOUND":
-            logger.warning("Received 'NOT FOUND' response. Cancelling future.")
-            future.cancel()
+        future: asyncio.Future | None = self.futures.pop(message.correlation_id, None)
+        if future is None or future.done():
+            logger.warning("Received a late response for correlation ID: %s", message.correlation_id, extra={"correlation_id": message.correlation_id})
+            return
+        logger.debug("Processing response with correlation ID: %s", message.correlation_id, extra={"correlation_id": message.correlation_id})
+
+        try:
+            reply = decode(message.body, message.content_type)
+        except Exception as error:
+            future.set_exception(ReplyDecodeError(f"Undecodable reply: {error}"))
+            return
+        if not isinstance(reply, dict) or ("error" not in reply and "result" not in reply):
+            future.set_exception(ReplyDecodeError(f"Malformed reply of type {type(reply).__name__}"))
+            return
+
+        code = reply.get("error")
+        if code is None:
+            future.set_result(reply["result"])
+        else:
+            future.set_exception(REPLY_ERRORS.get(code, Exception)(reply.get("message", code)))
 
-    async def call(self, value: dict) -> dict|None:
+    async def call(self, value: dict) -> dict|str:
         """
         Sends a message to RabbitMQ and waits for a response.
 
+        The message is encoded with the codec of `rpc_content_type`; the reply comes back in the same format.
+
         Args:
             value (dict): The data to be sent in the message.
 
         Returns:
-            dict | None: The response data if available, or None if no valid response is returned.
+            dict | str: The result of the request.
         
         Raises:
             asyncio.TimeoutError: If the request times out.
             ValueError: If the product is not found.
+            InsufficientInventoryError: If there is not enough stock for the request.
+            ReplyDecodeError: If the reply cannot be decoded.
         """
         correlation_id = str(uuid.uuid4())
+        started = time.perf_counter()
         loop = asyncio.get_running_loop()
         future = loop.create_future()
 
         self.futures[correlation_id] = future
-        logger.info(f"Sending message with correlation ID: {correlation_id}")
+        logger.info("Sending message with correlation ID: %s", correlation_id, extra={"correlation_id": correlation_id})
 
-        await self.channel.default_exchange.publish(
-            Message(json.dumps(value).encode(),       #use json.dumps to pass a valid JSON STRING
-                    content_type="text/plain", correlation_id=correlation_id, reply_to=self.callback_queue.name),
-            routing_key="read")
-        
+        try:
+            await self.pool.channel().publish(
+                Message(encode(value, Evariable.rpc_content_type),
+                        content_type=Evariable.rpc_content_type, correlation_id=correlation_id, reply_to=DIRECT_REPLY_TO),
+                routing_key=str(partition_of(value)), exchange=INVENTORY_EXCHANGE)
+        except Exception:
+            self.futures.pop(correlation_id, None)
+            raise
 
         try:
             response = await asyncio.wait_for(future, 10)
-            logger.info(f"Received response for correlation ID: {correlation_id}")
+            logger.info("Received response for correlation ID: %s", correlation_id, extra={"correlation_id": correlation_id})
             
         except asyncio.TimeoutError:
-            logger.error(f"Timeout while waiting for response for correlation ID: {correlation_id}")
-            del self.futures[correlation_id]  
+            logger.error("Timeout while waiting for response for correlation ID: %s", correlation_id, extra={"correlation_id": correlation_id})
+            self.futures.pop(correlation_id, None)
+            rpc_timeouts.labels(value["method"]).inc()
             raise asyncio.TimeoutError
         
-        except asyncio.CancelledError:
-            logger.error(f"Request cancelled for correlation ID: {correlation_id}")
-            raise ValueError
+        except ValueError:
+            logger.error("Product not found for correlation ID: %s", correlation_id, extra={"correlation_id": correlation_id})
+            rpc_not_found.labels(value["method"]).inc()
+            raise
+
+        finally:
+            rpc_duration.labels(value["method"]).observe(time.perf_counter() - started)
         
         return response
 
+    async def read(self, product_id: str) -> dict:
+        """
+        Reads product information, coalescing concurrent reads into batched requests.
+
+        Concurrent reads for the same product share one in-flight request, and reads for
+        different products issued close together are sent as a single 'read_many' message.
+
+        Args:
+            product_id (str): The unique identifier of the product to read.
+
+        Returns:
+            dict: The product details.
+
+        Raises:
+            asyncio.TimeoutError: If the request times out.
+            ValueError: If the product is not found.
+        """
+        future = self.read_futures.get(product_id)
+
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self.read_futures[product_id] = future
+            self.read_batch.append(product_id)
+
+            if len(self.read_batch) >= Evariable.inventory_read_batch_size:
+                self.flush_reads()
+            elif self.read_flush_handle is None:
+                self.read_flush_handle = loop.call_later(Evariable.inventory_read_batch_window, self.flush_reads)
+        else:
+            logger.debug("Joining in-flight read for product_id: %s", product_id)
+
+        # shield the shared future so one cancelled caller does not cancel it for the others
+        return await asyncio.shield(future)
+
+    def flush_reads(self) -> None:
+        """
+        Sends the pending product reads as one 'read_many' message.
+        """
+        if self.read_flush_handle is not None:
+            self.read_flush_handle.cancel()
+            self.read_flush_handle = None
+
+        product_ids, self.read_batch = self.read_batch, []
+        if not product_ids:
+            return
+
+        task = asyncio.create_task(self.send_read_batch(product_ids))
+        self.read_tasks.add(task)
+        task.add_done_callback(self.read_tasks.discard)
+
+    async def send_read_batch(self, product_ids: list[str]) -> None:
+        """
+        Sends a batched read and resolves the waiting futures of every product in it.
+
+        Args:
+            product_ids (list[str]): The distinct product IDs to read.
+        """
+        logger.info("Sending batched read for %s product(s).", len(product_ids))
+
+        try:
+            products = await self.call({"method": "read_many", "product_ids": product_ids})
+        except Exception as error:
+            for product_id in product_ids:
+                future = self.read_futures.pop(product_id)
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for product_id in product_ids:
+            future = self.read_futures.pop(product_id)
+            if future.done():
+                continue
+            product = products.get(product_id)
+            if product is None:
+                rpc_not_found.labels("read_many").inc()
+                future.set_exception(ValueError('Product NOT found'))
+            else:
+                future.set_result(product)
+
     async def close_connection(self) -> None:
         """
         Closes the RabbitMQ connection.
         """
-        await self.connection.close()
+        global publisher
+        await self.pool.close()
+        if publisher is self:
+            publisher = None
         logger.info("RabbitMQ connection closed.")
 
 
 publisher: Publisher = None
 
+rpc_pending.set_function(lambda: len(publisher.futures) if publisher else 0)
+
+
+async def start_publisher() -> Publisher:
+    """
+    Opens the AMQP channel pool of this process and starts the publisher every inventory request goes through.
+    """
+    global publisher
+    pool = await ChannelPool(Evariable.amqp_channel_pool_size, Evariable.amqp_publisher_confirms,
+                             Evariable.amqp_confirm_window).connect()
+    publisher = await Publisher(pool).connect()
+    return publisher
+
 async def message_to_inventory(value: dict) -> dict:
     """
-    Communicates with the inventory system to either read product information or subtract inventory.
+    Communicates with the inventory system to read product information, reserve stock for an order,
+    release a reservation or subtract inventory.
 
     Args:
-        value (dict): The data containing the method (read/subtract) and product details.
+        value (dict): The data containing the method (read/reserve/release/subtract) and product details.
 
     Returns:
-        dict: The product details or confirmation of inventory subtraction.
+        dict: The product details or confirmation of the inventory operation.
 
     Raises:
         Exception: If something goes wrong during the subtract operation.
         ValueError: If the product is not found.
+        InsufficientInventoryError: If the stock cannot be reserved.
+        ReplyDecodeError: If the reply of the inventory system cannot be decoded.
         TimeoutError: If the request to the inventory system times out.
+        ConnectionError: If the publisher of this process has not been started.
     """
 
-    global publisher
-
-    if publisher is None or publisher.connection.is_closed == True:
-        publisher = await Publisher().connect()
+    if publisher is None:
+        logger.error("The publisher is not running, '%s' was not sent.", value["method"])
+        raise ConnectionError("The publisher is not running")
 
     match value["method"]:
         case "subtract":
 
-            response = await publisher.call(value)
-            if response is None:
-                logger.error("Error during 'subtract' operation: No response received.")
-                raise Exception('Something went wrong')
+            try:
+                response = await publisher.call(value)
+            except (ValueError, InsufficientInventoryError) as error:
+                logger.error("Error during 'subtract' operation: %s.", error)
+                raise Exception(f'Inventory was not updated: {error}')
             logger.info("'Subtract' operation successful.")
             return response
+
+        case "reserve":
+
+            try:
+                response = await publisher.call(value)
+            except TimeoutError:
+                logger.error("Timeout during 'reserve' operation.")
+                raise TimeoutError('The request is taking longer than expected to complete.')
+            except ValueError:
+                logger.error("Product not found in 'reserve' operation.")
+                raise ValueError('Product NOT found')
+            except InsufficientInventoryError:
+                logger.warning("Not enough inventory in 'reserve' operation.")
+                raise InsufficientInventoryError('Quantity requested is more than available inventory')
+            logger.info("'Reserve' operation successful.")
+            return response
+
+        case "release":
+
+            response = await publisher.call(value)
+            logger.info("'Release' operation finished: %s.", response)
+            return response
             
         case "read":
-          
+
+            cached = product_cache.get(value["product_id"])
+            if cached == NOT_FOUND:
+                logger.error("Product not found in 'read' operation (cached).")
+                raise ValueError('Product NOT found')
+            if cached is not None:
+                return cached
+
+            product_cache.start_read(value["product_id"])
+            response = None
             try:
-                response = await publisher.call(value)
+                response = await publisher.read(value["product_id"])
             except ValueError:
+                response = NOT_FOUND
                 logger.error("Product not found in 'read' operation.")
                 raise ValueError('Product NOT found')
             except TimeoutError:
                 logger.error("Timeout during 'read' operation.")
                 raise TimeoutError('The request is taking longer than expected to complete.')
+            finally:
+                product_cache.finish_read(value["product_id"], response)
 
             logger.info("'Read' operation successful.")
-            return json.loads(response)
+            return dict(response)
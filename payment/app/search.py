@@ -0,0 +1,148 @@
+import base64
+import binascii
+import logging
+from datetime import datetime
+from ..schema.payment import Payment
+from .config import Evariable
+
+logger = logging.getLogger(__name__)
+
+
+def encode_cursor(member: str) -> str:
+    return base64.urlsafe_b64encode(member.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> str:
+    """
+    Decodes a search cursor back into the index member it points at.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        return base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError) as error:
+        raise ValueError("invalid cursor") from error
+
+
+async def search_payments(limit: int, cursor: str | None = None, status: str | None = None, product_id: str | None = None,
+                          since: datetime | None = None, until: datetime | None = None) -> dict:
+    """
+    Finds one page of payments, newest purchase first, filtered by status, product and purchase time.
+
+    The page is read from the index of the product when one is given, from the index of the
+    status otherwise, and from the index of all payments without either. Every index is kept
+    in purchase time order, so the time range is a range of the index and the cost of a page
+    depends on its size, not on the number of payments. When both a product and a status are
+    given, the status is checked on the fetched payments; at most `payment_search_max_scan`
+    index entries are examined per page, so a page may come back short with a cursor to carry
+    on from.
+
+    Archived payments are no longer in the indexes.
+
+    Args:
+        limit (int): The maximum number of payments on the page.
+        cursor (str, optional): The `next_cursor` of the previous page.
+        status (str, optional): Only include payments in this status.
+        product_id (str, optional): Only include payments of this product, on their own or in a cart.
+        since (datetime, optional): Only include payments purchased at or after this time.
+        until (datetime, optional): Only include payments purchased at or before this time.
+
+    Returns:
+        dict: The payments of the page and the cursor of the next page, None on the last page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    if product_id:
+        index = Payment.index_key("product", product_id)
+    elif status:
+        index = Payment.index_key("status", status)
+    else:
+        index = Payment.index_key("time")
+
+    # members are "<time>:<pk>", and ';' sorts right after ':'
+    newest = f"[{Payment.time_key(until)};" if until is not None else "+"
+    oldest = f"[{Payment.time_key(since)}" if since is not None else "-"
+    if cursor:
+        newest = f"({decode_cursor(cursor)}"
+
+    db = Payment.db()
+    payments: list[dict] = []
+    scanned = 0
+    last_member = None
+
+    while len(payments) < limit and scanned < Evariable.payment_search_max_scan:
+        count = min(limit - len(payments), Evariable.payment_search_max_scan - scanned)
+        members = await db.zrevrangebylex(index, newest, oldest, start=0, num=count)
+        if not members:
+            last_member = None
+            break
+
+        async with db.pipeline(transaction=False) as pipe:
+            for member in members:
+                pipe.hgetall(Payment.make_primary_key(member.rsplit(":", 1)[1]))
+            documents = await pipe.execute()
+
+        for document in documents:
+            # payments archived since the page was read have expired from Redis
+            if not document:
+                continue
+            if status and document.get("status") != status:
+                continue
+            payments.append(Payment.model_validate(document).model_dump())
+
+        scanned += len(members)
+        last_member = members[-1]
+        newest = f"({last_member}"
+        if len(members) < count:
+            last_member = None
+            break
+
+    return {"payments": payments, "next_cursor": encode_cursor(last_member) if last_member else None}
+
+
+def indexes_built_key() -> str:
+    return Payment.index_key("built")
+
+
+async def ensure_payment_indexes() -> None:
+    """
+    Builds the search indexes from the payment keyspace unless a previous build completed, e.g. on the first start after an upgrade.
+
+    The completion marker is only written once every payment was indexed, so a build that was
+    interrupted runs again on the next start; payments written in the meantime index themselves.
+    """
+    db = Payment.db()
+    if await db.exists(indexes_built_key()):
+        return
+
+    logger.info("Building the payment search indexes")
+    indexed = 0
+    keys: list[str] = []
+
+    async def reindex(keys: list[str]) -> int:
+        async with db.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(key)
+            documents = await pipe.execute()
+
+        payments = [Payment.model_validate(document) for document in documents if "pk" in document]
+        async with db.pipeline(transaction=False) as pipe:
+            for payment in payments:
+                member = payment.index_member()
+                for index in payment.index_keys():
+                    pipe.zadd(index, {member: 0})
+            await pipe.execute()
+        return len(payments)
+
+    async for key in db.scan_iter(match=Payment.make_primary_key("*"), count=Evariable.payment_search_backfill_batch, _type="HASH"):
+        keys.append(key)
+        if len(keys) >= Evariable.payment_search_backfill_batch:
+            indexed += await reindex(keys)
+            keys = []
+    if keys:
+        indexed += await reindex(keys)
+    await db.set(indexes_built_key(), 1)
+
+    logger.info(f"Payment search indexes built | payments : {indexed}")
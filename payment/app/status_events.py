@@ -0,0 +1,222 @@
+import asyncio
+import datetime
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from ..schema.payment import Payment , FINAL_STATUSES
+from .config import Evariable
+from .archive import find_archived_payment
+
+logger = logging.getLogger(__name__)
+logger_error = logging.getLogger('error_logger')
+
+# Put on the queue of every waiter when the subscription was lost, since transitions may have been missed meanwhile.
+RESYNC = None
+
+
+def status_channel() -> str:
+    return Payment.payments_key("status")
+
+
+async def read_status(order_id: str) -> str | None:
+    """
+    Reads only the status field of an order, None if the order does not exist.
+    Orders that were moved out of Redis are read from the payment archive.
+    """
+    status = await Payment.db().hget(Payment.make_primary_key(order_id), "status")
+    if status is None:
+        archived = await find_archived_payment(order_id)
+        status = archived["status"] if archived else None
+    return status
+
+
+async def read_versioned_status(order_id: str) -> tuple[str, str, float | None] | None:
+    """
+    Reads the status of an order with its ETag and last modification time, in one HMGET.
+
+    Returns:
+        tuple[str, str, float | None] | None: The status, the ETag, built from the purchase time and
+        the version (0 for payments saved before versions were kept) so that it changes with every
+        transition and is never shared by two payments stored under one order ID, and the epoch time
+        of the last transition, or of the purchase if it had none; None if the order does not exist.
+    """
+    fields = await Payment.db().hmget(Payment.make_primary_key(order_id), "status", "Version", "Updated_at", "Purchase_time")
+    if fields[0] is None:
+        archived = await find_archived_payment(order_id)
+        if archived is None:
+            return None
+        fields = [archived.get(name) for name in ("status", "Version", "Updated_at", "Purchase_time")]
+
+    status, version, updated_at, purchase_time = fields
+    created = round(datetime.datetime.fromisoformat(purchase_time).timestamp() * 1000000) if purchase_time else 0
+    modified = updated_at or purchase_time
+    return status, f'"{created}-{int(version or 0)}"', datetime.datetime.fromisoformat(modified).timestamp() if modified else None
+
+
+async def publish_status(order_id: str, status: str) -> None:
+    """
+    Announces a status transition of an order to the API workers that have clients waiting on it.
+
+    Publishing is best effort: waiters re-read the status when their subscription is re-established.
+    """
+    try:
+        await Payment.db().publish(status_channel(), json.dumps({"order_id": order_id, "status": status}))
+    except Exception as E:
+        logger_error.error(f"Publishing order status failed | Order ID: {order_id} | Error: {E}")
+
+
+class StatusBroker:
+
+    """
+    Fans order status transitions out to the requests of this process that wait on them.
+
+    The process holds a single Redis pub/sub subscription however many clients are
+    waiting, and hands each transition to the waiters of that order only.
+    """
+
+    def __init__(self) -> None:
+        self.waiters: dict[str, set[asyncio.Queue]] = {}
+        self.task: asyncio.Task | None = None
+
+    async def start(self) -> "StatusBroker":
+        self.task = asyncio.create_task(self.listen())
+        return self
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def listen(self) -> None:
+        while True:
+            pubsub = Payment.db().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(status_channel())
+                self.broadcast(RESYNC)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as E:
+                logger_error.error(f"Order status subscription lost | Error: {E}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def dispatch(self, data: str) -> None:
+        try:
+            event = json.loads(data)
+            queues = self.waiters.get(event["order_id"], ())
+        except (ValueError, KeyError, TypeError):
+            logger_error.error(f"Malformed order status event: {data}")
+            return
+        for queue in queues:
+            queue.put_nowait(event["status"])
+
+    def broadcast(self, status: str | None) -> None:
+        for queues in self.waiters.values():
+            for queue in queues:
+                queue.put_nowait(status)
+
+    @asynccontextmanager
+    async def watch(self, order_id: str) -> AsyncIterator[asyncio.Queue]:
+        """
+        Registers a waiter for the status transitions of an order.
+
+        Register before reading the current status, so no transition can fall in between.
+
+        Yields:
+            asyncio.Queue: Receives each new status, or RESYNC when the status must be read again.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self.waiters.setdefault(order_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = self.waiters[order_id]
+            queues.discard(queue)
+            if not queues:
+                del self.waiters[order_id]
+
+
+status_broker = StatusBroker()
+
+
+async def next_status(order_id: str, updates: asyncio.Queue, current: str, timeout: float) -> str:
+    """
+    Waits until the status of an order differs from `current`.
+
+    Returns:
+        str: The new status, or `current` if it did not change within `timeout` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return current
+        try:
+            status = await asyncio.wait_for(updates.get(), remaining)
+        except asyncio.TimeoutError:
+            return current
+        if status is RESYNC:
+            status = await read_status(order_id) or current
+        if status != current:
+            return status
+
+
+async def wait_for_status_change(order_id: str, since: str | None, timeout: float) -> str | None:
+    """
+    Long-polls the status of an order.
+
+    Args:
+        order_id (str): The unique identifier of the order.
+        since (str, optional): The status the client already knows; defaults to the current status.
+        timeout (float): Seconds to wait for a change.
+
+    Returns:
+        str | None: The status once it differs from `since` or the wait timed out, None if the order does not exist.
+    """
+    async with status_broker.watch(order_id) as updates:
+        current = await read_status(order_id)
+        if current is None:
+            return None
+        if (since is not None and current != since) or current in FINAL_STATUSES:
+            return current
+        return await next_status(order_id, updates, current, timeout)
+
+
+def server_sent_event(status: str) -> str:
+    return f"event: status\ndata: {json.dumps({'message': status})}\n\n"
+
+
+async def stream_status(order_id: str) -> AsyncIterator[str]:
+    """
+    Streams the status of an order as Server-Sent Events until it is final.
+
+    The current status is sent first, then every transition. A comment line is sent every
+    `order_status_keepalive` seconds so proxies keep the connection open, and the stream is
+    closed after `order_status_stream_timeout` seconds; clients reconnect as with any SSE stream.
+
+    Yields:
+        str: The encoded events.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + Evariable.order_status_stream_timeout
+
+    async with status_broker.watch(order_id) as updates:
+        current = await read_status(order_id)
+        if current is None:
+            return
+        yield server_sent_event(current)
+
+        while current not in FINAL_STATUSES and loop.time() < deadline:
+            status = await next_status(order_id, updates, current, min(Evariable.order_status_keepalive, deadline - loop.time()))
+            if status == current:
+                yield ": keep-alive\n\n"
+                continue
+            current = status
+            yield server_sent_event(current)
@@ -0,0 +1,357 @@
+import asyncio
+import datetime
+import ipaddress
+import json
+import logging
+import random
+import socket
+import time
+import uuid
+from urllib.parse import urlsplit
+import httpx
+from ..schema.payment import Payment
+from .config import Evariable
+
+logger = logging.getLogger("webhook_logger")
+logger_error = logging.getLogger('error_logger')
+
+DEAD_LETTER_SIZE = 10000
+
+# Leases the deliveries that are due, so no other dispatcher takes them while they are being sent.
+# KEYS: schedule sorted set, deliveries hash. ARGV: now, lease seconds, limit.
+# Returns {delivery_id, delivery, ...}.
+CLAIM_DELIVERIES_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+local claimed = {}
+for _, id in ipairs(due) do
+    local delivery = redis.call('HGET', KEYS[2], id)
+    if delivery then
+        redis.call('ZADD', KEYS[1], tonumber(ARGV[1]) + tonumber(ARGV[2]), id)
+        claimed[#claimed + 1] = id
+        claimed[#claimed + 1] = delivery
+    else
+        redis.call('ZREM', KEYS[1], id)
+    end
+end
+return claimed
+"""
+
+
+WEBHOOK_SCHEMES = ("http", "https")
+
+
+def blocked_address(address: str) -> bool:
+    """
+    Tells whether an IP address is one webhooks must not be sent to: loopback, private, link-local
+    (cloud metadata services included), shared, reserved, multicast or unspecified.
+    """
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return not ip.is_global or ip.is_multicast
+
+
+def check_webhook_url(url: str) -> None:
+    """
+    Checks that a webhook URL uses http or https and does not name a local or internal host.
+
+    Host names are checked again once resolved, right before every delivery, which then connects
+    to the checked address. Both checks are skipped when `webhook_allow_private_hosts` is set.
+
+    Raises:
+        ValueError: If the URL may not receive webhooks.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in WEBHOOK_SCHEMES:
+        raise ValueError(f"Webhook URLs must use {' or '.join(WEBHOOK_SCHEMES)}")
+    host = (parts.hostname or "").rstrip(".")
+    if not host:
+        raise ValueError("Webhook URLs must name a host")
+    if Evariable.webhook_allow_private_hosts:
+        return
+    if host == "localhost" or host.endswith(".localhost"):
+        raise ValueError("Webhook URLs must not point at a local or internal address")
+    try:
+        blocked = blocked_address(host)
+    except ValueError:
+        return
+    if blocked:
+        raise ValueError("Webhook URLs must not point at a local or internal address")
+
+
+async def check_webhook_host(url: str) -> str | None:
+    """
+    Resolves the host of a webhook URL and checks every address it resolves to, so a public name
+    pointing at an internal address is refused as well.
+
+    Returns:
+        str | None: A checked address of the host, which the delivery must connect to rather than resolve
+        the name again, or None if the checks are skipped because `webhook_allow_private_hosts` is set.
+
+    Raises:
+        ValueError: If the URL may not receive webhooks or its host resolves to a blocked address.
+        OSError: If the host cannot be resolved.
+    """
+    check_webhook_url(url)
+    if Evariable.webhook_allow_private_hosts:
+        return None
+    parts = urlsplit(url)
+    addresses = await asyncio.get_running_loop().getaddrinfo(parts.hostname, parts.port or 443, type=socket.SOCK_STREAM)
+    if any(blocked_address(address[4][0]) for address in addresses):
+        raise ValueError(f"Webhook host {parts.hostname} resolves to a local or internal address")
+    return addresses[0][4][0].split("%", 1)[0]
+
+
+def pinned_request(url: str, address: str | None) -> tuple[httpx.URL, dict[str, str], dict[str, str]]:
+    """
+    Points a webhook request at a checked address of its host, so a DNS answer that changed since the
+    check (DNS rebinding) is never used; the Host header and the TLS server name stay those of the URL.
+
+    Returns:
+        tuple[httpx.URL, dict[str, str], dict[str, str]]: The URL to connect to, and the headers and
+        request extensions to send with it.
+    """
+    # pooled connections are keyed by address, so hosts sharing an address may share a connection
+    target = httpx.URL(url)
+    if address is None or target.host == address:
+        return target, {}, {}
+    return target.copy_with(host=address), {"Host": target.netloc.decode("ascii")}, {"sni_hostname": target.host}
+
+
+def endpoints_key() -> str:
+    return Payment.payments_key("webhooks")
+
+
+def deliveries_key() -> str:
+    return Payment.payments_key("webhooks", "deliveries")
+
+
+def schedule_key() -> str:
+    return Payment.payments_key("webhooks", "schedule")
+
+
+def dead_letter_key() -> str:
+    return Payment.payments_key("webhooks", "dead")
+
+
+async def enqueue_webhook_event(payment: Payment) -> int:
+    """
+    Queues a payment status event for every endpoint that should hear about it.
+
+    The event goes to the callback URL of the order and to every globally registered endpoint.
+    Deliveries are stored in Redis, so they survive restarts and are retried until they succeed
+    or run out of attempts.
+
+    Args:
+        payment (Payment): The payment whose final status is announced.
+
+    Returns:
+        int: The number of deliveries queued.
+    """
+    db = Payment.db()
+    urls = set(await db.smembers(endpoints_key()))
+    if payment.Callback_url:
+        urls.add(payment.Callback_url)
+    if not urls:
+        return 0
+
+    event = {
+        "id": f"{payment.pk}:{payment.status}",
+        "type": f"payment.{payment.status.lower()}",
+        "order_id": payment.pk,
+        "status": payment.status,
+        "total_price": payment.Total_price,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    async with db.pipeline(transaction=True) as pipe:
+        for url in urls:
+            delivery_id = uuid.uuid4().hex
+            pipe.hset(deliveries_key(), delivery_id, json.dumps({"url": url, "event": event, "attempt": 0}))
+            pipe.zadd(schedule_key(), {delivery_id: time.time()})
+        await pipe.execute()
+
+    if webhook_dispatcher is not None:
+        webhook_dispatcher.wake.set()
+    return len(urls)
+
+
+class WebhookDispatcher:
+
+    """
+    Sends queued webhook deliveries over a pooled HTTP client.
+
+    Due deliveries are leased from the schedule sorted set in Redis and grouped by endpoint;
+    up to `webhook_batch_size` events for the same endpoint go out in one POST, and at most
+    `webhook_endpoint_concurrency` POSTs are open per endpoint. A failed delivery is put back
+    on the schedule with exponential backoff, and dropped into a dead-letter list once it
+    has failed `webhook_max_attempts` times.
+
+    Every POST carries a JSON body of the form {"events": [...]}. Delivery is at least once;
+    receivers can recognise repeats by the event 'id'.
+    """
+
+    def __init__(self) -> None:
+        self.client: httpx.AsyncClient | None = None
+        self.script = None
+        self.task: asyncio.Task | None = None
+        self.sends: set[asyncio.Task] = set()
+        self.in_flight: set[str] = set()
+        self.endpoint_limits: dict[str, asyncio.Semaphore] = {}
+        self.wake = asyncio.Event()
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+
+    async def start(self) -> "WebhookDispatcher":
+        limits = httpx.Limits(max_connections=Evariable.webhook_max_connections,
+                              max_keepalive_connections=Evariable.webhook_max_connections)
+        self.client = httpx.AsyncClient(timeout=Evariable.webhook_timeout, limits=limits)
+        self.script = Payment.db().register_script(CLAIM_DELIVERIES_SCRIPT)
+        self.task = asyncio.create_task(self.run())
+        logger.info("Webhook dispatcher started")
+        return self
+
+    async def stop(self) -> None:
+        """
+        Stops the dispatcher. Deliveries that were being sent are retried once their lease runs out.
+        """
+        tasks = ([self.task] if self.task else []) + list(self.sends)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.task = None
+        if self.client:
+            await self.client.aclose()
+        logger.info("Webhook dispatcher stopped")
+
+    async def run(self) -> None:
+        while True:
+            try:
+                claimed = await self.claim()
+            except Exception as E:
+                logger_error.error(f"Claiming webhook deliveries failed | Error: {E}")
+                claimed = 0
+
+            if claimed < Evariable.webhook_claim_batch:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), Evariable.webhook_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def claim(self) -> int:
+        """
+        Leases the due deliveries and starts sending them.
+
+        Returns:
+            int: The number of deliveries leased.
+        """
+        # the lease covers a full send, plus the time spent waiting for a slot of the endpoint
+        lease = Evariable.webhook_timeout * 3
+        result = await self.script(keys=[schedule_key(), deliveries_key()],
+                                   args=[time.time(), lease, Evariable.webhook_claim_batch])
+
+        batches: dict[str, list[tuple[str, dict]]] = {}
+        for delivery_id, delivery in zip(result[::2], result[1::2]):
+            if delivery_id in self.in_flight:
+                continue
+            delivery = json.loads(delivery)
+            batches.setdefault(delivery["url"], []).append((delivery_id, delivery))
+
+        for url, deliveries in batches.items():
+            for i in range(0, len(deliveries), Evariable.webhook_batch_size):
+                batch = deliveries[i:i + Evariable.webhook_batch_size]
+                self.in_flight.update(delivery_id for delivery_id, _ in batch)
+                task = asyncio.create_task(self.send(url, batch))
+                self.sends.add(task)
+                task.add_done_callback(self.sends.discard)
+
+        return len(result) // 2
+
+    async def send(self, url: str, batch: list[tuple[str, dict]]) -> None:
+        limit = self.endpoint_limits.get(url)
+        if limit is None:
+            limit = self.endpoint_limits[url] = asyncio.Semaphore(Evariable.webhook_endpoint_concurrency)
+
+        try:
+            try:
+                address = await check_webhook_host(url)
+            except ValueError as E:
+                await self.retry(url, batch, str(E), give_up=True)
+                return
+            except OSError as E:
+                await self.retry(url, batch, f"{type(E).__name__}: {E}")
+                return
+
+            async with limit:
+                try:
+                    target, headers, extensions = pinned_request(url, address)
+                    response = await self.client.post(target, headers=headers, extensions=extensions,
+                                                      json={"events": [delivery["event"] for _, delivery in batch]})
+                    error = None if response.is_success else f"HTTP {response.status_code}"
+                except httpx.HTTPError as E:
+                    error = f"{type(E).__name__}: {E}"
+
+            if error is None:
+                await self.acknowledge(batch)
+            else:
+                await self.retry(url, batch, error)
+        except Exception as E:
+            logger_error.error(f"Webhook delivery bookkeeping failed | url : {url} | Error: {E}")
+        finally:
+            self.in_flight.difference_update(delivery_id for delivery_id, _ in batch)
+
+    async def acknowledge(self, batch: list[tuple[str, dict]]) -> None:
+        delivery_ids = [delivery_id for delivery_id, _ in batch]
+        async with Payment.db().pipeline(transaction=True) as pipe:
+            pipe.hdel(deliveries_key(), *delivery_ids)
+            pipe.zrem(schedule_key(), *delivery_ids)
+            await pipe.execute()
+        self.delivered += len(batch)
+
+    async def retry(self, url: str, batch: list[tuple[str, dict]], error: str, give_up: bool = False) -> None:
+        """
+        Reschedules a failed batch with exponential backoff and jitter, or dead-letters the deliveries that ran out
+        of attempts, or all of them if `give_up` is set.
+        """
+        now = time.time()
+        async with Payment.db().pipeline(transaction=True) as pipe:
+            for delivery_id, delivery in batch:
+                delivery["attempt"] += 1
+                if give_up or delivery["attempt"] >= Evariable.webhook_max_attempts:
+                    pipe.hdel(deliveries_key(), delivery_id)
+                    pipe.zrem(schedule_key(), delivery_id)
+                    pipe.lpush(dead_letter_key(), json.dumps({**delivery, "error": error}))
+                    pipe.ltrim(dead_letter_key(), 0, DEAD_LETTER_SIZE - 1)
+                    self.dead += 1
+                    logger_error.error(f"Webhook delivery gave up | url : {url} | event : {delivery['event']['id']} | Error: {error}")
+                    continue
+
+                delay = min(Evariable.webhook_backoff_base * 2 ** (delivery["attempt"] - 1), Evariable.webhook_backoff_max)
+                pipe.hset(deliveries_key(), delivery_id, json.dumps(delivery))
+                pipe.zadd(schedule_key(), {delivery_id: now + delay * random.uniform(0.5, 1.0)})
+                self.retried += 1
+            await pipe.execute()
+
+        logger.warning(f"Webhook delivery failed | url : {url} | events : {len(batch)} | Error: {error}")
+
+    async def stats(self) -> dict:
+        return {
+            "scheduled": await Payment.db().zcard(schedule_key()),
+            "in_flight": len(self.in_flight),
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "dead": self.dead,
+        }
+
+
+webhook_dispatcher: WebhookDispatcher | None = None
+
+
+async def start_webhook_dispatcher() -> WebhookDispatcher:
+    """
+    Starts the webhook dispatcher of this process.
+    """
+    global webhook_dispatcher
+    webhook_dispatcher = await WebhookDispatcher().start()
+    return webhook_dispatcher
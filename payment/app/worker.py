@@ -0,0 +1,352 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime
+from aredis_om import NotFoundError, get_redis_connection
+from ..schema.payment import Payment , InvalidTransitionError , FINAL_STATUSES , PAYMENT_TRANSITIONS
+from ..schema.payment_scripts import run_script , REQUEUE_SCRIPT
+from .config import Evariable, REDIS_DATA_URL
+from .payment_gateway import process_payment
+from .publisher import start_publisher
+from .webhooks import start_webhook_dispatcher
+from .archive import start_payment_archiver
+from .metrics import payments_in_flight , payment_transitions , payment_transitions_rejected , payment_jobs_skipped , instrument_redis
+from .logging_config import configure_logging
+
+logger = logging.getLogger("payment_gateway")
+logger_error = logging.getLogger('error_logger')
+
+HEARTBEAT_TTL = 30
+
+
+def jobs_key() -> str:
+    return Payment.payments_key("jobs")
+
+
+def queued_key() -> str:
+    return Payment.payments_key("jobs", "queued")
+
+
+def processing_key(worker_id: str) -> str:
+    return Payment.payments_key("jobs", "processing", worker_id)
+
+
+def heartbeat_key(worker_id: str) -> str:
+    return Payment.payments_key("workers", worker_id)
+
+
+async def enqueue_payment(new_payment: Payment) -> None:
+    """
+    Saves a new payment with its search index entries, starts its audit stream, queues it for processing
+    and marks it as queued in one atomic round trip.
+
+    Args:
+        new_payment (Payment): The payment to save and process.
+    """
+    async with Payment.db().pipeline(transaction=True) as pipe:
+        await new_payment.save(pipeline=pipe)
+        pipe.xadd(Payment.audit_key(new_payment.pk), {"from": "", "to": new_payment.status, "at": datetime.now().isoformat()})
+        pipe.lpush(jobs_key(), new_payment.pk)
+        pipe.sadd(queued_key(), new_payment.pk)
+        await pipe.execute()
+    payment_transitions.labels(new_payment.status).inc()
+
+
+class PaymentWorkerPool:
+
+    """
+    A pool of workers that process payments from the durable job queue in Redis.
+
+    Each pool moves the jobs it takes into its own processing list and keeps a heartbeat
+    alive, so jobs held by a pool that died can be put back on the queue. A payment stays in
+    the set of queued payments until its job has left a processing list, so on startup the
+    unfinished payments that are in no queue are recovered as well.
+    """
+
+    def __init__(self, concurrency: int) -> None:
+        self.concurrency = concurrency
+        self.worker_id = uuid.uuid4().hex
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tasks: list[asyncio.Task] = []
+        self.jobs: set[asyncio.Task] = set()
+        self.running: set[str] = set()
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.window_processed = 0
+        self.window_latency = 0.0
+        self.window_max_latency = 0.0
+        self.window_started = time.monotonic()
+
+    async def start(self) -> "PaymentWorkerPool":
+        """
+        Recovers interrupted and unfinished payments, then starts the workers.
+
+        Returns:
+            PaymentWorkerPool: The running pool.
+        """
+        await self.heartbeat()
+        await self.recover()
+        self.tasks = [asyncio.create_task(self.work()), asyncio.create_task(self.keep_alive())]
+        logger.info(f"Payment worker pool started | worker_id : {self.worker_id} | concurrency : {self.concurrency}")
+        return self
+
+    async def stop(self) -> None:
+        """
+        Stops the workers. Jobs that were interrupted stay in the processing list and are recovered on the next start.
+        """
+        tasks = self.tasks + list(self.jobs)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks = []
+        logger.info(f"Payment worker pool stopped | worker_id : {self.worker_id}")
+
+    async def heartbeat(self) -> None:
+        await Payment.db().set(heartbeat_key(self.worker_id), 1, ex=HEARTBEAT_TTL)
+
+    async def keep_alive(self) -> None:
+        while True:
+            await asyncio.sleep(min(HEARTBEAT_TTL / 3, Evariable.payment_worker_stats_interval))
+            try:
+                await self.heartbeat()
+            except Exception as E:
+                logger_error.error(f"Payment worker heartbeat failed | Error: {E}")
+
+            if time.monotonic() - self.window_started >= Evariable.payment_worker_stats_interval:
+                stats = await self.stats()
+                self.reset_window()
+                logger.info(f"Payment worker stats | queue_depth : {stats['queue_depth']} | in_flight : {stats['in_flight']} | "
+                            f"payments_per_sec : {stats['payments_per_sec']:.2f} | avg_latency_ms : {stats['avg_latency_ms']:.1f} | "
+                            f"max_latency_ms : {stats['max_latency_ms']:.1f} | processed : {stats['processed']} | failed : {stats['failed']}")
+
+    async def recover(self) -> None:
+        """
+        Puts the jobs of dead pools back on the queue and queues unfinished payments that are in no queue.
+
+        Only one pool runs the recovery at a time.
+        """
+        db = Payment.db()
+        lock = Payment.payments_key("jobs", "recovery")
+        if not await db.set(lock, self.worker_id, nx=True, ex=60):
+            return
+
+        try:
+            async for key in db.scan_iter(match=processing_key("*")):
+                owner = key.rsplit(":", 1)[-1]
+                if owner != self.worker_id and not await db.exists(heartbeat_key(owner)):
+                    moved = 0
+                    while await db.lmove(key, jobs_key(), "RIGHT", "LEFT"):
+                        moved += 1
+                    logger.warning(f"Recovered {moved} interrupted payment job(s) of worker {owner}")
+
+            recovered = 0
+            batch = []
+            async for key in db.scan_iter(match=Payment.make_primary_key("*"), count=1000):
+                batch.append(key)
+                if len(batch) >= 1000:
+                    recovered += await self.requeue_unfinished(batch)
+                    batch = []
+            if batch:
+                recovered += await self.requeue_unfinished(batch)
+
+            if recovered:
+                logger.warning(f"Recovered {recovered} unfinished payment(s) that were in no queue")
+
+        finally:
+            await db.delete(lock)
+
+    async def requeue_unfinished(self, keys: list[str]) -> int:
+        """
+        Queues the unfinished payments among the given keys that are not in the set of queued payments.
+
+        The check and the push happen in one script, so a payment that was enqueued, or whose job
+        is still running, is never queued a second time.
+        """
+        db = Payment.db()
+        async with db.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hmget(key, "pk", "status")
+            rows = await pipe.execute()
+
+        unfinished = [pk for pk, status in rows if status in PAYMENT_TRANSITIONS]
+        if not unfinished:
+            return 0
+        return await run_script(db, REQUEUE_SCRIPT, [queued_key(), jobs_key()], unfinished)
+
+    async def work(self) -> None:
+        """
+        Takes jobs off the queue whenever a slot of the pool is free and runs them.
+        """
+        db = Payment.db()
+        while True:
+            await self.semaphore.acquire()
+            try:
+                pk = await db.blmove(jobs_key(), processing_key(self.worker_id), 5, "RIGHT", "LEFT")
+            except Exception as E:
+                self.semaphore.release()
+                if isinstance(E, asyncio.CancelledError):
+                    raise
+                logger_error.error(f"Taking a payment job failed | Error: {E}")
+                await asyncio.sleep(1)
+                continue
+
+            if pk is None:
+                self.semaphore.release()
+                continue
+
+            job = asyncio.create_task(self.run(pk))
+            self.jobs.add(job)
+            job.add_done_callback(self.jobs.discard)
+
+    async def run(self, pk: str) -> None:
+        try:
+            self.in_flight += 1
+            started = time.monotonic()
+            failed = not await self.run_job(pk)
+            self.in_flight -= 1
+            self.record(time.monotonic() - started, failed)
+
+            async with Payment.db().pipeline(transaction=True) as pipe:
+                pipe.lrem(processing_key(self.worker_id), 1, pk)
+                # a duplicate job leaves the payment queued while the first one is still running
+                if pk not in self.running:
+                    pipe.srem(queued_key(), pk)
+                await pipe.execute()
+        finally:
+            self.semaphore.release()
+
+    async def run_job(self, pk: str) -> bool:
+        """
+        Processes one queued payment.
+
+        A payment found in 'processing' is only resumed once the pool that owns it stopped
+        sending heartbeats, and after it was claimed for this pool; jobs of payments that are
+        finished, owned by a live pool or already running here are dropped.
+
+        Args:
+            pk (str): The unique identifier of the payment.
+
+        Returns:
+            bool: True if the payment was processed successfully or needed no processing.
+        """
+        if pk in self.running:
+            logger.info(f"Skipping duplicate job of a payment this pool is processing | Payment ID: {pk}")
+            payment_jobs_skipped.labels("duplicate").inc()
+            return True
+
+        self.running.add(pk)
+        try:
+            return await self.process(pk)
+        finally:
+            self.running.discard(pk)
+
+    async def process(self, pk: str) -> bool:
+        try:
+            new_payment = await Payment.get(pk)
+        except NotFoundError:
+            logger_error.error(f"Queued payment does not exist | Payment ID: {pk}")
+            return False
+        except Exception as E:
+            logger_error.error(f"Loading queued payment failed | Payment ID: {pk} | Error: {E}")
+            return False
+
+        if new_payment.status in FINAL_STATUSES:
+            logger.info(f"Skipping payment that is already finished | Payment ID: {pk} | status : {new_payment.status}")
+            payment_jobs_skipped.labels("finished").inc()
+            return True
+        if new_payment.status == "processing":
+            owner = new_payment.Worker_id
+            if not await new_payment.claim(self.worker_id, heartbeat_key(owner or "")):
+                logger.info(f"Skipping payment another worker is processing | Payment ID: {pk} | worker_id : {owner}")
+                payment_jobs_skipped.labels("owned").inc()
+                return True
+            logger.warning(f"Resuming interrupted payment | Payment ID: {pk} | worker_id : {owner}")
+
+        try:
+            await process_payment(new_payment, self.worker_id)
+        except InvalidTransitionError as E:
+            logger.info(f"Payment was moved on by another attempt | Payment ID: {pk} | status : {E.current}")
+            payment_transitions_rejected.inc()
+            return True
+        except Exception as E:
+            logger_error.error(f"Payment processing failed | Payment ID: {pk} | Error: {E}")
+            return False
+        return True
+
+    def record(self, latency: float, failed: bool) -> None:
+        self.processed += 1
+        self.window_processed += 1
+        self.window_latency += latency
+        self.window_max_latency = max(self.window_max_latency, latency)
+        if failed:
+            self.failed += 1
+
+    async def stats(self) -> dict:
+        """
+        Returns the queue depth and the statistics of the current window, without starting a new one.
+        """
+        elapsed = max(time.monotonic() - self.window_started, 1e-9)
+        return {
+            "worker_id": self.worker_id,
+            "queue_depth": await Payment.db().llen(jobs_key()),
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+            "payments_per_sec": self.window_processed / elapsed,
+            "avg_latency_ms": self.window_latency / self.window_processed * 1000 if self.window_processed else 0.0,
+            "max_latency_ms": self.window_max_latency * 1000,
+        }
+
+    def reset_window(self) -> None:
+        """
+        Starts a new statistics window; done by the periodic stats log of the pool only.
+        """
+        self.window_processed = 0
+        self.window_latency = 0.0
+        self.window_max_latency = 0.0
+        self.window_started = time.monotonic()
+
+
+payment_worker_pool: PaymentWorkerPool | None = None
+
+payments_in_flight.set_function(lambda: payment_worker_pool.in_flight if payment_worker_pool else 0)
+
+
+async def start_payment_workers() -> PaymentWorkerPool:
+    """
+    Starts the payment worker pool of this process.
+    """
+    global payment_worker_pool
+    payment_worker_pool = await PaymentWorkerPool(Evariable.payment_worker_concurrency).start()
+    return payment_worker_pool
+
+
+async def main() -> None:
+    """
+    Runs a standalone payment worker process, with its own AMQP channel pool, webhook dispatcher and payment archiver, so payment execution scales separately from the HTTP tier.
+    """
+    configure_logging()
+    redis = get_redis_connection(url=REDIS_DATA_URL , decode_responses=True)
+    instrument_redis(redis)
+    Payment.Meta.database = redis
+    if not await redis.ping():
+        raise SystemExit("Cannot connect to the Redis database!")
+
+    publisher = await start_publisher()
+    pool = await start_payment_workers()
+    dispatcher = await start_webhook_dispatcher()
+    archiver = await start_payment_archiver()
+    try:
+        await asyncio.gather(*pool.tasks, dispatcher.task)
+    finally:
+        await pool.stop()
+        await dispatcher.stop()
+        if archiver:
+            await archiver.stop()
+        await publisher.close_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
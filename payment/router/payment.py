@@ -1,36 +1,77 @@
+import asyncio
 import datetime
+import json
 import logging
-from fastapi import APIRouter , HTTPException , status , BackgroundTasks
-from aredis_om import NotFoundError
-from ..schema.payment import Order , Payment
-from ..app.publisher import message_to_inventory
-from ..app.payment_gateway import process_payment
+from fastapi import APIRouter , HTTPException , status , Query , Header , Response , Request
+from fastapi.responses import StreamingResponse
+from ..schema.payment import Order , CartOrder , Payment , Webhook
+from ..app.publisher import message_to_inventory , InsufficientInventoryError , ReplyDecodeError
+from ..app import worker , webhooks , publisher
+from ..app.config import Evariable
+from ..app.status_events import read_status , read_versioned_status , wait_for_status_change , stream_status
+from ..app.idempotency import run_idempotent
+from ..app.gateways import GATEWAYS
+from ..app.admission import admit_order
+from ..app.http_cache import is_not_modified , validator_headers , not_modified
+from ..app.search import search_payments
 
 payment_router = APIRouter()
 
+# Order statuses change while a client polls them, so caches must always check the version with us.
+ORDER_CACHE_CONTROL = "private, no-cache"
+
 logger = logging.getLogger(__name__)
 
-@payment_router.post('/orders/' ,status_code=status.HTTP_201_CREATED )
-async def API_order_product(order:Order , background_tasks: BackgroundTasks):
+@payment_router.post('/orders/' ,status_code=status.HTTP_201_CREATED)
+async def API_order_product(order:Order , request:Request , response:Response , idempotency_key:str|None = Header(None)):
 
     """
-    Processes a new order and initiates the payment asynchronously.
+    Processes a new order, reserves its stock and queues the payment for the payment workers.
+
+    The stock is held against the order ID until the payment commits it; holds of
+    abandoned or failed payments expire and are released by the product service.
+
+    Clients may send an Idempotency-Key header to retry safely: every request with the same key
+    gets the outcome of the first one, and only the first one reserves stock and queues a payment.
 
     Args:
         order (Order): The order object containing details such as product ID and quantity.
-        background_tasks (BackgroundTasks): Used to handle the payment processing asynchronously in the background.
+        idempotency_key (str, optional): The Idempotency-Key header.
 
     Returns:
         dict: A dictionary with a success message and the order ID.
 
     Raises:
         HTTPException:
-            - 400 BAD REQUEST: If the requested quantity exceeds available inventory.
+            - 400 BAD REQUEST: If the requested quantity exceeds available inventory or cannot be reserved, or the gateway is unknown.
             - 404 NOT FOUND: If the product is not found in the inventory.
             - 408 REQUEST TIMEOUT: If the request to inventory takes too long.
+            - 409 CONFLICT: If a request with the same Idempotency-Key is still being processed.
+            - 422 UNPROCESSABLE ENTITY: If the Idempotency-Key was used with a different order, or the Callback_url may not receive webhooks.
+            - 429 TOO MANY REQUESTS: If the client or the service is over its order rate limit, or too many orders are in progress.
+    """
+    if idempotency_key is None:
+        return await admitted(request, lambda: place_order(order))
+    return await run_idempotent("orders", idempotency_key, order.model_dump_json(),
+                                lambda: admitted(request, lambda: place_order(order)), response)
+
+
+async def admitted(request:Request , place) -> dict:
+    """
+    Places an order once it passed admission control, holding its admission slot meanwhile.
+    """
+    async with admit_order(request):
+        return await place()
+
+
+async def place_order(order:Order) -> dict:
+    """
+    Reads the product, reserves the stock and queues the payment of a single product order.
     """
+    check_gateway(order.Gateway)
+    check_callback_url(order.Callback_url)
     try:
-        logger.info(f"Received order request: {order}")
+        logger.info("Received order request: %s", order)
         inventory_response = await message_to_inventory({
             "method": "read",
             "product_id": order.Product_id})
@@ -45,31 +86,184 @@ async def API_order_product(order:Order , background_tasks: BackgroundTasks):
             "Quantity": order.Quantity,
             "Total_price": total_price,
             "status": "pending" , 
-            "Payment_Gateway": None
+            "Payment_Gateway": order.Gateway,
+            "Callback_url": str(order.Callback_url) if order.Callback_url else None
         }
+        new_payment =  Payment(**payment_data)
+
+        await message_to_inventory({
+            "method": "reserve",
+            "order_id": new_payment.pk,
+            "product_id": order.Product_id,
+            "Quantity": order.Quantity})
+
+    except InsufficientInventoryError:
+        raise HTTPException(detail="Quantity requested is more than available inventory",status_code=status.HTTP_400_BAD_REQUEST)
     except ValueError:
         raise HTTPException(detail="Product not found!", status_code=status.HTTP_404_NOT_FOUND)
+    except ReplyDecodeError:
+        raise HTTPException(detail="The inventory system sent an unreadable reply.", status_code=status.HTTP_502_BAD_GATEWAY)
     except TimeoutError:
         raise HTTPException(detail="The request is taking longer than expected to complete.", status_code=status.HTTP_408_REQUEST_TIMEOUT)
 
-    
-    new_payment =  Payment(**payment_data)
-    await new_payment.save()
+    await worker.enqueue_payment(new_payment)
 
-    logger.info(f"Order processed successfully. Payment ID: {new_payment.pk}")
-    background_tasks.add_task(process_payment, new_payment)
-    logger.info(f"Payment processing for Payment ID: {new_payment.pk} added to background tasks.")
+    logger.info("Order processed successfully. Payment ID: %s", new_payment.pk)
+    logger.info("Payment processing for Payment ID: %s added to the payment queue.", new_payment.pk)
 
 
     return {"message": "Order processed" , "order_id" : new_payment.pk}
 
 
+def check_gateway(name: str | None) -> None:
+    if name is not None and name not in GATEWAYS:
+        raise HTTPException(detail=f"Unknown payment gateway '{name}'", status_code=status.HTTP_400_BAD_REQUEST)
+
+
+def check_callback_url(url) -> None:
+    if url is None:
+        return
+    try:
+        webhooks.check_webhook_url(str(url))
+    except ValueError as E:
+        raise HTTPException(detail=str(E), status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+
+@payment_router.post('/cart_orders/' ,status_code=status.HTTP_201_CREATED)
+async def API_order_cart(cart:CartOrder , request:Request , response:Response , idempotency_key:str|None = Header(None)):
+
+    """
+    Processes an order of several products, reserves all of them at once and queues a single
+    payment for the cart total.
+
+    All products are read with one batched inventory request and reserved all-or-nothing,
+    so either the whole cart is accepted or nothing is held.
+
+    Like single product orders, cart orders accept an Idempotency-Key header for safe retries.
+
+    Args:
+        cart (CartOrder): The line items of the order, each with a product ID and a quantity.
+        idempotency_key (str, optional): The Idempotency-Key header.
+
+    Returns:
+        dict: A dictionary with a success message and the order ID.
+
+    Raises:
+        HTTPException:
+            - 400 BAD REQUEST: If a requested quantity exceeds available inventory or cannot be reserved, or the gateway is unknown.
+            - 404 NOT FOUND: If a product is not found in the inventory.
+            - 408 REQUEST TIMEOUT: If the request to inventory takes too long.
+            - 409 CONFLICT: If a request with the same Idempotency-Key is still being processed.
+            - 422 UNPROCESSABLE ENTITY: If the Idempotency-Key was used with a different cart, or the Callback_url may not receive webhooks.
+            - 429 TOO MANY REQUESTS: If the client or the service is over its order rate limit, or too many orders are in progress.
+    """
+    if idempotency_key is None:
+        return await admitted(request, lambda: place_cart_order(cart))
+    return await run_idempotent("cart_orders", idempotency_key, cart.model_dump_json(),
+                                lambda: admitted(request, lambda: place_cart_order(cart)), response)
+
+
+async def place_cart_order(cart:CartOrder) -> dict:
+    """
+    Reads and reserves every product of a cart order and queues its payment.
+    """
+    check_gateway(cart.Gateway)
+    check_callback_url(cart.Callback_url)
+    items: dict[str, int] = {}
+    for item in cart.Items:
+        items[item.Product_id] = items.get(item.Product_id, 0) + item.Quantity
+
+    try:
+        logger.info("Received cart order request: %s", cart)
+        # reads issued together are coalesced into one batched inventory request
+        products = await asyncio.gather(*(
+            message_to_inventory({"method": "read", "product_id": product_id}) for product_id in items))
+
+        line_items = []
+        for product, (product_id, quantity) in zip(products, items.items()):
+            if int(product["Product_Inventory"]) < quantity:
+                raise HTTPException(detail=f"Quantity requested for product {product_id} is more than available inventory",status_code=status.HTTP_400_BAD_REQUEST)
+            line_items.append({"Product_id": product["pk"], "Quantity": quantity, "Unit_price": float(product["Product_Price"])})
+
+        new_payment = Payment(
+            Purchase_time=datetime.datetime.now(),
+            Quantity=sum(items.values()),
+            Total_price=sum(item["Quantity"] * item["Unit_price"] for item in line_items),
+            status="pending",
+            Payment_Gateway=cart.Gateway,
+            Line_items=json.dumps(line_items),
+            Callback_url=str(cart.Callback_url) if cart.Callback_url else None)
+
+        await message_to_inventory({
+            "method": "reserve",
+            "order_id": new_payment.pk,
+            "items": [{"product_id": product_id, "Quantity": quantity} for product_id, quantity in items.items()]})
+
+    except InsufficientInventoryError:
+        raise HTTPException(detail="Quantity requested is more than available inventory",status_code=status.HTTP_400_BAD_REQUEST)
+    except ValueError:
+        raise HTTPException(detail="Product not found!", status_code=status.HTTP_404_NOT_FOUND)
+    except ReplyDecodeError:
+        raise HTTPException(detail="The inventory system sent an unreadable reply.", status_code=status.HTTP_502_BAD_GATEWAY)
+    except TimeoutError:
+        raise HTTPException(detail="The request is taking longer than expected to complete.", status_code=status.HTTP_408_REQUEST_TIMEOUT)
+
+    await worker.enqueue_payment(new_payment)
+
+    logger.info("Cart order processed successfully. Payment ID: %s | line items : %s", new_payment.pk, len(line_items))
+
+    return {"message": "Order processed" , "order_id" : new_payment.pk}
+
+
+@payment_router.get('/payments')
+async def API_search_payments(limit:int = Query(20, ge=1, le=Evariable.payment_search_max_limit) ,
+                              cursor:str | None = None ,
+                              status_filter:str | None = Query(None, alias="status") ,
+                              product_id:str | None = None ,
+                              since:datetime.datetime | None = None ,
+                              until:datetime.datetime | None = None):
+
+    """
+    Search payments page by page, filtered by status, product and purchase time.
+
+    Payments are ordered by purchase time, newest first. Pass the `next_cursor` of a page
+    as `cursor` to fetch the next one; it is None on the last page. Archived payments are
+    not searched.
+
+    Args:
+        limit (int): The maximum number of payments on the page.
+        cursor (str, optional): The cursor of the page to fetch.
+        status_filter (str, optional): The `status` query parameter; only include payments in this status.
+        product_id (str, optional): Only include payments of this product.
+        since (datetime, optional): Only include payments purchased at or after this time.
+        until (datetime, optional): Only include payments purchased at or before this time.
+
+    Returns:
+        dict: The payments of the page, including their `pk`, and the `next_cursor`.
+
+    Raises:
+        HTTPException: If the cursor is malformed (400 Bad Request).
+    """
+    logger.info("Received request to search payments | limit: %s | status: %s | product_id: %s | since: %s | until: %s",
+                limit, status_filter, product_id, since, until)
+
+    try:
+        return await search_payments(limit, cursor, status_filter, product_id, since, until)
+
+    except ValueError:
+        raise HTTPException(detail="invalid cursor", status_code=status.HTTP_400_BAD_REQUEST)
+
+
 @payment_router.get('/check_order/{order_id}')
-async def API_check_order(order_id:str ):
+async def API_check_order(order_id:str , request:Request , response:Response):
 
     """
     API endpoint to check the status of an order by its ID.
 
+    Responses carry an ETag built from the purchase time and the version of the payment, bumped
+    by every status transition, and a Last-Modified date. Requests with a matching If-None-Match, or an
+    If-Modified-Since no older than the last transition, get 304 Not Modified.
+
     Args:
         order_id (str): The unique identifier for the order.
 
@@ -80,10 +274,176 @@ async def API_check_order(order_id:str ):
         HTTPException: If the order is not found, returns a 404 error.
     """
     
-    try:
-        logger.info(f"Order status checked for Order ID: {order_id}.")
-        order = await Payment.get(order_id)
-    except NotFoundError:
+    logger.info("Order status checked for Order ID: %s.", order_id)
+    record = await read_versioned_status(order_id)
+    if record is None:
         raise HTTPException(detail="order NOT found", status_code=status.HTTP_404_NOT_FOUND)
-    
-    return {"message" : order.status}
\ No newline at end of file
+
+    order_status, etag, last_modified = record
+    headers = validator_headers(etag, last_modified, ORDER_CACHE_CONTROL)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(headers)
+
+    response.headers.update(headers)
+    return {"message" : order_status}
+
+
+@payment_router.get('/check_order/{order_id}/wait')
+async def API_wait_order(order_id:str , since:str | None = None ,
+                         timeout:float = Query(Evariable.order_status_wait_timeout, gt=0, le=Evariable.order_status_wait_timeout)):
+
+    """
+    Long-poll variant of check_order: holds the request open until the status of the order changes.
+
+    Args:
+        order_id (str): The unique identifier for the order.
+        since (str, optional): The status the client already knows. Defaults to the current status,
+            i.e. wait for the next transition. Returns right away if the status already differs.
+        timeout (float): Seconds to wait before returning the unchanged status.
+
+    Returns:
+        dict: A dictionary containing the status message of the order.
+
+    Raises:
+        HTTPException: If the order is not found, returns a 404 error.
+    """
+
+    order_status = await wait_for_status_change(order_id, since, timeout)
+    if order_status is None:
+        raise HTTPException(detail="order NOT found", status_code=status.HTTP_404_NOT_FOUND)
+
+    return {"message" : order_status}
+
+
+@payment_router.get('/check_order/{order_id}/events')
+async def API_order_events(order_id:str ):
+
+    """
+    Streams the status of an order as Server-Sent Events until the payment completes or fails.
+
+    Each event is named 'status' and carries the same body as check_order.
+
+    Args:
+        order_id (str): The unique identifier for the order.
+
+    Returns:
+        StreamingResponse: A text/event-stream of status events.
+
+    Raises:
+        HTTPException: If the order is not found, returns a 404 error.
+    """
+
+    logger.info("Order status stream opened for Order ID: %s.", order_id)
+    if await read_status(order_id) is None:
+        raise HTTPException(detail="order NOT found", status_code=status.HTTP_404_NOT_FOUND)
+
+    return StreamingResponse(stream_status(order_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@payment_router.get('/payment_workers/stats')
+async def API_payment_worker_stats():
+
+    """
+    API endpoint to report the payment queue depth and, when the worker pool runs in this
+    process, its throughput and processing latency in the current stats window. Reading the
+    statistics does not start a new window.
+
+    Returns:
+        dict: The queue depth and the statistics of the local worker pool, if any.
+    """
+
+    if worker.payment_worker_pool is None:
+        return {"queue_depth": await Payment.db().llen(worker.jobs_key()), "worker_pool": None}
+
+    stats = await worker.payment_worker_pool.stats()
+    return {"queue_depth": stats.pop("queue_depth"), "worker_pool": stats}
+
+@payment_router.get('/amqp/stats')
+async def API_amqp_stats():
+
+    """
+    API endpoint to report the AMQP channel pool of this process: per-channel publish and
+    reply counters and the publish rate of each channel over the last stats window.
+
+    Returns:
+        dict: The state of the connection and the statistics of every pooled channel.
+    """
+
+    if publisher.publisher is None:
+        raise HTTPException(detail="The publisher is not running", status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return publisher.publisher.pool.stats()
+
+
+@payment_router.get('/gateways/stats')
+async def API_gateway_stats():
+
+    """
+    API endpoint to report the payment gateways of this process: the state of each circuit
+    breaker, the charges in flight and the counts of calls, errors, declines and hedges.
+
+    Returns:
+        dict: The statistics of every registered gateway, keyed by name.
+    """
+
+    return {name: adapter.stats() for name, adapter in GATEWAYS.items()}
+
+
+@payment_router.post('/webhooks' ,status_code=status.HTTP_201_CREATED )
+async def API_register_webhook(webhook:Webhook):
+
+    """
+    Registers an endpoint that is sent a webhook whenever any payment is completed or failed.
+
+    Args:
+        webhook (Webhook): The URL of the endpoint.
+
+    Returns:
+        dict: A dictionary with a success message.
+
+    Raises:
+        HTTPException: 422 UNPROCESSABLE ENTITY if the URL may not receive webhooks, e.g. a private address.
+    """
+
+    check_callback_url(webhook.Url)
+    await Payment.db().sadd(webhooks.endpoints_key(), str(webhook.Url))
+    logger.info("Webhook endpoint registered | url : %s", webhook.Url)
+    return {"message": "webhook registered"}
+
+
+@payment_router.get('/webhooks')
+async def API_list_webhooks():
+
+    """
+    Lists the globally registered webhook endpoints and the state of the delivery pipeline of this process.
+
+    Returns:
+        dict: The endpoint URLs and, when the dispatcher runs in this process, its delivery counters.
+    """
+
+    dispatcher = webhooks.webhook_dispatcher
+    return {"endpoints": sorted(await Payment.db().smembers(webhooks.endpoints_key())),
+            "dispatcher": await dispatcher.stats() if dispatcher else None}
+
+
+@payment_router.delete('/webhooks')
+async def API_unregister_webhook(url:str):
+
+    """
+    Unregisters a global webhook endpoint. Deliveries already queued for it are still attempted.
+
+    Args:
+        url (str): The URL of the endpoint, as it was registered.
+
+    Returns:
+        dict: A dictionary with a success message.
+
+    Raises:
+        HTTPException: If the endpoint is not registered, returns a 404 error.
+    """
+
+    if not await Payment.db().srem(webhooks.endpoints_key(), url):
+        raise HTTPException(detail="webhook NOT found", status_code=status.HTTP_404_NOT_FOUND)
+    logger.info("Webhook endpoint unregistered | url : %s", url)
+    return {"message": "webhook unregistered"}
+
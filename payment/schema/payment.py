@@ -1,12 +1,57 @@
-from pydantic import BaseModel , Field
-from aredis_om import HashModel 
+import json
+from pydantic import BaseModel , ConfigDict , Field , HttpUrl
+from aredis_om import HashModel , NotFoundError
 from datetime import datetime
+from .payment_scripts import run_script , TRANSITION_SCRIPT , CLAIM_SCRIPT
 
+# Statuses a payment never leaves.
+FINAL_STATUSES = ("Completed", "Failed")
+
+# The statuses a payment may move to from each status. A payment is created 'pending', is
+# 'processing' while the gateway handles it and ends 'Completed' or 'Failed'.
+PAYMENT_TRANSITIONS = {
+    "pending": ("processing", "Failed"),
+    "processing": ("Completed", "Failed"),
+}
+
+
+class InvalidTransitionError(Exception):
+
+    """
+    Raised when a payment cannot move to the requested status, e.g. because another worker already moved it on.
+    """
+
+    def __init__(self, current: str | None, requested: str) -> None:
+        super().__init__(f"Payment cannot move from '{current}' to '{requested}'")
+        self.current = current
+        self.requested = requested
 
 class Order(BaseModel):
 
     Product_id : str 
     Quantity : int = Field(gt=0)
+    Callback_url : HttpUrl | None = None
+    Gateway : str | None = None
+
+
+class OrderItem(BaseModel):
+
+    model_config = ConfigDict(extra="forbid")
+
+    Product_id : str
+    Quantity : int = Field(gt=0)
+
+
+class CartOrder(BaseModel):
+
+    Items : list[OrderItem] = Field(min_length=1)
+    Callback_url : HttpUrl | None = None
+    Gateway : str | None = None
+
+
+class Webhook(BaseModel):
+
+    Url : HttpUrl
 
 
 
@@ -22,43 +67,197 @@ class Payment (HashModel):
     Attributes:
     - Automatically generates a unique primary key ('pk') for each product instance.
 
-    - Product_id : str
+    - Product_id : str, optional
         Unique identifier for the product being paid for. This is typically a foreign key
-        linking to an 'Order' or 'Product' table in a relational database.
+        linking to an 'Order' or 'Product' table in a relational database. Cart payments
+        leave it empty and list their products in 'Line_items'.
 
     - Purchase_time : datetime, optional
         Timestamp indicating when the purchase was made. This field can be null initially.
         In a database, this would typically be stored as a 'datetime' type column.
 
     - Quantity : int
-        The number of units purchased. This would be stored as an integer field in the database.
+        The number of units purchased, summed over the line items for a cart payment.
+        This would be stored as an integer field in the database.
 
     - Total_price : float
         The total cost of the transaction. This would likely be a 'decimal' or 'float' type
         field in the database to handle monetary values.
 
     - Status : str, optional
-        Current status of the payment (e.g., 'Pending', 'Completed', 'Failed'). This field
-        helps track the progress of the payment process. In a database, this would likely
-        be a 'varchar' or 'text' field.
+        Current status of the payment: 'pending', 'processing', 'Completed' or 'Failed'. Once
+        saved it only changes through `transition`, following PAYMENT_TRANSITIONS. In a database,
+        this would likely be a 'varchar' or 'text' field.
 
     - Payment_Gateway : str, optional
-        The payment gateway used for processing the transaction (e.g., 'PayPal', 'Stripe').
-        This field helps identify the external payment service used. In a database, this 
-        would be stored as a string.
+        The payment gateway used for processing the transaction (e.g., 'PayPal', 'Stripe'),
+        the name of a registered gateway adapter. It is chosen with the order and empty
+        for the default gateway. In a database, this would be stored as a string.
+
+    - Line_items : str, optional
+        For a cart payment, a JSON list of the purchased products, each with 'Product_id',
+        'Quantity' and 'Unit_price'. The whole cart is charged once for 'Total_price'.
+
+    - Callback_url : str, optional
+        A URL that is sent a webhook once the payment is completed or failed, in addition
+        to the globally registered webhook endpoints.
+
+    - Version : int
+        Starts at 1 and is bumped by every status transition; the ETag of the order status is built from it.
+
+    - Updated_at : datetime, optional
+        When the last status transition happened, empty until the first one.
+
+    - Worker_id : str, optional
+        The payment worker pool that moved the payment to 'processing' and charges it. Another
+        pool only takes the payment over with `claim`, once the heartbeat of this one is gone.
+
+    Every payment is also an entry of the search indexes, sorted sets holding '<purchase time>:<pk>'
+    members: one of all payments, one per status and one per product. They are written with the
+    payment and moved by its status transitions, so searches read them in purchase time order.
 
     
     Redis HashModel capabilities allow the product to be saved, retrieved, and managed
     efficiently in the Redis database, while Pydantic's schema validation ensures data integrity.
 
     """
-    Product_id : str 
-    Purchase_time : datetime | None
+    Product_id : str | None = None
+    Purchase_time : datetime | None = None
     Quantity : int 
     Total_price : float
     status : str 
-    Payment_Gateway : str | None
+    Payment_Gateway : str | None = None
+    Line_items : str | None = None
+    Callback_url : str | None = None
+    Version : int = 1
+    Updated_at : datetime | None = None
+    Worker_id : str | None = None
 
     class Config:
         extra='ignore'
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+    def items(self) -> list[dict]:
+        """
+        Returns the products of the payment as 'product_id'/'Quantity' pairs, for single and cart payments alike.
+        """
+        if self.Line_items:
+            return [{"product_id": item["Product_id"], "Quantity": item["Quantity"]} for item in json.loads(self.Line_items)]
+        return [{"product_id": self.Product_id, "Quantity": self.Quantity}]
+
+    @classmethod
+    def payments_key(cls, *parts: str) -> str:
+        """
+        Builds the key of a payment bookkeeping structure, kept outside the payment keyspace.
+        """
+        return ":".join((cls._meta.global_key_prefix.strip(":"), "payments", *parts))
+
+    @classmethod
+    def index_key(cls, *parts: str) -> str:
+        """
+        Builds the key of a search index, kept outside the payment keyspace.
+        """
+        return cls.payments_key("index", *parts)
+
+    @staticmethod
+    def time_key(at: datetime | None) -> str:
+        """
+        Encodes a time so that the lexicographic order of the encoded times is their chronological order.
+        """
+        return f"{at.timestamp() if at else 0:017.6f}"
+
+    def index_member(self) -> str:
+        return f"{self.time_key(self.Purchase_time)}:{self.pk}"
+
+    def index_keys(self) -> list[str]:
+        """
+        Returns the search indexes the payment is listed in: all payments, its status and each of its products.
+        """
+        return [self.index_key("time"), self.index_key("status", self.status),
+                *(self.index_key("product", item["product_id"]) for item in self.items())]
+
+    async def save(self, pipeline=None) -> "Payment":
+        """
+        Saves the payment and lists it in its search indexes.
+
+        Without a pipeline the hash and the indexes are written in one transaction.
+        """
+        if pipeline is None:
+            async with self.db().pipeline(transaction=True) as pipe:
+                await self.save(pipeline=pipe)
+                await pipe.execute()
+            return self
+
+        await super().save(pipeline=pipeline)
+        member = self.index_member()
+        for key in self.index_keys():
+            pipeline.zadd(key, {member: 0})
+        return self
+
+    @classmethod
+    def audit_key(cls, order_id: str) -> str:
+        """
+        Returns the key of the stream recording the status transitions of an order.
+        """
+        return cls.payments_key("audit", order_id)
+
+    async def claim(self, worker_id: str, owner_heartbeat_key: str) -> bool:
+        """
+        Takes over a payment left in 'processing' by a worker pool that is no longer alive.
+
+        The owner, its heartbeat and the status are checked and the new owner is set by one
+        script, so of several pools finding the same interrupted payment only one resumes it.
+
+        Args:
+            worker_id (str): The pool taking the payment over.
+            owner_heartbeat_key (str): The heartbeat key of the current owner, which must have expired.
+
+        Returns:
+            bool: True if the payment now belongs to `worker_id`.
+        """
+        claimed = await run_script(self.db(), CLAIM_SCRIPT, [self.key(), owner_heartbeat_key], [self.Worker_id or "", worker_id])
+        if claimed:
+            self.Worker_id = worker_id
+        return bool(claimed)
+
+    async def transition(self, new_status: str, **fields) -> str:
+        """
+        Moves the payment to a new status, together with the fields that change with it.
+
+        The status is compared and set by a Lua script in one round trip, so of two workers
+        attempting the same transition only the first succeeds. The same script bumps the
+        version of the payment, moves it to the search index of its new status and appends
+        the transition to the audit stream of the order.
+
+        Args:
+            new_status (str): The status to move to; it must be reachable from the current status.
+            **fields: Other fields of the payment to set along with the status.
+
+        Returns:
+            str: The ID of the audit stream entry.
+
+        Raises:
+            InvalidTransitionError: If the payment may not move to `new_status`, or is no longer in the status it was loaded with.
+            NotFoundError: If the payment does not exist.
+        """
+        if new_status not in PAYMENT_TRANSITIONS.get(self.status, ()):
+            raise InvalidTransitionError(self.status, new_status)
+
+        at = datetime.now()
+        args = [self.status, new_status, at.isoformat(), self.index_member()]
+        for name, value in fields.items():
+            args += [name, str(value)]
+        keys = [self.key(), self.audit_key(self.pk), self.index_key("status", self.status), self.index_key("status", new_status)]
+        applied, result, *version = await run_script(self.db(), TRANSITION_SCRIPT, keys, args)
+        if applied == -1:
+            raise NotFoundError
+        if applied == 0:
+            self.status = result
+            raise InvalidTransitionError(result, new_status)
+
+        self.status = new_status
+        self.Version = version[0]
+        self.Updated_at = at
+        for name, value in fields.items():
+            setattr(self, name, value)
+        return result
@@ -0,0 +1,84 @@
+from redis.commands.core import AsyncScript
+
+
+# Moves a payment from one status to the next if, and only if, it is still in the expected status,
+# updating the fields that come with the transition, bumping its 'Version' and 'Updated_at', moving it
+# from the search index of its old status to that of the new one and appending an entry to the audit
+# stream of the order.
+# KEYS: payment hash, audit stream, old and new status index.
+# ARGV: expected status, new status, timestamp, index member, then field/value pairs.
+# Returns {1, entry_id, version} when the transition was applied, {0, current_status} when the payment is in
+# another status and {-1, ''} when it does not exist.
+TRANSITION_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'status')
+if not current then
+    return {-1, ''}
+end
+if current ~= ARGV[1] then
+    return {0, current}
+end
+local fields = {'status', ARGV[2]}
+for i = 5, #ARGV do
+    fields[#fields + 1] = ARGV[i]
+end
+redis.call('HSET', KEYS[1], 'Updated_at', ARGV[3], unpack(fields))
+local version = redis.call('HINCRBY', KEYS[1], 'Version', 1)
+redis.call('ZREM', KEYS[3], ARGV[4])
+redis.call('ZADD', KEYS[4], 0, ARGV[4])
+local entry = redis.call('XADD', KEYS[2], '*', 'from', ARGV[1], 'to', ARGV[2], 'at', ARGV[3], unpack(fields, 3))
+return {1, entry, version}
+"""
+
+# Hands a payment interrupted while 'processing' over to another worker pool, if its owner is no longer
+# alive: its heartbeat key expired, or it is the pool asking.
+# KEYS: payment hash, heartbeat key of the current owner. ARGV: current owner ('' if none), new owner.
+# Returns 1 if the payment was handed over, 0 if it is finished, moved on or still owned by a live pool.
+CLAIM_SCRIPT = """
+local fields = redis.call('HMGET', KEYS[1], 'status', 'Worker_id')
+if fields[1] ~= 'processing' or (fields[2] or '') ~= ARGV[1] then
+    return 0
+end
+if ARGV[1] ~= ARGV[2] and redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'Worker_id', ARGV[2])
+return 1
+"""
+
+# Queues the payments that are not queued yet: a payment is queued from the moment it is added to the set of
+# queued payments until its job has left the processing list of the pool that ran it.
+# KEYS: set of queued payments, job queue. ARGV: payment ids.
+# Returns the number of payments queued.
+REQUEUE_SCRIPT = """
+local queued = 0
+for i = 1, #ARGV do
+    if redis.call('SADD', KEYS[1], ARGV[i]) == 1 then
+        redis.call('LPUSH', KEYS[2], ARGV[i])
+        queued = queued + 1
+    end
+end
+return queued
+"""
+
+# Extends a lock, if, and only if, it is still held by the caller.
+# KEYS: lock key. ARGV: token of the holder, seconds to expire in.
+# Returns 1 if the lock was extended, 0 if it expired or is held by someone else.
+REFRESH_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_scripts: dict[str, AsyncScript] = {}
+
+
+def run_script(db, source: str, keys: list, args: list):
+    """
+    Runs a Lua script through EVALSHA, registering it on first use.
+    """
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = db.register_script(source)
+    return script(keys=keys, args=args, client=db)
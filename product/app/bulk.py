@@ -0,0 +1,199 @@
+import codecs
+import csv
+import io
+import json
+import logging
+from typing import AsyncIterable, AsyncIterator
+from pydantic import ValidationError
+from ..schema.product import Product , ProductSchema
+from .config import Evariable
+from .events import publish_product_event
+
+logger = logging.getLogger(__name__)
+
+CSV_CONTENT_TYPES = ("text/csv", "application/csv")
+EXPORT_FIELDS = ["pk", *ProductSchema.model_fields]
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """
+    Splits a streamed UTF-8 body into lines without holding more than one chunk in memory.
+
+    Args:
+        chunks (AsyncIterable[bytes]): The raw body chunks.
+
+    Yields:
+        str: Each line of the body, without its line ending.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_rows(chunks: AsyncIterable[bytes], content_type: str) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """
+    Parses a streamed NDJSON or CSV body into rows.
+
+    CSV bodies must start with a header line naming the columns. Quoted CSV fields may span lines.
+
+    Args:
+        chunks (AsyncIterable[bytes]): The raw body chunks.
+        content_type (str): The content type of the body.
+
+    Yields:
+        tuple[int, dict | None, str | None]: The 1-based row number, and either the parsed row or a parse error.
+    """
+    is_csv = content_type.split(";")[0].strip().lower() in CSV_CONTENT_TYPES
+    header = None
+    row_number = 0
+    buffered = ""
+
+    async for line in iter_lines(chunks):
+        if is_csv:
+            # a quoted field spanning lines leaves an odd number of quotes until it is closed
+            buffered = f"{buffered}\n{line}" if buffered else line
+            if buffered.count('"') % 2:
+                continue
+            line, buffered = buffered, ""
+
+        if not line.strip():
+            continue
+
+        if is_csv and header is None:
+            header = next(csv.reader([line]))
+            continue
+
+        row_number += 1
+        try:
+            if is_csv:
+                values = next(csv.reader(io.StringIO(line)))
+                if len(values) != len(header):
+                    raise ValueError(f"expected {len(header)} columns, got {len(values)}")
+                row = dict(zip(header, values))
+            else:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError("expected a JSON object")
+        except ValueError as error:
+            yield row_number, None, str(error)
+            continue
+
+        yield row_number, row, None
+
+    if buffered:
+        yield row_number + 1, None, "unterminated quoted field"
+
+
+async def import_products(chunks: AsyncIterable[bytes], content_type: str) -> dict:
+    """
+    Validates streamed rows against ProductSchema and saves them in pipelined batches.
+
+    Invalid rows are reported and skipped without stopping the load. Rows with a 'pk'
+    overwrite the product with that ID, so an export can be imported back as is. Once a batch
+    is saved, a 'created' or 'updated' product event is published for each of its rows, so
+    payment workers do not serve stale cached copies of the imported products.
+
+    Args:
+        chunks (AsyncIterable[bytes]): The raw body chunks.
+        content_type (str): The content type of the body, NDJSON or CSV.
+
+    Returns:
+        dict: The number of imported and failed rows and the first `bulk_import_max_errors` row errors.
+    """
+    imported = 0
+    failed = 0
+    errors: list[dict] = []
+    batch: list[tuple[Product, dict]] = []
+
+    async def flush() -> None:
+        async with Product.db().pipeline(transaction=False) as pipe:
+            # checked in the same round trip, to tell new products from overwritten ones
+            for product, _ in batch:
+                pipe.exists(product.key())
+            for product, _ in batch:
+                await product.save(pipeline=pipe)
+            existed = (await pipe.execute())[:len(batch)]
+        seen = set()
+        for (product, fields), exists in zip(batch, existed):
+            await publish_product_event("updated" if exists or product.pk in seen else "created", product.pk, fields)
+            seen.add(product.pk)
+        batch.clear()
+
+    async for row_number, row, error in iter_rows(chunks, content_type):
+        if row is not None:
+            try:
+                fields = ProductSchema.model_validate(row).model_dump()
+                product = Product(**fields, pk=str(row["pk"])) if row.get("pk") else Product(**fields)
+                batch.append((product, fields))
+            except ValidationError as validation_error:
+                error = "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in validation_error.errors())
+
+        if error is not None:
+            failed += 1
+            if len(errors) < Evariable.bulk_import_max_errors:
+                errors.append({"row": row_number, "error": error})
+            continue
+
+        if len(batch) >= Evariable.bulk_batch_size:
+            imported += len(batch)
+            await flush()
+
+    if batch:
+        imported += len(batch)
+        await flush()
+
+    logger.info(f"Bulk product import finished | imported : {imported} | failed : {failed}")
+    return {"imported": imported, "failed": failed, "errors": errors}
+
+
+async def export_products(csv_format: bool) -> AsyncIterator[str]:
+    """
+    Streams every product by walking the product keyspace with SCAN and pipelined HGETALL.
+
+    Args:
+        csv_format (bool): Emit CSV with a header line instead of NDJSON.
+
+    Yields:
+        str: The exported lines, one product per line.
+    """
+    db = Product.db()
+    prefix = Product.make_primary_key("")
+
+    if csv_format:
+        yield ",".join(EXPORT_FIELDS) + "\n"
+
+    async def render(keys: list[str]) -> str:
+        async with db.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(key)
+            documents = await pipe.execute()
+
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        for key, document in zip(keys, documents):
+            if not document:
+                continue
+            product = {"pk": key[len(prefix):], **ProductSchema.model_validate(document).model_dump()}
+            if csv_format:
+                writer.writerow([product[field] for field in EXPORT_FIELDS])
+            else:
+                out.write(json.dumps(product) + "\n")
+        return out.getvalue()
+
+    keys: list[str] = []
+    async for key in db.scan_iter(match=f"{prefix}*", count=Evariable.bulk_batch_size, _type="HASH"):
+        keys.append(key)
+        if len(keys) >= Evariable.bulk_batch_size:
+            yield await render(keys)
+            keys = []
+
+    if keys:
+        yield await render(keys)
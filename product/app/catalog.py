@@ -0,0 +1,146 @@
+import base64
+import binascii
+import logging
+from ..schema.product import Product , ProductSchema
+from .config import Evariable
+
+logger = logging.getLogger(__name__)
+
+
+def encode_cursor(member: str) -> str:
+    return base64.urlsafe_b64encode(member.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> str:
+    """
+    Decodes a listing cursor back into the index member it points at.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        return base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError) as error:
+        raise ValueError("invalid cursor") from error
+
+
+async def list_products(limit: int, cursor: str | None = None, min_price: float | None = None, max_price: float | None = None,
+                        in_stock: bool = False, name_prefix: str | None = None) -> dict:
+    """
+    Lists one page of products in index order, filtered by price range, stock and name prefix.
+
+    The page is read from the name index when a name prefix is given and from the in-stock or
+    price index otherwise, so the cost of a page depends on its size and not on the size of the
+    catalog. Filters the chosen index cannot apply are checked on the fetched products; at most
+    `listing_max_scan` index entries are examined per page, so a page may come back short with
+    a cursor to carry on from.
+
+    Args:
+        limit (int): The maximum number of products on the page.
+        cursor (str, optional): The `next_cursor` of the previous page.
+        min_price (float, optional): The lowest price to include.
+        max_price (float, optional): The highest price to include.
+        in_stock (bool): Only include products with stock left.
+        name_prefix (str, optional): Only include products whose name starts with this prefix, case-insensitively.
+
+    Returns:
+        dict: The products of the page and the cursor of the next page, None on the last page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    if name_prefix:
+        index = Product.index_key("name")
+        prefix = name_prefix.lower().encode()
+        start, stop = b"[" + prefix, b"[" + prefix + b"\xff"
+    else:
+        index = Product.index_key("in_stock" if in_stock else "price")
+        start = f"[{Product.price_key(min_price)}" if min_price is not None else "-"
+        # members are "<price>:<pk>", and ';' sorts right after ':'
+        stop = f"[{Product.price_key(max_price)};" if max_price is not None else "+"
+
+    if cursor:
+        start = f"({decode_cursor(cursor)}"
+
+    db = Product.db()
+    products: list[dict] = []
+    scanned = 0
+    last_member = None
+
+    while len(products) < limit and scanned < Evariable.listing_max_scan:
+        count = min(limit - len(products), Evariable.listing_max_scan - scanned)
+        members = await db.zrangebylex(index, start, stop, start=0, num=count)
+        if not members:
+            last_member = None
+            break
+
+        pks = [member.rsplit(":", 1)[1] for member in members]
+        async with db.pipeline(transaction=False) as pipe:
+            for pk in pks:
+                pipe.hgetall(Product.make_primary_key(pk))
+            documents = await pipe.execute()
+
+        for pk, document in zip(pks, documents):
+            if not document:
+                continue
+            product = ProductSchema.model_validate(document)
+            if min_price is not None and product.Product_Price < min_price:
+                continue
+            if max_price is not None and product.Product_Price > max_price:
+                continue
+            if in_stock and product.Product_Inventory <= 0:
+                continue
+            products.append({"pk": pk, **product.model_dump()})
+
+        scanned += len(members)
+        last_member = members[-1]
+        start = f"({last_member}"
+        if len(members) < count:
+            last_member = None
+            break
+
+    return {"products": products, "next_cursor": encode_cursor(last_member) if last_member else None}
+
+
+def indexes_built_key() -> str:
+    return Product.index_key("built")
+
+
+async def ensure_product_indexes() -> None:
+    """
+    Builds the listing indexes from the product keyspace unless a previous build completed, e.g. on the first start after an upgrade.
+
+    The completion marker is only written once every product was indexed, so a build that was
+    interrupted runs again on the next start; products written in the meantime index themselves.
+    """
+    db = Product.db()
+    if await db.exists(indexes_built_key()):
+        return
+
+    logger.info("Building the product listing indexes")
+    prefix = Product.make_primary_key("")
+    indexed = 0
+    keys: list[str] = []
+
+    async def reindex(keys: list[str]) -> int:
+        async with db.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hmget(key, "Product_Price", "Product_Name")
+            rows = await pipe.execute()
+
+        async with db.pipeline(transaction=False) as pipe:
+            for key, (price, name) in zip(keys, rows):
+                if price is not None:
+                    await Product.reindex(key[len(prefix):], float(price), name or "", pipe)
+            return sum(await pipe.execute())
+
+    async for key in db.scan_iter(match=f"{prefix}*", count=Evariable.bulk_batch_size, _type="HASH"):
+        keys.append(key)
+        if len(keys) >= Evariable.bulk_batch_size:
+            indexed += await reindex(keys)
+            keys = []
+    if keys:
+        indexed += await reindex(keys)
+    await db.set(indexes_built_key(), 1)
+
+    logger.info(f"Product listing indexes built | products : {indexed}")
@@ -0,0 +1,91 @@
+"""
+Wire format of the inventory RPC messages.
+
+Bodies are encoded according to the AMQP content_type of the message: msgpack for
+'application/msgpack' and JSON for 'application/json'. Requests sent as 'text/plain' come
+from payment services that predate content types; they carry a JSON body and are answered
+in the old plain-text format.
+
+Every other reply is an envelope, {"result": ...} on success or {"error": CODE, "message": ...}
+with details of the failure, so errors are typed instead of magic strings.
+"""
+import msgpack
+import orjson
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+LEGACY = "text/plain"
+
+NOT_FOUND = "NOT_FOUND"
+INSUFFICIENT_INVENTORY = "INSUFFICIENT_INVENTORY"
+
+# Body shapes used by the plain-text replies of older versions.
+LEGACY_ERRORS = {NOT_FOUND: "NOT FOUND", INSUFFICIENT_INVENTORY: "INSUFFICIENT INVENTORY"}
+
+CODECS = {
+    JSON: (orjson.dumps, orjson.loads),
+    LEGACY: (orjson.dumps, orjson.loads),
+    MSGPACK: (msgpack.packb, msgpack.unpackb),
+}
+
+
+def register_codec(content_type: str, encode, decode) -> None:
+    """
+    Adds a codec for a content type, or replaces the one registered for it.
+
+    Args:
+        content_type (str): The AMQP content type the codec handles.
+        encode: Function turning a value into bytes.
+        decode: Function turning bytes back into a value; it should raise ValueError on bad input.
+    """
+    CODECS[content_type] = (encode, decode)
+
+
+def decode(body: bytes, content_type: str | None):
+    """
+    Decodes a message body according to its content type; a missing content type is read as JSON.
+
+    Raises:
+        ValueError: If the content type is unknown or the body cannot be decoded.
+    """
+    codec = CODECS.get(content_type or LEGACY)
+    if codec is None:
+        raise ValueError(f"Unsupported content type '{content_type}'")
+    return codec[1](body)
+
+
+def encode(value, content_type: str) -> bytes:
+    return CODECS[content_type][0](value)
+
+
+def ok_reply(result) -> dict:
+    return {"result": result}
+
+
+def error_reply(code: str, message: str, **details) -> dict:
+    return {"error": code, "message": message, **details}
+
+
+def encode_reply(reply: dict, method: str, content_type: str | None) -> tuple[bytes, str | None]:
+    """
+    Encodes a reply in the format of the request it answers.
+
+    Args:
+        reply (dict): The reply envelope.
+        method (str): The method of the request, needed to render plain-text replies.
+        content_type (str | None): The content type of the request.
+
+    Returns:
+        tuple[bytes, str | None]: The body and the content type of the reply.
+    """
+    if content_type in CODECS and content_type != LEGACY:
+        return encode(reply, content_type), content_type
+
+    if "error" in reply:
+        return LEGACY_ERRORS.get(reply["error"], reply["error"]).encode(), None
+    result = reply["result"]
+    if isinstance(result, str):
+        return result.encode(), None
+    if method == "read_many":
+        result = {pk: LEGACY_ERRORS[NOT_FOUND] if product is None else product for pk, product in result.items()}
+    return orjson.dumps(result), None
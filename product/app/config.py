@@ -11,6 +11,28 @@ class ENV (BaseSettings):
     RabbitMQ_port  : str = ""
     RabbitMQ_user : str = "guest"
     RabbitMQ_password : str = "guest"
+    consumer_prefetch_count : int = 64
+    consumer_max_concurrency : int = 32
+    consumer_stats_interval : float = 60.0
+    inventory_partitions : int = 8
+    partition_heartbeat_interval : float = 5.0
+    partition_member_ttl : float = 15.0
+    reservation_ttl : int = 900
+    reservation_sweep_interval : float = 5.0
+    reservation_sweep_batch : int = 500
+    committed_order_ttl : int = 604800
+    inventory_shard_max : int = 64
+    inventory_shard_sync_interval : float = 1.0
+    inventory_shard_drift : int = 10
+    bulk_batch_size : int = 500
+    bulk_import_max_errors : int = 1000
+    product_cache_control : str = "no-cache"
+    listing_max_limit : int = 100
+    listing_max_scan : int = 1000
+    log_queue_enabled : bool = True
+    log_queue_size : int = 10000
+    log_json : bool = False
+    log_sample_rates : dict[str, float] = {}
 
     class Config :
         env_file = ".env"
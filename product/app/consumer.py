@@ -1,10 +1,15 @@
+import asyncio
 import logging
-import json
+import time
 from aio_pika import Message, connect
-from aio_pika.abc import AbstractIncomingMessage
+from aio_pika.abc import AbstractChannel, AbstractExchange, AbstractIncomingMessage
 from aredis_om import NotFoundError
-from ..schema.product import Product
+from ..schema.product import Product , InsufficientInventoryError , shard_counts
 from .config import Evariable
+from .codec import decode , encode_reply , ok_reply , error_reply , NOT_FOUND , INSUFFICIENT_INVENTORY
+from .events import setup_product_events , publish_inventory_levels
+from .partitions import PartitionClaimer
+from .metrics import consumer_messages , consumer_handler_duration , consumer_in_flight , method_label
 
 logger = logging.getLogger('consumer_logger')
 logger_error = logging.getLogger('error_logger')
@@ -18,77 +23,299 @@ async def connect_consumer() :
 
 
 
+class ConsumerStats:
+
+    """
+    Counters describing the consumer workload, used to size the prefetch count and the handler pool.
+    Window counters are reset every time a report is taken.
+    """
+
+    def __init__(self) -> None:
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.window_processed = 0
+        self.window_latency = 0.0
+        self.window_max_latency = 0.0
+        self.window_started = time.monotonic()
+
+    def record(self, latency: float, failed: bool) -> None:
+        self.processed += 1
+        self.window_processed += 1
+        self.window_latency += latency
+        self.window_max_latency = max(self.window_max_latency, latency)
+        if failed:
+            self.failed += 1
+
+    def report(self) -> dict:
+        """
+        Returns the statistics of the current window and starts a new one.
+        """
+        now = time.monotonic()
+        elapsed = max(now - self.window_started, 1e-9)
+        report = {
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+            "messages_per_sec": self.window_processed / elapsed,
+            "avg_latency_ms": self.window_latency / self.window_processed * 1000 if self.window_processed else 0.0,
+            "max_latency_ms": self.window_max_latency * 1000,
+        }
+        self.window_processed = 0
+        self.window_latency = 0.0
+        self.window_max_latency = 0.0
+        self.window_started = now
+        return report
+
+
+class MessageDispatcher:
+
+    """
+    Runs inventory message handlers concurrently in a bounded pool.
+
+    Messages carrying the same product_id are chained so they are handled one after another
+    in arrival order, while messages for different products run in parallel. Messages for a
+    sharded product are not chained, their writes go to different shards.
+    """
+
+    def __init__(self, exchange: AbstractExchange, max_concurrency: int) -> None:
+        self.exchange = exchange
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.tails: dict[str, asyncio.Future] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.stats = ConsumerStats()
+
+    async def dispatch(self, message: AbstractIncomingMessage) -> None:
+        """
+        Consume callback: decodes the message and schedules its handler behind any
+        earlier message for the same product.
+
+        Args:
+            message (AbstractIncomingMessage): The incoming message from RabbitMQ.
+        """
+        try:
+            value = decode(message.body, message.content_type)
+            if not isinstance(value, dict):
+                raise ValueError(f"expected an object, got {type(value).__name__}")
+        except ValueError as E:
+            logger_error.critical(f'Undecodable message rejected | correlation_id : {message.correlation_id} | Error: {E}', extra={"correlation_id": message.correlation_id})
+            await message.reject(requeue=False)
+            consumer_messages.labels("other", "rejected").inc()
+            return
+
+        key = value.get("product_id")
+        if key in shard_counts:
+            key = None
+        previous = self.tails.get(key) if key else None
+        done = asyncio.get_running_loop().create_future()
+        if key:
+            self.tails[key] = done
+
+        task = asyncio.create_task(self.run(message, value, key, previous, done))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, message: AbstractIncomingMessage, value: dict, key: str|None,
+                  previous: asyncio.Future|None, done: asyncio.Future) -> None:
+        try:
+            if previous is not None:
+                await previous
+
+            async with self.semaphore:
+                self.stats.in_flight += 1
+                consumer_in_flight.inc()
+                started = time.monotonic()
+                failed = not await handle_message(message, value, self.exchange)
+                latency = time.monotonic() - started
+                self.stats.in_flight -= 1
+                consumer_in_flight.dec()
+                self.stats.record(latency, failed)
+
+                method = method_label(value)
+                consumer_handler_duration.labels(method).observe(latency)
+                consumer_messages.labels(method, "failed" if failed else "ok").inc()
+        finally:
+            done.set_result(None)
+            if key and self.tails.get(key) is done:
+                del self.tails[key]
+
+
+async def handle_message(message: AbstractIncomingMessage, value: dict, exchange: AbstractExchange) -> bool:
+    """
+    Processes one inventory message and publishes the reply to its reply queue.
+
+    Args:
+        message (AbstractIncomingMessage): The incoming message from RabbitMQ.
+        value (dict): The decoded message body.
+        exchange (AbstractExchange): The exchange used to publish the reply.
+
+    Returns:
+        bool: True if the message was handled successfully.
+    """
+    try:
+        async with message.process(requeue=False):
+            logger.info("Message received | correlation_id : %s", message.correlation_id, extra={"correlation_id": message.correlation_id})
+
+            assert message.reply_to is not None
+
+            reply = await on_response(value, message.correlation_id)
+            logger.info("The message was processed | correlation_id : %s", message.correlation_id, extra={"correlation_id": message.correlation_id})
+
+            body, content_type = encode_reply(reply, value["method"], message.content_type)
+            await exchange.publish(
+                Message(body=body,content_type=content_type,correlation_id=message.correlation_id,)
+                ,routing_key=message.reply_to)
+            logger.info("The message was sent to the PaymentGateway | correlation_id : %s", message.correlation_id, extra={"correlation_id": message.correlation_id})
+
+    except Exception as E:
+        logger_error.critical(f'something went wrong in message broker!!   {E}')
+        return False
+
+    return True
+
+
 async def consumer() -> None:
     """
-    RabbitMQ consumer that listens to the 'read' queue for messages regarding product actions
-    (read or subtract inventory) and responds with the requested information or performs
+    RabbitMQ consumer that listens to the inventory partition queues for messages regarding product actions
+    (read, batched read_many, reserve, release or subtract inventory) and responds with the requested information or performs
     inventory updates.
 
-    It handles responses asynchronously and sends a message back to the reply queue.
+    Inventory requests are spread over `inventory_partitions` queues by product, multi-product
+    reserves and subtracts by order ID, and every instance consumes its share of them, handed
+    out by a PartitionClaimer. The 'read' queue
+    is still consumed for requests from payment services that do not partition them yet.
+
+    Messages are prefetched according to `consumer_prefetch_count` and handled concurrently by
+    up to `consumer_max_concurrency` handlers, keeping per-product ordering. Queue depth and
+    handler latency are logged every `consumer_stats_interval` seconds.
     """
     connection = await connect_consumer()
     channel = await connection.channel()
-    exchange = channel.default_exchange
+    await channel.set_qos(prefetch_count=Evariable.consumer_prefetch_count)
     queue = await channel.declare_queue("read")
+    await setup_product_events(channel)
 
-    async with queue.iterator() as qiterator:
+    dispatcher = MessageDispatcher(channel.default_exchange, Evariable.consumer_max_concurrency)
+    await queue.consume(dispatcher.dispatch)
+    claimer = await PartitionClaimer(channel, dispatcher.dispatch).start()
 
-        message: AbstractIncomingMessage
+    try:
+        await report_consumer_stats(channel, dispatcher, claimer)
+    finally:
+        await claimer.stop()
 
-        async for message in qiterator:
 
-            try:
-                async with message.process(requeue=False):
-                    logger.info(f"Message received | correlation_id : {message.correlation_id}")
-                    
-                    assert message.reply_to is not None
-                    assert message.body is not None
-                    
-                    response = await on_response(message.body.decode() ,message.correlation_id)
-                    logger.info(f"The message was processed | correlation_id : {message.correlation_id}")
-                    
-                    await exchange.publish(
-                        Message(body=response.encode(),correlation_id=message.correlation_id,)
-                        ,routing_key=message.reply_to)
-                    logger.info(f"The message was sent to the PaymentGateway | correlation_id : {message.correlation_id}")
-
-            except Exception as E:
-                logger_error.critical(f'something went wrong in message broker!!   {E}')
-
-
-async def on_response (value: str ,correlation_id: str ) -> dict|str:
+async def report_consumer_stats(channel: AbstractChannel, dispatcher: MessageDispatcher, claimer: PartitionClaimer) -> None:
+    while True:
+        await asyncio.sleep(Evariable.consumer_stats_interval)
+        try:
+            declared = await channel.declare_queue("read", passive=True)
+            queue_depth = declared.declaration_result.message_count + await claimer.queue_depth()
+        except Exception as E:
+            logger_error.error(f'Unable to read the queue depth | Error: {E}')
+            queue_depth = None
+
+        stats = dispatcher.stats.report()
+        logger.info(f"Consumer stats | queue_depth : {queue_depth} | partitions : {claimer.partitions()} | in_flight : {stats['in_flight']} | "
+                    f"messages_per_sec : {stats['messages_per_sec']:.1f} | avg_latency_ms : {stats['avg_latency_ms']:.2f} | "
+                    f"max_latency_ms : {stats['max_latency_ms']:.2f} | processed : {stats['processed']} | failed : {stats['failed']}")
+
+
+def order_items(value: dict) -> dict[str, int]:
+    """
+    Returns the quantities of a reserve or subtract message keyed by product ID.
+
+    A message either names one product with 'product_id'/'Quantity' or carries an 'items'
+    list of such pairs; quantities of repeated products are added up.
+    """
+    if "items" not in value:
+        return {value["product_id"]: value["Quantity"]}
+
+    items: dict[str, int] = {}
+    for item in value["items"]:
+        items[item["product_id"]] = items.get(item["product_id"], 0) + item["Quantity"]
+    return items
+
+
+async def on_response (value: dict ,correlation_id: str ) -> dict:
     """
     Handles the incoming message and performs actions such as reading product info or
     subtracting product inventory.
 
     Args:
-        value (str): JSON string containing the method (read or subtract) and product ID.
+        value (dict): The decoded message containing the method (read, read_many, reserve, release or subtract),
+            the product ID(s) or line items and, for reservations, the order ID.
 
     Returns:
-        dict | str: The result of the requested action or an error message.
+        dict: The reply envelope, with either the result of the requested action or a typed error.
     """
-    value=json.loads(value)
+    if value["method"] == "read_many":
+        products = await Product.get_many(value["product_ids"])
+        logger.info("products info read | product_ids : %s | correlation_id : %s", len(products), correlation_id, extra={"correlation_id": correlation_id})
+        return ok_reply({pk: product.model_dump() if product else None for pk, product in products.items()})
 
-    try :
-        product_info = await Product.get(value["product_id"])
-    except NotFoundError:
-        return "NOT FOUND"
-    
     match value["method"]:
 
         case "subtract":
+            items = order_items(value)
             try:
-                total = product_info.Product_Inventory - value["Quantity"]
-                await product_info.update(Product_Inventory = total)
+                if value.get("order_id"):
+                    levels = await Product.commit_order(value["order_id"], items, Evariable.committed_order_ttl)
+                    if levels is None:
+                        logger.info("The order was already committed | order_id : %s | correlation_id : %s", value['order_id'], correlation_id, extra={"correlation_id": correlation_id})
+                        return ok_reply("The product update was successful")
+                    if not levels:
+                        logger.info("The product reservation committed | order_id : %s | correlation_id : %s", value['order_id'], correlation_id, extra={"correlation_id": correlation_id})
+                        return ok_reply("The product update was successful")
+                else:
+                    levels = await Product.subtract_inventory(items)
+                await publish_inventory_levels(levels)
 
-                logger.info(f"The product inventory updated | product_id : {product_info.pk} | Quantity : {value["Quantity"]} | correlation_id : {correlation_id}")
+            except NotFoundError:
+                return error_reply(NOT_FOUND, "Product NOT found")
+
+            except InsufficientInventoryError as E:
+                logger.warning("Not enough inventory to subtract | product_id : %s | Quantity : %s | available : %s | correlation_id : %s", E.product_id, items[E.product_id], E.available, correlation_id, extra={"correlation_id": correlation_id})
+                return error_reply(INSUFFICIENT_INVENTORY, "Quantity requested is more than available inventory",
+                                   product_id=E.product_id, available=E.available)
 
-                return "The product update was successful"
-            
             except Exception as E: 
                 logger_error.critical(f'something went wrong in message broker!! | Error: {E}')
                 raise Exception(f"something went wrong  {E}")
 
+            logger.info("The product inventory updated | items : %s | stock : %s | correlation_id : %s", items, levels, correlation_id, extra={"correlation_id": correlation_id})
+            return ok_reply("The product update was successful")
+
+        case "reserve":
+            items = order_items(value)
+            try:
+                levels = await Product.reserve_inventory(value["order_id"], items, Evariable.reservation_ttl)
+                await publish_inventory_levels(levels)
+
+            except NotFoundError:
+                return error_reply(NOT_FOUND, "Product NOT found")
+
+            except InsufficientInventoryError as E:
+                logger.warning("Not enough inventory to reserve | product_id : %s | Quantity : %s | available : %s | correlation_id : %s", E.product_id, items[E.product_id], E.available, correlation_id, extra={"correlation_id": correlation_id})
+                return error_reply(INSUFFICIENT_INVENTORY, "Quantity requested is more than available inventory",
+                                   product_id=E.product_id, available=E.available)
+
+            logger.info("The product inventory reserved | items : %s | order_id : %s | correlation_id : %s", items, value['order_id'], correlation_id, extra={"correlation_id": correlation_id})
+            return ok_reply("RESERVED")
+
+        case "release":
+            levels = await Product.release_reservation(value["order_id"])
+            logger.info("The product reservation released | order_id : %s | released : %s | correlation_id : %s", value['order_id'], levels is not None, correlation_id, extra={"correlation_id": correlation_id})
+            if levels is None:
+                return ok_reply("NOT RESERVED")
+            await publish_inventory_levels(levels)
+            return ok_reply("RELEASED")
+
         case "read":
-            logger.info(f"product info read | product_id : {product_info.pk} | correlation_id : {correlation_id}")
-            return json.dumps(product_info.model_dump())
\ No newline at end of file
+            try :
+                product_info = await Product.get(value["product_id"])
+            except NotFoundError:
+                return error_reply(NOT_FOUND, "Product NOT found", product_id=value["product_id"])
+
+            logger.info("product info read | product_id : %s | correlation_id : %s", product_info.pk, correlation_id, extra={"correlation_id": correlation_id})
+            return ok_reply(product_info.model_dump())
\ No newline at end of file
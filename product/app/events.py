@@ -0,0 +1,56 @@
+import json
+import logging
+from aio_pika import ExchangeType, Message
+from aio_pika.abc import AbstractChannel, AbstractExchange
+
+logger = logging.getLogger('consumer_logger')
+logger_error = logging.getLogger('error_logger')
+
+PRODUCT_EVENTS_EXCHANGE = "product_events"
+
+exchange: AbstractExchange | None = None
+
+
+async def setup_product_events(channel: AbstractChannel) -> None:
+    """
+    Declares the fanout exchange product change events are published on.
+
+    Args:
+        channel (AbstractChannel): The channel used to publish the events.
+    """
+    global exchange
+    exchange = await channel.declare_exchange(PRODUCT_EVENTS_EXCHANGE, ExchangeType.FANOUT)
+
+
+async def publish_product_event(event: str, product_id: str, fields: dict | None = None) -> None:
+    """
+    Publishes a product change event so payment workers can patch or drop their cached copy.
+
+    Publishing is best effort: a failure is logged and never fails the change itself.
+
+    Args:
+        event (str): One of 'created', 'updated', 'deleted' or 'inventory'.
+        product_id (str): The unique identifier of the changed product.
+        fields (dict, optional): The changed fields and their new values.
+    """
+    if exchange is None:
+        return
+
+    try:
+        await exchange.publish(
+            Message(json.dumps({"event": event, "product_id": product_id, "fields": fields or {}}).encode(),
+                    content_type="application/json"),
+            routing_key="")
+    except Exception as E:
+        logger_error.error(f"Publishing product event failed | event : {event} | product_id : {product_id} | Error: {E}")
+
+
+async def publish_inventory_levels(levels: dict[str, int]) -> None:
+    """
+    Publishes an 'inventory' event for every product whose stock level changed.
+
+    Args:
+        levels (dict[str, int]): The new stock level keyed by product ID.
+    """
+    for product_id, stock in levels.items():
+        await publish_product_event("inventory", product_id, {"Product_Inventory": stock})
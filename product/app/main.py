@@ -9,11 +9,15 @@ from ..router.product import product_router
 from ..schema.product import Product
 from .config import Evariable
 from .consumer import consumer , connect_consumer
+from .reservations import reservation_sweeper , shard_syncer
+from .catalog import ensure_product_indexes
+from .metrics import MetricsMiddleware , instrument_redis , metrics_endpoint
 from .logging_config import configure_logging
 
 
 REDIS_DATA_URL = f"redis://{Evariable.redis_username}:{Evariable.redis_password}@{Evariable.redis_host}:{Evariable.redis_port}/{Evariable.redis_database}"
 redis = get_redis_connection(url=REDIS_DATA_URL , decode_responses=True)
+instrument_redis(redis)
 
 logger = logging.getLogger(__name__)
 logger_error = logging.getLogger('error_logger')
@@ -35,6 +39,12 @@ async def check_database_is_up(app: FastAPI):
         await connect_consumer()
         
         asyncio.create_task(consumer())
+
+        asyncio.create_task(reservation_sweeper())
+
+        asyncio.create_task(shard_syncer())
+
+        asyncio.create_task(ensure_product_indexes())
         
         if not await redis.ping() :
             raise ConnectionError("Unable to ping the Redis database!")
@@ -56,6 +66,9 @@ app = FastAPI(lifespan=check_database_is_up )
 
 app.include_router(product_router , prefix="/v1" ,tags=['Product'])
 
+app.add_middleware(MetricsMiddleware)
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler_logging(request , exc):
@@ -0,0 +1,108 @@
+import time
+from prometheus_client import (CONTENT_TYPE_LATEST , CollectorRegistry , Counter , Gauge , Histogram , GCCollector ,
+                               PlatformCollector , ProcessCollector , generate_latest)
+from starlette.requests import Request
+from starlette.responses import Response
+
+# The service keeps its own registry, so it can share a process with the payment service in benchmarks.
+registry = CollectorRegistry()
+ProcessCollector(registry=registry)
+PlatformCollector(registry=registry)
+GCCollector(registry=registry)
+
+# Buckets from 0.5ms up to 10s, shared by every latency histogram so they can be compared.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+http_request_duration = Histogram("http_request_duration_seconds", "Latency of HTTP requests by route.",
+                                  ["method", "route", "status"], buckets=LATENCY_BUCKETS, registry=registry)
+consumer_messages = Counter("consumer_messages_total", "Inventory messages handled, by method and outcome.",
+                            ["method", "outcome"], registry=registry)
+consumer_handler_duration = Histogram("consumer_handler_duration_seconds", "Time spent handling inventory messages, by method.",
+                                      ["method"], buckets=LATENCY_BUCKETS, registry=registry)
+consumer_in_flight = Gauge("consumer_messages_in_flight", "Inventory messages being handled.", registry=registry)
+consumer_partitions_owned = Gauge("consumer_partitions_owned", "Inventory partition queues consumed by this instance.", registry=registry)
+log_records_dropped = Counter("log_records_dropped_total", "Log records dropped because the log queue was full, by level.",
+                              ["level"], registry=registry)
+log_records_sampled = Counter("log_records_sampled_out_total", "Log records skipped by per-logger sampling, by logger.",
+                              ["logger"], registry=registry)
+redis_command_duration = Histogram("redis_command_duration_seconds", "Latency of Redis commands, pipelines counted as one.",
+                                   ["command"], buckets=LATENCY_BUCKETS, registry=registry)
+
+# Message methods are labels, so unknown ones share a series instead of growing the label set.
+CONSUMER_METHODS = ("read", "read_many", "reserve", "release", "subtract")
+
+
+def method_label(value: dict) -> str:
+    method = value.get("method")
+    return method if method in CONSUMER_METHODS else "other"
+
+
+class MetricsMiddleware:
+
+    """
+    ASGI middleware recording the latency of every HTTP request under its route template,
+    so '/v1/read_product/{proID}' is one series however many products there are.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            http_request_duration.labels(scope["method"], route.path if route else "unmatched", status).observe(
+                time.perf_counter() - started)
+
+
+def instrument_redis(client) -> None:
+    """
+    Times every command and pipeline sent through a Redis client.
+
+    Args:
+        client: The redis.asyncio client to instrument. Pub/sub connections are not covered.
+    """
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    async def timed_execute_command(*args, **options):
+        started = time.perf_counter()
+        try:
+            return await execute_command(*args, **options)
+        finally:
+            redis_command_duration.labels(str(args[0]).split(" ")[0].upper()).observe(time.perf_counter() - started)
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def timed_execute(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await execute(*args, **kwargs)
+            finally:
+                redis_command_duration.labels("PIPELINE").observe(time.perf_counter() - started)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    client.execute_command = timed_execute_command
+    client.pipeline = timed_pipeline
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
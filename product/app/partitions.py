@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from aio_pika import ExchangeType
+from aio_pika.abc import AbstractChannel, AbstractQueue
+from ..schema.product import Product
+from .config import Evariable
+from .metrics import consumer_partitions_owned
+
+logger = logging.getLogger('consumer_logger')
+logger_error = logging.getLogger('error_logger')
+
+INVENTORY_EXCHANGE = "inventory"
+
+
+def partition_queue(partition: int) -> str:
+    return f"inventory.{partition}"
+
+
+def members_key() -> str:
+    return Product.inventory_key("consumers")
+
+
+def partition_owner(partition: int, members: list[str]) -> str:
+    """
+    Picks the owner of a partition by rendezvous hashing: the member scoring highest for it.
+    A member joining or leaving only moves the partitions it gains or held.
+    """
+    return max(members, key=lambda member: hashlib.blake2b(f"{member}:{partition}".encode(), digest_size=8).digest())
+
+
+class PartitionClaimer:
+
+    """
+    Claims this instance's share of the inventory partition queues and rebalances it as instances join or leave.
+
+    Every instance keeps a heartbeat in a Redis sorted set and works out its own share from the
+    live members, so no coordinator is needed. The partition queues are declared with single
+    active consumer: while a partition changes hands the old and the new owner may both be
+    subscribed, but only one of them receives its messages.
+    """
+
+    def __init__(self, channel: AbstractChannel, on_message) -> None:
+        self.channel = channel
+        self.on_message = on_message
+        self.member_id = uuid.uuid4().hex
+        self.queues: dict[int, AbstractQueue] = {}
+        self.consumer_tags: dict[int, str] = {}
+        self.members: list[str] = []
+        self.task: asyncio.Task | None = None
+
+    async def start(self) -> "PartitionClaimer":
+        """
+        Declares the inventory exchange and its partition queues, then claims the first share of them.
+        """
+        exchange = await self.channel.declare_exchange(INVENTORY_EXCHANGE, ExchangeType.DIRECT)
+        for partition in range(Evariable.inventory_partitions):
+            queue = await self.channel.declare_queue(partition_queue(partition),
+                                                     arguments={"x-single-active-consumer": True})
+            await queue.bind(exchange, routing_key=str(partition))
+            self.queues[partition] = queue
+
+        await self.rebalance()
+        self.task = asyncio.create_task(self.run())
+        return self
+
+    async def heartbeat(self) -> list[str]:
+        """
+        Refreshes the heartbeat of this instance and drops the members whose heartbeat expired.
+
+        Returns:
+            list[str]: The IDs of the live members.
+        """
+        now = time.time()
+        async with Product.db().pipeline(transaction=True) as pipe:
+            pipe.zadd(members_key(), {self.member_id: now})
+            pipe.zremrangebyscore(members_key(), "-inf", now - Evariable.partition_member_ttl)
+            pipe.zrange(members_key(), 0, -1)
+            _, _, members = await pipe.execute()
+        return members
+
+    async def rebalance(self) -> None:
+        members = await self.heartbeat()
+        owned = {partition for partition in self.queues if partition_owner(partition, members) == self.member_id}
+
+        # subscribe to the gained partitions first, so none is left without a consumer in between
+        for partition in sorted(owned - self.consumer_tags.keys()):
+            self.consumer_tags[partition] = await self.queues[partition].consume(self.on_message)
+        for partition in sorted(self.consumer_tags.keys() - owned):
+            await self.queues[partition].cancel(self.consumer_tags.pop(partition))
+
+        if members != self.members:
+            logger.info("Inventory partitions rebalanced | members : %s | partitions : %s", len(members), self.partitions())
+        self.members = members
+        consumer_partitions_owned.set(len(self.consumer_tags))
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(Evariable.partition_heartbeat_interval)
+            try:
+                await self.rebalance()
+            except Exception as E:
+                logger_error.error(f"Rebalancing inventory partitions failed | Error: {E}")
+
+    def partitions(self) -> list[int]:
+        return sorted(self.consumer_tags)
+
+    async def queue_depth(self) -> int:
+        """
+        Returns the number of messages waiting in the partitions this instance consumes.
+        """
+        depth = 0
+        for partition in self.partitions():
+            declared = await self.channel.declare_queue(partition_queue(partition), passive=True)
+            depth += declared.declaration_result.message_count
+        return depth
+
+    async def stop(self) -> None:
+        """
+        Leaves the group, so the other instances take over the partitions at their next heartbeat.
+        """
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await Product.db().zrem(members_key(), self.member_id)
+        for partition, tag in list(self.consumer_tags.items()):
+            await self.queues[partition].cancel(tag)
+        self.consumer_tags.clear()
+        consumer_partitions_owned.set(0)
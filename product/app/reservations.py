@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from ..schema.product import Product
+from .config import Evariable
+from .events import publish_inventory_levels
+
+logger = logging.getLogger(__name__)
+logger_error = logging.getLogger('error_logger')
+
+
+async def shard_syncer() -> None:
+    """
+    Background task that adds the shards of every sharded product up into its stock.
+
+    Every `inventory_shard_sync_interval` seconds the shards of all sharded products are read and
+    added up in one pipelined round trip, spread evenly again where they drifted more than
+    `inventory_shard_drift` units apart, and the changed stock levels are published.
+    """
+    while True:
+        await asyncio.sleep(Evariable.inventory_shard_sync_interval)
+
+        try:
+            levels, rebalanced = await Product.sync_shards(Evariable.inventory_shard_drift)
+            await publish_inventory_levels(levels)
+
+            if rebalanced:
+                logger.info(f"Inventory shards rebalanced | products : {rebalanced}")
+
+        except Exception as E:
+            logger_error.error(f"Syncing inventory shards failed | Error: {E}")
+
+
+async def reservation_sweeper() -> None:
+    """
+    Background task that returns the stock of expired reservations to the products.
+
+    Every `reservation_sweep_interval` seconds it releases expired reservations in batches of
+    `reservation_sweep_batch`, three Redis round trips per batch, until none are left. Reservations
+    expire when their payment is abandoned, or when it failed and its release did not get through.
+    """
+    while True:
+        await asyncio.sleep(Evariable.reservation_sweep_interval)
+
+        try:
+            released, levels = await Product.release_expired_reservations(Evariable.reservation_sweep_batch)
+            total = released
+            while released == Evariable.reservation_sweep_batch:
+                released, more_levels = await Product.release_expired_reservations(Evariable.reservation_sweep_batch)
+                levels.update(more_levels)
+                total += released
+
+            await publish_inventory_levels(levels)
+
+            if total:
+                logger.info(f"Expired reservations released | count : {total}")
+
+        except Exception as E:
+            logger_error.error(f"Releasing expired reservations failed | Error: {E}")
@@ -1,7 +1,13 @@
 import logging
-from fastapi import APIRouter , HTTPException , status
+from fastapi import APIRouter , HTTPException , status , Request , Query , Response
+from fastapi.responses import StreamingResponse
 from ..schema.product import Product  , ProductSchema
 from aredis_om import NotFoundError
+from ..app.events import publish_product_event
+from ..app.bulk import import_products , export_products
+from ..app.catalog import list_products
+from ..app.config import Evariable
+from ..app.http_cache import is_conditional , is_not_modified , validator_headers , not_modified
 
 logger = logging.getLogger(__name__)
 logger_error = logging.getLogger('error_logger')
@@ -9,11 +15,52 @@ logger_error = logging.getLogger('error_logger')
 product_router = APIRouter()
 
 
+@product_router.get('/products', status_code=status.HTTP_200_OK)
+async def API_list_products(limit: int = Query(20, ge=1, le=Evariable.listing_max_limit),
+                            cursor: str | None = None,
+                            min_price: float | None = None,
+                            max_price: float | None = None,
+                            in_stock: bool = False,
+                            name_prefix: str | None = None):
+    """
+    List products page by page, filtered by price range, stock and name prefix.
+
+    Products are ordered by price, or by name when `name_prefix` is given. Pass the
+    `next_cursor` of a page as `cursor` to fetch the next one; it is None on the last page.
+
+    Args:
+        limit (int): The maximum number of products on the page.
+        cursor (str, optional): The cursor of the page to fetch.
+        min_price (float, optional): The lowest price to include.
+        max_price (float, optional): The highest price to include.
+        in_stock (bool): Only include products with stock left.
+        name_prefix (str, optional): Only include products whose name starts with this prefix, case-insensitively.
+
+    Returns:
+        dict: The products of the page, including their `pk`, and the `next_cursor`.
+
+    Raises:
+        HTTPException: If the cursor is malformed (400 Bad Request).
+    """
+    logger.info("Received request to list products | limit: %s | min_price: %s | max_price: %s | in_stock: %s | name_prefix: %s",
+                limit, min_price, max_price, in_stock, name_prefix)
+
+    try:
+        return await list_products(limit, cursor, min_price, max_price, in_stock, name_prefix)
+
+    except ValueError:
+        raise HTTPException(detail="invalid cursor", status_code=status.HTTP_400_BAD_REQUEST)
+
+
 @product_router.get('/read_product/{proID}', response_model=ProductSchema ,status_code=status.HTTP_200_OK)
-async def API_read_product(proID: str):
+async def API_read_product(proID: str, request: Request, response: Response):
     """
     Fetch product details by product ID.
 
+    Responses carry an ETag, a Last-Modified date and the `product_cache_control` Cache-Control
+    header. A request with If-None-Match or If-Modified-Since is checked against the version of
+    the product alone, and answered with 304 Not Modified if the product did not change.
+
     Args:
         proID (str): The unique identifier of the product to retrieve.
 
@@ -23,14 +70,23 @@ async def API_read_product(proID: str):
     Raises:
         HTTPException: If the product is not found (404 Not Found).
     """
-    logger.info(f"Received request to read product with ID: {proID}")
+    logger.info("Received request to read product with ID: %s", proID)
+
+    if is_conditional(request):
+        validators = await Product.read_validators(proID)
+        if validators is None:
+            raise HTTPException(detail="product NOT found", status_code=status.HTTP_404_NOT_FOUND)
+        etag, last_modified = validators
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(validator_headers(etag, last_modified, Evariable.product_cache_control))
 
     try:
-        product_info = await Product.get(proID)
+        product_info, etag, last_modified = await Product.get_with_validators(proID)
     
     except NotFoundError:
         raise HTTPException(detail="product NOT found", status_code=status.HTTP_404_NOT_FOUND)
     
+    response.headers.update(validator_headers(etag, last_modified, Evariable.product_cache_control))
     return product_info
 
 
@@ -45,12 +101,13 @@ async def API_save_product(product: ProductSchema):
     Returns:
         dict: A success message and the newly created product ID.
     """
-    logger.info(f"Received request to create a new product: {product}")
+    logger.info("Received request to create a new product: %s", product)
     
     try:
         new_product = Product(**product.model_dump())
         await new_product.save()
-        logger.info(f"New product created successfully | Product ID: {new_product.pk}")
+        logger.info("New product created successfully | Product ID: %s", new_product.pk)
+        await publish_product_event("created", new_product.pk, product.model_dump())
 
     except Exception as e : 
         logger_error.error(f"Error while creating product | Error: {e}")
@@ -76,12 +133,13 @@ async def API_update_product(product: ProductSchema , proID: str):
             - If the product is not found (404 Not Found).
             - If an error occurs during the update process (400 Bad Request).
     """
-    logger.info(f"Received request to update product with ID: {proID} | New data: {product}")
+    logger.info("Received request to update product with ID: %s | New data: %s", proID, product)
     
     try: 
         product_info = await Product.get(proID)
         await product_info.update(**product.model_dump())
-        logger.info(f"product updated successfully | pk:{proID}")
+        logger.info("product updated successfully | pk:%s", proID)
+        await publish_product_event("updated", proID, product.model_dump())
 
     except NotFoundError:
         raise HTTPException(detail="product NOT found", status_code=status.HTTP_404_NOT_FOUND)
@@ -93,6 +151,36 @@ async def API_update_product(product: ProductSchema , proID: str):
     return {"message":"product updated successfully"}
 
 
+@product_router.put('/shard_product/{proID}', status_code=status.HTTP_200_OK)
+async def API_shard_product(proID: str, shards: int = Query(ge=1, le=Evariable.inventory_shard_max)):
+    """
+    Split the stock of a product over several shard counters, for products that sell in bursts.
+
+    Orders of a sharded product each take their stock from one shard, so they no longer contend
+    for the product hash; its `Product_Inventory` follows the shards once they are added up by
+    the shard syncer. One shard gathers the stock back into the product hash.
+
+    Args:
+        proID (str): The unique identifier of the product.
+        shards (int): The number of shards, 1 to stop sharding the product.
+
+    Returns:
+        dict: A success message and the stock of the product.
+
+    Raises:
+        HTTPException: If the product is not found (404 Not Found).
+    """
+    logger.info("Received request to shard product with ID: %s | shards : %s", proID, shards)
+
+    try:
+        stock = await Product.shard_inventory(proID, shards)
+    except NotFoundError:
+        raise HTTPException(detail="product NOT found", status_code=status.HTTP_404_NOT_FOUND)
+
+    logger.info("product sharded successfully | pk:%s | shards : %s", proID, shards)
+    return {"message": "product sharded successfully", "shards": shards, "Product_Inventory": stock}
+
+
 @product_router.delete('/delete_product/{proID}', status_code=status.HTTP_200_OK)
 async def API_delete_product(proID: str):
     """
@@ -107,14 +195,54 @@ async def API_delete_product(proID: str):
     Raises:
         HTTPException: If the product is not found (404 Not Found).
     """
-    logger.info(f"Received request to delete product with ID: {proID}")
+    logger.info("Received request to delete product with ID: %s", proID)
     
     try:
         product_info = await Product.get(proID)
         await product_info.delete(pk=proID)
-        logger.info(f"Product deleted successfully | Product ID: {proID}")
+        logger.info("Product deleted successfully | Product ID: %s", proID)
+        await publish_product_event("deleted", proID)
 
     except NotFoundError:
         raise HTTPException(detail="product NOT found", status_code=status.HTTP_404_NOT_FOUND)
     
-    return {"message":"product deleted successfully"}
\ No newline at end of file
+    return {"message":"product deleted successfully"}
+
+
+@product_router.post('/import_products', status_code=status.HTTP_200_OK)
+async def API_import_products(request: Request):
+    """
+    Bulk-import products from a streamed NDJSON or CSV request body of any size.
+
+    The body is sent as `application/x-ndjson` (one JSON object per line) or `text/csv`
+    (a header line, then one product per line). Rows are validated against ProductSchema as
+    they arrive and written in pipelined batches of `bulk_batch_size`. Rows that carry a `pk`
+    overwrite the product with that ID. Product events are published for every saved batch.
+
+    Args:
+        request (Request): The request whose body holds the products.
+
+    Returns:
+        dict: The number of imported and failed rows and the errors of the failed rows.
+    """
+    content_type = request.headers.get("content-type", "application/x-ndjson")
+    logger.info("Received request to import products | content-type: %s", content_type)
+
+    return await import_products(request.stream(), content_type)
+
+
+@product_router.get('/export_products', status_code=status.HTTP_200_OK)
+async def API_export_products(format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    """
+    Stream every product as NDJSON or CSV in constant memory.
+
+    Args:
+        format (str): Either 'ndjson' (default) or 'csv'.
+
+    Returns:
+        StreamingResponse: The products, one per line, including their `pk`.
+    """
+    logger.info("Received request to export products | format: %s", format)
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(export_products(format == "csv"), media_type=media_type)
\ No newline at end of file
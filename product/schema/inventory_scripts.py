@@ -0,0 +1,405 @@
+from redis.commands.core import AsyncScript
+
+# Every key a script touches is declared in its KEYS. The scripts keep the listing indexes in step with
+# the product hashes atomically, so all inventory keys must live on one Redis instance: the services
+# assume a single Redis server, not a cluster.
+
+# Keeps the in-stock index in line with a product's stock level. The index member of a product is
+# the first line of its entry in the index registry, see REINDEX_PRODUCT_SCRIPT.
+SYNC_STOCK_FUNCTION = """
+local function sync_stock(registry, stock_index, pk, stock)
+    local members = redis.call('HGET', registry, pk)
+    if not members then
+        return
+    end
+    local price_member = string.sub(members, 1, string.find(members, '\\n', 1, true) - 1)
+    if stock > 0 then
+        redis.call('ZADD', stock_index, 0, price_member)
+    else
+        redis.call('ZREM', stock_index, price_member)
+    end
+end
+"""
+
+
+# Every write to a product hash bumps its 'Version' and sets 'Updated_at' (epoch seconds), which the
+# HTTP validators are built from. The first write also sets 'Epoch', the creation time in microseconds:
+# a product deleted and created again with the same pk starts over at version 1 under a new epoch.
+TOUCH_FUNCTION = """
+local function touch(product)
+    local now = redis.call('TIME')
+    redis.call('HINCRBY', product, 'Version', 1)
+    redis.call('HSET', product, 'Updated_at', now[1])
+    redis.call('HSETNX', product, 'Epoch', now[1] .. string.format('%06d', now[2]))
+end
+"""
+
+
+# The stock of a product is the 'Product_Inventory' field of its hash until the product is sharded, and is
+# then split over shard counters, listed in the shard registry with their count. Callers pass the hash, or
+# one shard of their choosing, with a flag telling which: '1' for a shard, '0' for the hash. Writes to a
+# shard leave the hash alone; the shard syncer adds the shards up into 'Product_Inventory' in the background.
+STOCK_FUNCTION = SYNC_STOCK_FUNCTION + TOUCH_FUNCTION + """
+-- Returns the stock held by the key, 'missing' if the product does not exist and 'stale' if the caller's
+-- view of the shards is out of date: it passed a shard that is gone, or the hash of a sharded product.
+local function stock_of(key, sharded, pk, shard)
+    if shard == '1' then
+        local stock = redis.call('GET', key)
+        if not stock or redis.call('HEXISTS', sharded, pk) == 0 then
+            return 'stale'
+        end
+        return tonumber(stock)
+    end
+    local stock = redis.call('HGET', key, 'Product_Inventory')
+    if not stock then
+        return 'missing'
+    end
+    if redis.call('HEXISTS', sharded, pk) == 1 then
+        return 'stale'
+    end
+    return tonumber(stock)
+end
+
+-- Adds `delta` units to the stock held by the key and returns the new stock.
+local function add_stock(key, delta, registry, stock_index, pk, shard)
+    if shard == '1' then
+        return redis.call('INCRBY', key, delta)
+    end
+    local stock = redis.call('HINCRBY', key, 'Product_Inventory', delta)
+    touch(key)
+    sync_stock(registry, stock_index, pk, stock)
+    return stock
+end
+"""
+
+
+# Splits `total` units evenly over the shard counters KEYS[first] to KEYS[last].
+SPREAD_FUNCTION = """
+local function spread(total, first, last)
+    local shards = last - first + 1
+    for i = first, last do
+        local share = math.floor(total / shards)
+        if i - first < total % shards then
+            share = share + 1
+        end
+        redis.call('SET', KEYS[i], share)
+    end
+end
+"""
+
+
+# Decrements the inventory of every product only if each has enough stock left, all items or none.
+# The stock keys are KEYS[first + 1 ...] and their (product_id, quantity, shard flag) triples start at ARGV[offset + 1].
+# Returns {1, 0, 0, new_stock...} on success, {0, item_index, stock} when an item is short, {-1, item_index, 0}
+# when a product does not exist and {-2, item_index, 0} when the shards of a product changed. item_index is 0-based.
+SUBTRACT_FUNCTION = STOCK_FUNCTION + """
+local function subtract(first, offset, registry, stock_index, sharded)
+    local items = #KEYS - first
+    for i = 1, items do
+        local stock = stock_of(KEYS[first + i], sharded, ARGV[offset + 3 * i - 2], ARGV[offset + 3 * i])
+        if stock == 'missing' then
+            return {-1, i - 1, 0}
+        end
+        if stock == 'stale' then
+            return {-2, i - 1, 0}
+        end
+        if stock < tonumber(ARGV[offset + 3 * i - 1]) then
+            return {0, i - 1, stock}
+        end
+    end
+    local result = {1, 0, 0}
+    for i = 1, items do
+        result[i + 3] = add_stock(KEYS[first + i], -tonumber(ARGV[offset + 3 * i - 1]), registry, stock_index,
+                                  ARGV[offset + 3 * i - 2], ARGV[offset + 3 * i])
+    end
+    return result
+end
+"""
+
+
+# KEYS: index registry, in-stock index, shard registry, stock keys... ARGV: a (product_id, quantity, shard flag) triple per stock key.
+SUBTRACT_INVENTORY_SCRIPT = SUBTRACT_FUNCTION + """
+return subtract(3, 0, KEYS[1], KEYS[2], KEYS[3])
+"""
+
+
+# Holds stock for an order, all items or none.
+# KEYS: reservation hash, expiry sorted set, index registry, in-stock index, shard registry, stock keys...
+# ARGV: order_id, ttl, then a (product_id, quantity, shard flag) triple per stock key.
+# Returns {1, 0, 0, new_stock...} on success ({1, 0, 0} if the order is already reserved), and otherwise
+# what subtracting returns.
+RESERVE_INVENTORY_SCRIPT = SUBTRACT_FUNCTION + """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return {1, 0, 0}
+end
+local result = subtract(5, 2, KEYS[3], KEYS[4], KEYS[5])
+if result[1] ~= 1 then
+    return result
+end
+for i = 1, #KEYS - 5 do
+    redis.call('HSET', KEYS[1], ARGV[3 * i], ARGV[3 * i + 1])
+end
+local now = redis.call('TIME')
+redis.call('ZADD', KEYS[2], tonumber(now[1]) + tonumber(ARGV[2]), ARGV[1])
+return result
+"""
+
+
+# Makes the stock deduction of a paid order final, at most once per order. The hold of the order is
+# dropped if it still has one, since its stock was taken when reserving; otherwise, e.g. once the hold
+# expired, the items are subtracted. Either way the order is marked committed for `ttl` seconds, and
+# further commits of it change nothing.
+# KEYS: committed marker, reservation hash, expiry sorted set, index registry, in-stock index, shard registry, stock keys...
+# ARGV: order_id, ttl, then a (product_id, quantity, shard flag) triple per stock key.
+# Returns {2, 0, 0} if the order was already committed, {3, 0, 0} if its reservation was committed, and
+# otherwise what subtracting returns.
+COMMIT_ORDER_SCRIPT = SUBTRACT_FUNCTION + """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return {2, 0, 0}
+end
+local result = {3, 0, 0}
+if redis.call('DEL', KEYS[2]) == 1 then
+    redis.call('ZREM', KEYS[3], ARGV[1])
+else
+    result = subtract(6, 2, KEYS[4], KEYS[5], KEYS[6])
+    if result[1] ~= 1 then
+        return result
+    end
+end
+redis.call('SET', KEYS[1], 1, 'EX', tonumber(ARGV[2]))
+return result
+"""
+
+
+# Shared by the release scripts. Every key a release touches is passed in KEYS, so the caller reads
+# the products of the reservations first; reservations never change once made, only disappear.
+# KEYS: expiry sorted set, index registry, in-stock index, shard registry, the reservation hash of every order,
+# then stock keys. ARGV: the number of orders, their order_ids, then a (product_id, shard flag) pair per stock key.
+# Every unsharded product that gets stock back is appended to `restocked` as a (product_id, new_stock) pair.
+RELEASE_FUNCTION = STOCK_FUNCTION + """
+local orders = tonumber(ARGV[1])
+local products, shards = {}, {}
+for i = 1, #KEYS - 4 - orders do
+    products[ARGV[orders + 2 * i]] = KEYS[orders + 4 + i]
+    shards[ARGV[orders + 2 * i]] = ARGV[orders + 2 * i + 1]
+end
+local restocked = {}
+-- Returns 1 if the n-th order was released, 0 if it holds no reservation and -1 if it reserved a product
+-- not passed in, or passed with shards that changed.
+local function release(n)
+    local order_id, reservation = ARGV[n + 1], KEYS[n + 4]
+    local items = redis.call('HGETALL', reservation)
+    for i = 1, #items, 2 do
+        local product = products[items[i]]
+        if not product or stock_of(product, KEYS[4], items[i], shards[items[i]]) == 'stale' then
+            return -1
+        end
+    end
+    for i = 1, #items, 2 do
+        local product, shard = products[items[i]], shards[items[i]]
+        if stock_of(product, KEYS[4], items[i], shard) ~= 'missing' then
+            local stock = add_stock(product, items[i + 1], KEYS[2], KEYS[3], items[i], shard)
+            if shard == '0' then
+                restocked[#restocked + 1] = items[i]
+                restocked[#restocked + 1] = stock
+            end
+        end
+    end
+    redis.call('DEL', reservation)
+    redis.call('ZREM', KEYS[1], order_id)
+    if #items > 0 then
+        return 1
+    end
+    return 0
+end
+"""
+
+# Releases one order. Returns {released, product_id, new_stock, ...} where released is 1 if a reservation
+# was released, 0 if there was none and -1 if the reservation names products that were not passed in.
+RELEASE_RESERVATION_SCRIPT = RELEASE_FUNCTION + """
+local released = release(1)
+if released == -1 then
+    return {-1}
+end
+return {released, unpack(restocked)}
+"""
+
+# Releases the given orders whose reservation expired; orders committed or released since they were
+# listed are skipped. Returns {released_count, product_id, new_stock, ...}.
+RELEASE_EXPIRED_RESERVATIONS_SCRIPT = RELEASE_FUNCTION + """
+local now = tonumber(redis.call('TIME')[1])
+local released = 0
+for n = 1, orders do
+    local expiry = redis.call('ZSCORE', KEYS[1], ARGV[n + 1])
+    if expiry and tonumber(expiry) <= now and release(n) == 1 then
+        released = released + 1
+    end
+end
+return {released, unpack(restocked)}
+"""
+
+
+# Splits the stock of a product over `shards` shard counters, or gathers it back into the hash with a
+# single shard. The stock is taken from the current shards, or from the hash if the product is not
+# sharded or was saved since its shards were last spread.
+# KEYS: product hash, index registry, in-stock index, shard registry, then the shards of the larger layout.
+# ARGV: product_id, shards, the shard count the caller read.
+# Returns {1, stock}, {-1} if the product does not exist and {-2} if its shard count is no longer the one read.
+SHARD_INVENTORY_SCRIPT = SYNC_STOCK_FUNCTION + TOUCH_FUNCTION + SPREAD_FUNCTION + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {-1}
+end
+local current = tonumber(redis.call('HGET', KEYS[4], ARGV[1]) or '0')
+if current ~= tonumber(ARGV[3]) then
+    return {-2}
+end
+local total = tonumber(redis.call('HGET', KEYS[1], 'Product_Inventory') or '0')
+if current > 0 and redis.call('HEXISTS', KEYS[1], 'Spread_pending') == 0 then
+    total = 0
+    for i = 5, 4 + current do
+        total = total + tonumber(redis.call('GET', KEYS[i]) or '0')
+    end
+end
+for i = 5, #KEYS do
+    redis.call('DEL', KEYS[i])
+end
+local shards = tonumber(ARGV[2])
+if shards > 1 then
+    spread(total, 5, 4 + shards)
+    redis.call('HSET', KEYS[4], ARGV[1], shards)
+else
+    redis.call('HDEL', KEYS[4], ARGV[1])
+end
+redis.call('HDEL', KEYS[1], 'Spread_pending')
+redis.call('HSET', KEYS[1], 'Product_Inventory', total)
+touch(KEYS[1])
+sync_stock(KEYS[2], KEYS[3], ARGV[1], total)
+return {1, total}
+"""
+
+
+# Adds the shards of a sharded product up into its 'Product_Inventory', and spreads them evenly again once
+# the fullest and the emptiest shard are more than `drift` units apart. A product saved since its shards
+# were last spread has its saved stock spread instead; the shards of a deleted product are dropped.
+# KEYS: product hash, index registry, in-stock index, shard registry, shards... ARGV: product_id, drift.
+# Returns {stock, changed, rebalanced}, {-1} if the product was deleted and {-2} if its shard count changed.
+SYNC_SHARDS_SCRIPT = SYNC_STOCK_FUNCTION + TOUCH_FUNCTION + SPREAD_FUNCTION + """
+if tonumber(redis.call('HGET', KEYS[4], ARGV[1]) or '0') ~= #KEYS - 4 then
+    return {-2}
+end
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    for i = 5, #KEYS do
+        redis.call('DEL', KEYS[i])
+    end
+    redis.call('HDEL', KEYS[4], ARGV[1])
+    return {-1}
+end
+local stock = tonumber(redis.call('HGET', KEYS[1], 'Product_Inventory') or '0')
+if redis.call('HDEL', KEYS[1], 'Spread_pending') == 1 then
+    spread(stock, 5, #KEYS)
+    return {stock, 0, 1}
+end
+local total, low, high = 0, nil, nil
+for i = 5, #KEYS do
+    local shard = tonumber(redis.call('GET', KEYS[i]) or '0')
+    total = total + shard
+    low = math.min(low or shard, shard)
+    high = math.max(high or shard, shard)
+end
+local rebalanced = 0
+if high - low > tonumber(ARGV[2]) then
+    spread(total, 5, #KEYS)
+    rebalanced = 1
+end
+if total == stock then
+    return {total, 0, rebalanced}
+end
+redis.call('HSET', KEYS[1], 'Product_Inventory', total)
+touch(KEYS[1])
+sync_stock(KEYS[2], KEYS[3], ARGV[1], total)
+return {total, 1, rebalanced}
+"""
+
+
+# Drops the shards of a deleted product. KEYS: shard registry, shards... ARGV: product_id.
+# Returns 0 and leaves them to the shard syncer if the product has another number of shards.
+DROP_SHARDS_SCRIPT = """
+if tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0') ~= #KEYS - 1 then
+    return 0
+end
+for i = 2, #KEYS do
+    redis.call('DEL', KEYS[i])
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+# Moves a product to its current entries in the listing indexes, or drops it from them once deleted.
+# The registry maps each product to "<price member>\n<name member>" so old entries can be removed.
+# KEYS: index registry, price index, in-stock index, name index, product hash.
+# ARGV: product_id, price member, name member.
+REINDEX_PRODUCT_SCRIPT = """
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+if old then
+    local separator = string.find(old, '\\n', 1, true)
+    local old_price = string.sub(old, 1, separator - 1)
+    redis.call('ZREM', KEYS[2], old_price)
+    redis.call('ZREM', KEYS[3], old_price)
+    redis.call('ZREM', KEYS[4], string.sub(old, separator + 1))
+end
+local stock = redis.call('HGET', KEYS[5], 'Product_Inventory')
+if not stock then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return 0
+end
+redis.call('ZADD', KEYS[2], 0, ARGV[2])
+if tonumber(stock) > 0 then
+    redis.call('ZADD', KEYS[3], 0, ARGV[2])
+end
+redis.call('ZADD', KEYS[4], 0, ARGV[3])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. '\\n' .. ARGV[3])
+return 1
+"""
+
+# Marks a product hash as written, after a save that replaced its fields, and spreads the saved stock of a
+# sharded product over its shards. If the product has another number of shards than the ones passed, the
+# hash is flagged with 'Spread_pending' and the shard syncer spreads it on its next run.
+# KEYS: product hash, shard registry, the shards the caller knows of. ARGV: product_id.
+SAVE_PRODUCT_SCRIPT = TOUCH_FUNCTION + SPREAD_FUNCTION + """
+touch(KEYS[1])
+local shards = redis.call('HGET', KEYS[2], ARGV[1])
+if not shards then
+    return 0
+end
+if tonumber(shards) ~= #KEYS - 2 then
+    redis.call('HSET', KEYS[1], 'Spread_pending', 1)
+    return 0
+end
+redis.call('HDEL', KEYS[1], 'Spread_pending')
+spread(tonumber(redis.call('HGET', KEYS[1], 'Product_Inventory') or '0'), 3, #KEYS)
+return 1
+"""
+
+
+# Reads what the HTTP validators of a product are built from.
+# KEYS: product hash. Returns {} if the product does not exist, else {version, updated_at, epoch}.
+PRODUCT_VERSION_SCRIPT = """
+local fields = redis.call('HMGET', KEYS[1], 'Version', 'Updated_at', 'Epoch')
+if not fields[1] and redis.call('EXISTS', KEYS[1]) == 0 then
+    return {}
+end
+return {tonumber(fields[1] or '0'), tonumber(fields[2] or '0'), fields[3] or '0'}
+"""
+
+_scripts: dict[str, AsyncScript] = {}
+
+
+def run_script(db, source: str, keys: list, args: list):
+    """
+    Runs a Lua script through EVALSHA, registering it on first use.
+    """
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = db.register_script(source)
+    return script(keys=keys, args=args, client=db)
@@ -1,5 +1,37 @@
-from aredis_om import HashModel 
+import random
+import time
+from aredis_om import HashModel , NotFoundError
 from pydantic import BaseModel 
+from .inventory_scripts import (run_script , SUBTRACT_INVENTORY_SCRIPT , RESERVE_INVENTORY_SCRIPT ,
+                                COMMIT_ORDER_SCRIPT , RELEASE_RESERVATION_SCRIPT , RELEASE_EXPIRED_RESERVATIONS_SCRIPT ,
+                                REINDEX_PRODUCT_SCRIPT , SAVE_PRODUCT_SCRIPT , PRODUCT_VERSION_SCRIPT ,
+                                SHARD_INVENTORY_SCRIPT , SYNC_SHARDS_SCRIPT , DROP_SHARDS_SCRIPT)
+
+# Prices are stored in the price index as fixed-width strings, so lexicographic order is numeric order.
+PRICE_KEY_OFFSET = 10 ** 15
+
+# The shard count of every sharded product, as this process last read it. The inventory scripts check
+# the shards they are passed, so a stale count costs a retry rather than a wrong write.
+shard_counts: dict[str, int] = {}
+
+
+class InsufficientInventoryError(Exception):
+
+    """
+    Raised when a product does not hold enough stock for the requested quantity.
+
+    Attributes:
+    - available : int
+        The stock level at the time of the request.
+
+    - product_id : str, optional
+        The product that ran short, when several products were requested at once.
+    """
+
+    def __init__(self, available: int, product_id: str | None = None) -> None:
+        self.available = available
+        self.product_id = product_id
+        super().__init__(f"Insufficient inventory, only {available} left")
 
 
 
@@ -32,5 +64,460 @@ class Product(HashModel, ProductSchema):
     Redis HashModel capabilities allow the product to be saved, retrieved, and managed
     efficiently in the Redis database, while Pydantic's schema validation ensures data integrity.
 
+    The stock of a hot product can be split over shard counters with `shard_inventory`, so that
+    concurrent orders write to different keys. 'Product_Inventory' then holds the sum of the
+    shards as last added up by the shard syncer, see `sync_shards`.
+
+    Every write to the hash bumps its 'Version' and sets 'Updated_at', two fields kept outside
+    the model so a save cannot write back a stale version; HTTP validators are built from them
+    and from 'Epoch', the creation time of the hash, so a re-created product gets new ETags.
+
     """
-    pass
+
+    # The fields are all inherited, so give the model annotations of its own: aredis_om rewrites
+    # them in place and would otherwise leak the product fields into every other HashModel.
+    __annotations__ = {}
+
+    @classmethod
+    async def get_many(cls, pks: list[str]) -> dict[str, "Product | None"]:
+        """
+        Fetches several products with one pipelined round trip to Redis.
+
+        Args:
+            pks (list[str]): The unique identifiers of the products to fetch.
+
+        Returns:
+            dict[str, Product | None]: The products keyed by their ID, or None for IDs that do not exist.
+        """
+        async with cls.db().pipeline(transaction=False) as pipe:
+            for pk in pks:
+                pipe.hgetall(cls.make_primary_key(pk))
+            documents = await pipe.execute()
+
+        return {pk: cls.model_validate({**document, "pk": pk}) if document else None
+                for pk, document in zip(pks, documents)}
+
+    @classmethod
+    async def get_with_validators(cls, pk) -> tuple["Product", str, int]:
+        """
+        Fetches a product together with its HTTP validators.
+
+        Returns:
+            tuple[Product, str, int]: The product, its ETag and the epoch second it was last modified.
+
+        Raises:
+            NotFoundError: If the product does not exist.
+        """
+        document = await cls.db().hgetall(cls.make_primary_key(pk))
+        if not document:
+            raise NotFoundError
+        etag = cls.make_etag(int(document.get("Version", 0)), document.get("Epoch", "0"))
+        return cls.model_validate({**document, "pk": pk}), etag, int(document.get("Updated_at", 0))
+
+    @classmethod
+    async def read_validators(cls, pk) -> tuple[str, int] | None:
+        """
+        Reads the HTTP validators of a product in one script call, without reading the product.
+
+        Returns:
+            tuple[str, int] | None: The ETag and last modification time as in `get_with_validators`,
+            or None if the product does not exist.
+        """
+        result = await run_script(cls.db(), PRODUCT_VERSION_SCRIPT, [cls.make_primary_key(pk)], [])
+        if not result:
+            return None
+        version, updated_at, epoch = result
+        return cls.make_etag(version, epoch), updated_at
+
+    @staticmethod
+    def make_etag(version: int, epoch: str) -> str:
+        return f'"{epoch}-{version}"'
+
+    @classmethod
+    async def take_stock(cls, source: str, keys: list[str], args: list, items: dict[str, int]) -> tuple[int, dict[str, int]]:
+        """
+        Runs an inventory script that takes stock from several products, all or none.
+
+        The stock of a sharded product is taken from one shard picked at random. A shard that runs short
+        is swapped for another shard of the product and the script runs again, until every shard was
+        tried; a shard count the script finds out of date is read again from Redis.
+
+        Args:
+            source (str): The script, see SUBTRACT_FUNCTION for the stock keys and arguments it takes.
+            keys (list[str]): The keys the script takes before the stock keys.
+            args (list): The arguments the script takes before the items.
+            items (dict[str, int]): The quantity to take, keyed by product ID.
+
+        Returns:
+            tuple[int, dict[str, int]]: The status the script returned and the new stock level of each unsharded product.
+
+        Raises:
+            NotFoundError: If one of the products does not exist.
+            InsufficientInventoryError: If one of the products holds fewer units than requested, in every shard
+                for a sharded product; `available` is then the stock of the shards tried.
+        """
+        pks = list(items)
+        short: dict[str, dict[int, int]] = {}
+        while True:
+            chosen: dict[str, int] = {}
+            stock_keys, stock_args = [], []
+            for pk in pks:
+                untried = [shard for shard in range(shard_counts.get(pk, 0)) if shard not in short.get(pk, {})]
+                if short.get(pk) and not untried:
+                    raise InsufficientInventoryError(sum(short[pk].values()), pk)
+                if untried:
+                    chosen[pk] = random.choice(untried)
+                    stock_keys.append(cls.shard_key(pk, chosen[pk]))
+                else:
+                    stock_keys.append(cls.make_primary_key(pk))
+                stock_args += [pk, items[pk], 1 if untried else 0]
+
+            status, index, stock, *levels = await run_script(cls.db(), source, keys + stock_keys, args + stock_args)
+
+            if status == -2:
+                short.pop(pks[index], None)
+                await cls.refresh_shard_counts([pks[index]])
+                continue
+            if status == -1:
+                raise NotFoundError
+            if status == 0:
+                if pks[index] not in chosen:
+                    raise InsufficientInventoryError(stock, pks[index])
+                short.setdefault(pks[index], {})[chosen[pks[index]]] = stock
+                continue
+            return status, {pk: level for pk, level in zip(pks, levels) if pk not in chosen}
+
+    @classmethod
+    async def subtract_inventory(cls, items: dict[str, int]) -> dict[str, int]:
+        """
+        Atomically decrements the inventory of several products if each has enough stock left.
+
+        The check and the decrement run server side in one round trip, so concurrent
+        subtracts can neither lose updates nor drive the stock negative. Either every
+        item is subtracted or none is.
+
+        Args:
+            items (dict[str, int]): The number of units to subtract, keyed by product ID.
+
+        Returns:
+            dict[str, int]: The new stock level of each unsharded product.
+
+        Raises:
+            NotFoundError: If one of the products does not exist.
+            InsufficientInventoryError: If one of the products holds fewer units than requested.
+        """
+        _, levels = await cls.take_stock(SUBTRACT_INVENTORY_SCRIPT,
+                                         [cls.index_key("registry"), cls.index_key("in_stock"), cls.shards_key()], [], items)
+        return levels
+
+    @classmethod
+    def inventory_key(cls, *parts: str) -> str:
+        """
+        Builds the key of an inventory bookkeeping structure, kept outside the product keyspace.
+        """
+        return ":".join((cls._meta.global_key_prefix.strip(":"), "inventory", *parts))
+
+    @classmethod
+    def index_key(cls, *parts: str) -> str:
+        """
+        Builds the key of a listing index, kept outside the product keyspace.
+        """
+        return ":".join((cls._meta.global_key_prefix.strip(":"), "index", *parts))
+
+    @classmethod
+    def shards_key(cls) -> str:
+        return cls.inventory_key("sharded")
+
+    @classmethod
+    def shard_key(cls, pk: str, shard: int) -> str:
+        return cls.inventory_key("shard", pk, str(shard))
+
+    @classmethod
+    def shard_keys(cls, pk: str, shards: int) -> list[str]:
+        return [cls.shard_key(pk, shard) for shard in range(shards)]
+
+    @staticmethod
+    def load_shard_counts(counts: dict[str, str]) -> None:
+        shard_counts.clear()
+        shard_counts.update((pk, int(count)) for pk, count in counts.items())
+
+    @classmethod
+    async def refresh_shard_counts(cls, pks: list[str]) -> None:
+        counts = await cls.db().hmget(cls.shards_key(), pks)
+        for pk, count in zip(pks, counts):
+            if count:
+                shard_counts[pk] = int(count)
+            else:
+                shard_counts.pop(pk, None)
+
+    @classmethod
+    def release_keys(cls) -> list[str]:
+        return [cls.inventory_key("reservations"), cls.index_key("registry"), cls.index_key("in_stock"), cls.shards_key()]
+
+    @classmethod
+    def restock_keys(cls, pks: list[str]) -> tuple[list[str], list]:
+        """
+        Picks the key every product gets its released stock back on: a random shard, or the product hash if it is not sharded.
+
+        Returns:
+            tuple[list[str], list]: The stock keys, and the (product_id, shard flag) pairs the release scripts take with them.
+        """
+        keys, args = [], []
+        for pk in pks:
+            shards = shard_counts.get(pk, 0)
+            keys.append(cls.shard_key(pk, random.randrange(shards)) if shards else cls.make_primary_key(pk))
+            args += [pk, 1 if shards else 0]
+        return keys, args
+
+    @staticmethod
+    def price_key(price: float) -> str:
+        """
+        Encodes a price so that the lexicographic order of the encoded prices is their numeric order.
+        """
+        if price < 0:
+            return f"-{PRICE_KEY_OFFSET + price:020.4f}"
+        return f"{price:020.4f}"
+
+    async def save(self, pipeline=None) -> "Product":
+        """
+        Saves the product and moves it to its current entries in the listing indexes.
+
+        The saved stock of a sharded product is spread over its shards.
+
+        Without a pipeline the hash and the indexes are written in one transaction.
+        """
+        if pipeline is None:
+            async with self.db().pipeline(transaction=True) as pipe:
+                await self.save(pipeline=pipe)
+                await pipe.execute()
+            return self
+
+        await super().save(pipeline=pipeline)
+        await run_script(pipeline, SAVE_PRODUCT_SCRIPT,
+                         [self.key(), self.shards_key()] + self.shard_keys(self.pk, shard_counts.get(self.pk, 0)), [self.pk])
+        await self.reindex(self.pk, self.Product_Price, self.Product_Name, pipeline)
+        return self
+
+    @classmethod
+    async def delete(cls, pk, pipeline=None) -> int:
+        """
+        Deletes the product and its shards and drops it from the listing indexes.
+        """
+        if pipeline is None:
+            await cls.refresh_shard_counts([pk])
+            async with cls.db().pipeline(transaction=True) as pipe:
+                await cls.delete(pk, pipeline=pipe)
+                deleted, *_ = await pipe.execute()
+            return deleted
+
+        deleted = await super().delete(pk, pipeline=pipeline)
+        await cls.reindex(pk, 0, "", pipeline)
+        await run_script(pipeline, DROP_SHARDS_SCRIPT, [cls.shards_key()] + cls.shard_keys(pk, shard_counts.get(pk, 0)), [pk])
+        return deleted
+
+    @classmethod
+    async def reindex(cls, pk: str, price: float, name: str, client=None):
+        """
+        Moves a product to its entries in the price, in-stock and name indexes, or drops it from them if it no longer exists.
+
+        Args:
+            pk (str): The unique identifier of the product.
+            price (float): The current price of the product.
+            name (str): The current name of the product.
+            client (optional): A pipeline to queue the update on instead of running it right away.
+        """
+        keys = [cls.index_key("registry"), cls.index_key("price"), cls.index_key("in_stock"), cls.index_key("name"),
+                cls.make_primary_key(pk)]
+        return await run_script(client or cls.db(), REINDEX_PRODUCT_SCRIPT, keys,
+                                [pk, f"{cls.price_key(price)}:{pk}", f"{name.lower()}:{pk}"])
+
+    @classmethod
+    async def reserve_inventory(cls, order_id: str, items: dict[str, int], ttl: int) -> dict[str, int]:
+        """
+        Atomically holds stock for an order until it is committed, released or expires.
+
+        Either every item is reserved or none is. Reserving again for an order that already
+        holds a reservation is a no-op.
+
+        Args:
+            order_id (str): The unique identifier of the order the stock is held for.
+            items (dict[str, int]): The quantity to hold, keyed by product ID.
+            ttl (int): Seconds after which the reservation expires and its stock is released.
+
+        Returns:
+            dict[str, int]: The new stock level of each unsharded product, or an empty dict if the order was already reserved.
+
+        Raises:
+            NotFoundError: If one of the products does not exist.
+            InsufficientInventoryError: If one of the products holds fewer units than requested.
+        """
+        keys = [cls.inventory_key("reservation", order_id), cls.inventory_key("reservations"),
+                cls.index_key("registry"), cls.index_key("in_stock"), cls.shards_key()]
+        _, levels = await cls.take_stock(RESERVE_INVENTORY_SCRIPT, keys, [order_id, ttl], items)
+        return levels
+
+    @classmethod
+    async def commit_order(cls, order_id: str, items: dict[str, int], ttl: int) -> dict[str, int] | None:
+        """
+        Makes the stock deduction of a paid order final, at most once per order, in one atomic script.
+
+        The reservation of the order is committed if it still holds one; its stock was already
+        taken out when it was reserved. Without one, e.g. because it expired, the items are
+        subtracted instead. The order is then remembered as committed for `ttl` seconds, so a
+        payment worker that retries or duplicates the commit cannot take the stock twice.
+
+        Args:
+            order_id (str): The unique identifier of the order.
+            items (dict[str, int]): The quantities of the order, keyed by product ID.
+            ttl (int): Seconds the order is remembered as committed.
+
+        Returns:
+            dict[str, int] | None: The new stock level of each unsharded product, empty if the reservation was committed,
+            or None if the order was already committed.
+
+        Raises:
+            NotFoundError: If the items had to be subtracted and one of the products does not exist.
+            InsufficientInventoryError: If the items had to be subtracted and one of the products holds fewer units than requested.
+        """
+        keys = [cls.inventory_key("committed", order_id), cls.inventory_key("reservation", order_id), cls.inventory_key("reservations"),
+                cls.index_key("registry"), cls.index_key("in_stock"), cls.shards_key()]
+        status, levels = await cls.take_stock(COMMIT_ORDER_SCRIPT, keys, [order_id, ttl], items)
+        if status == 2:
+            return None
+        return levels
+
+    @classmethod
+    async def release_reservation(cls, order_id: str) -> dict[str, int] | None:
+        """
+        Releases the reservation of an order and returns its stock to the products.
+
+        The products of the reservation are read first, so the release script can declare every key it writes.
+
+        Args:
+            order_id (str): The unique identifier of the order.
+
+        Returns:
+            dict[str, int] | None: The new stock level of each restocked unsharded product, or None if the order holds no reservation.
+        """
+        reservation = cls.inventory_key("reservation", order_id)
+        while True:
+            pks = await cls.db().hkeys(reservation)
+            if not pks:
+                return None
+            keys, args = cls.restock_keys(pks)
+            released, *restocked = await run_script(cls.db(), RELEASE_RESERVATION_SCRIPT,
+                                                    cls.release_keys() + [reservation] + keys, [1, order_id, *args])
+            # -1: the order was reserved again with other products since they were read, or their shards changed
+            if released != -1:
+                break
+            await cls.refresh_shard_counts(pks)
+        if not released:
+            return None
+        return dict(zip(restocked[::2], restocked[1::2]))
+
+    @classmethod
+    async def release_expired_reservations(cls, limit: int) -> tuple[int, dict[str, int]]:
+        """
+        Releases up to `limit` expired reservations.
+
+        The expired orders and the products they hold, with the shard counts, are read in two round trips,
+        and released in a third by one script.
+
+        Args:
+            limit (int): The maximum number of reservations to release.
+
+        Returns:
+            tuple[int, dict[str, int]]: The number of reservations released and the new stock level of each restocked product.
+        """
+        db = cls.db()
+        # the script checks the expiry again against the clock of Redis
+        order_ids = await db.zrangebyscore(cls.inventory_key("reservations"), "-inf", int(time.time()), start=0, num=limit)
+        if not order_ids:
+            return 0, {}
+
+        reservations = [cls.inventory_key("reservation", order_id) for order_id in order_ids]
+        async with db.pipeline(transaction=False) as pipe:
+            pipe.hgetall(cls.shards_key())
+            for reservation in reservations:
+                pipe.hkeys(reservation)
+            sharded, *reserved = await pipe.execute()
+        cls.load_shard_counts(sharded)
+
+        pks = list(dict.fromkeys(pk for products in reserved for pk in products))
+        keys, args = cls.restock_keys(pks)
+        released, *restocked = await run_script(db, RELEASE_EXPIRED_RESERVATIONS_SCRIPT,
+                                                cls.release_keys() + reservations + keys, [len(order_ids), *order_ids, *args])
+        return released, dict(zip(restocked[::2], restocked[1::2]))
+
+
+    @classmethod
+    async def shard_inventory(cls, pk: str, shards: int) -> int:
+        """
+        Splits the stock of a product evenly over `shards` shard counters, or gathers it back into the product hash if `shards` is 1.
+
+        A sharded product takes every reservation, subtract and release on a single shard picked at random,
+        so concurrent orders of a hot product no longer contend for one key. Its 'Product_Inventory', and
+        with it its entry in the in-stock index, follows the shards once the shard syncer added them up.
+
+        Args:
+            pk (str): The unique identifier of the product.
+            shards (int): The number of shards.
+
+        Returns:
+            int: The stock of the product.
+
+        Raises:
+            NotFoundError: If the product does not exist.
+        """
+        keys = [cls.make_primary_key(pk), cls.index_key("registry"), cls.index_key("in_stock"), cls.shards_key()]
+        while True:
+            await cls.refresh_shard_counts([pk])
+            current = shard_counts.get(pk, 0)
+            status, *stock = await run_script(cls.db(), SHARD_INVENTORY_SCRIPT, keys + cls.shard_keys(pk, max(current, shards)),
+                                              [pk, shards, current])
+            if status == -1:
+                raise NotFoundError
+            # -2: the product was sharded again since its shard count was read
+            if status != -2:
+                break
+        await cls.refresh_shard_counts([pk])
+        return stock[0]
+
+    @classmethod
+    async def sync_shards(cls, drift: int) -> tuple[dict[str, int], int]:
+        """
+        Adds the shards of every sharded product up into its 'Product_Inventory', in one pipelined round trip.
+
+        Shards are spread evenly again once the fullest and the emptiest shard of a product are more than
+        `drift` units apart, so orders keep finding a shard with stock. The shard counts this process
+        knows are refreshed on the way.
+
+        Args:
+            drift (int): The largest difference between two shards of a product that is left as it is.
+
+        Returns:
+            tuple[dict[str, int], int]: The new stock level of each product whose stock changed, and the number of products rebalanced.
+        """
+        db = cls.db()
+        cls.load_shard_counts(await db.hgetall(cls.shards_key()))
+        counts = dict(shard_counts)
+        if not counts:
+            return {}, 0
+
+        keys = [cls.index_key("registry"), cls.index_key("in_stock"), cls.shards_key()]
+        async with db.pipeline(transaction=False) as pipe:
+            for pk, shards in counts.items():
+                await run_script(pipe, SYNC_SHARDS_SCRIPT, [cls.make_primary_key(pk)] + keys + cls.shard_keys(pk, shards), [pk, drift])
+            results = await pipe.execute()
+
+        levels: dict[str, int] = {}
+        rebalanced = 0
+        for pk, result in zip(counts, results):
+            # {-1}: the product was deleted, {-2}: it was sharded again since the counts were read
+            if len(result) == 1:
+                continue
+            stock, changed, spread = result
+            if changed:
+                levels[pk] = stock
+            rebalanced += spread
+        return levels, rebalanced
@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+from unittest import mock
+import fakeredis
+import httpx
+from fastapi import FastAPI , Request
+from payment.schema.payment import Payment
+from payment.app import admission
+from payment.app.config import Evariable
+
+
+class AdmissionTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Payment.Meta.database = self.db
+        self.release = asyncio.Event()
+        app = FastAPI()
+
+        @app.post("/orders/")
+        async def order(request: Request):
+            async with admission.admit_order(request):
+                await self.release.wait()
+                return {"message": "Order processed"}
+
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=("10.0.0.1", 1234)), base_url="http://test")
+
+    async def asyncTearDown(self) -> None:
+        await self.client.aclose()
+        await self.db.aclose()
+
+    async def test_orders_in_flight_are_limited(self) -> None:
+        with mock.patch.object(Evariable, "rpc_max_in_flight", 2):
+            admitted = [asyncio.create_task(self.client.post("/orders/")) for _ in range(2)]
+            while admission.orders_in_flight < 2:
+                await asyncio.sleep(0)
+
+            rejected = await self.client.post("/orders/")
+            self.release.set()
+            responses = await asyncio.gather(*admitted)
+
+        self.assertEqual(rejected.status_code, 429)
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(admission.orders_in_flight, 0)
+
+    async def test_client_header_is_ignored_without_a_trusted_proxy(self) -> None:
+        self.release.set()
+        with mock.patch.object(Evariable, "order_rate_limit_per_client", 1.0), \
+                mock.patch.object(Evariable, "order_rate_limit_burst_per_client", 1):
+            first = await self.client.post("/orders/", headers={"X-Client-Id": "a"})
+            second = await self.client.post("/orders/", headers={"X-Client-Id": "b"})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 429)
+        self.assertEqual(admission.orders_in_flight, 0)
+
+    async def test_client_header_of_a_trusted_proxy(self) -> None:
+        self.release.set()
+        with mock.patch.object(Evariable, "order_rate_limit_per_client", 1.0), \
+                mock.patch.object(Evariable, "order_rate_limit_burst_per_client", 1), \
+                mock.patch.object(Evariable, "rate_limit_trusted_proxies", ["10.0.0.1"]):
+            first = await self.client.post("/orders/", headers={"X-Client-Id": "a"})
+            second = await self.client.post("/orders/", headers={"X-Client-Id": "b"})
+            third = await self.client.post("/orders/", headers={"X-Client-Id": "a"})
+
+        self.assertEqual([first.status_code, second.status_code, third.status_code], [200, 200, 429])
+
+
+if __name__ == "__main__":
+    unittest.main()
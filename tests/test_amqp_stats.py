@@ -0,0 +1,30 @@
+import unittest
+from unittest import mock
+from payment.app.amqp import PooledChannel
+from payment.app.config import Evariable
+
+
+class PooledChannelStatsTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_reading_stats_keeps_the_window(self) -> None:
+        channel = PooledChannel(0, mock.MagicMock(is_closed=False, default_exchange=mock.AsyncMock()), confirm_window=0)
+        await channel.publish(mock.MagicMock(), routing_key="inventory")
+
+        first, second = channel.stats(), channel.stats()
+
+        self.assertEqual(first["published"], 1)
+        self.assertEqual(channel.window_published, 1)
+        self.assertGreater(second["publishes_per_sec"], 0)
+
+    async def test_rate_of_the_last_window(self) -> None:
+        channel = PooledChannel(0, mock.MagicMock(is_closed=False), confirm_window=0)
+        channel.window_published = int(Evariable.amqp_stats_window * 2)
+
+        channel.count_publish(channel.window_started + Evariable.amqp_stats_window)
+
+        self.assertEqual(channel.stats()["publishes_per_sec"], 2.0)
+        self.assertEqual(channel.window_published, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
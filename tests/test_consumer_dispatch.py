@@ -0,0 +1,22 @@
+import json
+import unittest
+from unittest import mock
+from product.app.consumer import MessageDispatcher
+
+
+class MessageDispatcherTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_messages_that_are_not_objects_are_rejected(self) -> None:
+        dispatcher = MessageDispatcher(mock.AsyncMock(), max_concurrency=1)
+
+        for body in ([1, 2], "read", 42, None):
+            with self.subTest(body=body):
+                message = mock.AsyncMock(body=json.dumps(body).encode(), content_type="application/json", correlation_id="c")
+                await dispatcher.dispatch(message)
+
+                message.reject.assert_awaited_once_with(requeue=False)
+                self.assertFalse(dispatcher.tasks)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from payment.app.gateways import GatewayAdapter , GatewayError , PaymentGateway
+
+
+class SleepingGateway(PaymentGateway):
+
+    name = "sleeping"
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+
+    async def charge(self, payment, idempotency_key: str) -> None:
+        await asyncio.sleep(self.delay)
+
+
+def adapter(delay: float, concurrency: int, timeout: float) -> GatewayAdapter:
+    return GatewayAdapter(SleepingGateway(delay), concurrency=concurrency, timeout=timeout, hedge_delay=0.0,
+                          breaker_failures=1, breaker_reset=60.0)
+
+
+class GatewayTimeoutTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_waiting_for_a_slot_does_not_count_against_the_timeout(self) -> None:
+        gateway = adapter(delay=0.05, concurrency=1, timeout=0.08)
+
+        await asyncio.gather(*(gateway.charge(SimpleNamespace(pk=str(i))) for i in range(3)))
+
+        self.assertEqual(gateway.errors, 0)
+        self.assertEqual(gateway.breaker.state, "closed")
+
+    async def test_slow_gateway_times_out_and_opens_the_circuit(self) -> None:
+        gateway = adapter(delay=1.0, concurrency=1, timeout=0.02)
+
+        with self.assertRaises(GatewayError):
+            await gateway.charge(SimpleNamespace(pk="1"))
+
+        self.assertEqual(gateway.errors, 1)
+        self.assertEqual(gateway.breaker.state, "open")
+
+
+if __name__ == "__main__":
+    unittest.main()
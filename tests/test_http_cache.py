@@ -0,0 +1,60 @@
+import email.utils
+import time
+import unittest
+from unittest import mock
+import fakeredis
+from starlette.requests import Request
+from product.schema.product import Product
+from product.app import http_cache
+from product.app.http_cache import is_not_modified
+
+
+def conditional_request(**headers: str) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/",
+                    "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]})
+
+
+class IfModifiedSinceTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Product.Meta.database = self.db
+
+    async def asyncTearDown(self) -> None:
+        await self.db.aclose()
+
+    async def test_second_write_in_the_same_second_is_not_hidden(self) -> None:
+        product = await Product(Product_Name="hat", Product_Info="", Product_Inventory=1, Product_Price=5.0).save()
+        _, first_modified = await Product.read_validators(product.pk)
+        request = conditional_request(if_modified_since=email.utils.formatdate(first_modified, usegmt=True))
+
+        product.Product_Price = 6.0
+        await product.save()
+        _, second_modified = await Product.read_validators(product.pk)
+
+        # both writes land in one second as long as that second is not over
+        with mock.patch.object(http_cache.time, "time", return_value=first_modified + 0.5):
+            self.assertFalse(is_not_modified(request, '"etag"', max(first_modified, second_modified)))
+
+    def test_date_of_an_earlier_second_is_honoured(self) -> None:
+        now = int(time.time())
+        request = conditional_request(if_modified_since=email.utils.formatdate(now, usegmt=True))
+
+        with mock.patch.object(http_cache.time, "time", return_value=now + 0.5):
+            self.assertFalse(is_not_modified(request, '"etag"', now))
+            self.assertTrue(is_not_modified(request, '"etag"', now - 1))
+        self.assertFalse(is_not_modified(request, '"etag"', now + 1))
+
+    async def test_recreated_product_gets_a_new_etag(self) -> None:
+        product = await Product(Product_Name="hat", Product_Info="", Product_Inventory=1, Product_Price=5.0).save()
+        first_etag, _ = await Product.read_validators(product.pk)
+
+        await Product.delete(product.pk)
+        await Product(pk=product.pk, Product_Name="hat", Product_Info="", Product_Inventory=1, Product_Price=5.0).save()
+        second_etag, _ = await Product.read_validators(product.pk)
+
+        self.assertNotEqual(first_etag, second_etag)
+
+
+if __name__ == "__main__":
+    unittest.main()
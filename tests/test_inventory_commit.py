@@ -0,0 +1,49 @@
+import unittest
+import fakeredis
+from aredis_om import NotFoundError
+from product.schema.product import Product , InsufficientInventoryError
+
+
+class CommitOrderTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Product.Meta.database = self.db
+        self.product = await Product(Product_Name="hat", Product_Info="", Product_Inventory=10, Product_Price=5.0).save()
+
+    async def asyncTearDown(self) -> None:
+        await self.db.aclose()
+
+    async def stock(self) -> int:
+        return (await Product.get(self.product.pk)).Product_Inventory
+
+    async def test_reserved_order_is_committed_once(self) -> None:
+        await Product.reserve_inventory("order", {self.product.pk: 3}, 60)
+
+        self.assertEqual(await Product.commit_order("order", {self.product.pk: 3}, 60), {})
+        self.assertIsNone(await Product.commit_order("order", {self.product.pk: 3}, 60))
+
+        self.assertEqual(await self.stock(), 7)
+        self.assertFalse(await self.db.exists(Product.inventory_key("reservation", "order")))
+        self.assertIsNone(await Product.release_reservation("order"))
+
+    async def test_order_without_reservation_is_subtracted_once(self) -> None:
+        self.assertEqual(await Product.commit_order("order", {self.product.pk: 4}, 60), {self.product.pk: 6})
+        self.assertIsNone(await Product.commit_order("order", {self.product.pk: 4}, 60))
+
+        self.assertEqual(await self.stock(), 6)
+
+    async def test_short_order_is_not_marked_committed(self) -> None:
+        with self.assertRaises(InsufficientInventoryError):
+            await Product.commit_order("order", {self.product.pk: 11}, 60)
+
+        self.assertFalse(await self.db.exists(Product.inventory_key("committed", "order")))
+        self.assertEqual(await Product.commit_order("order", {self.product.pk: 10}, 60), {self.product.pk: 0})
+
+    async def test_order_of_a_missing_product(self) -> None:
+        with self.assertRaises(NotFoundError):
+            await Product.commit_order("order", {"missing": 1}, 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
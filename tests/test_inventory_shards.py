@@ -0,0 +1,104 @@
+import unittest
+import fakeredis
+from aredis_om import NotFoundError
+from product.schema.product import Product , InsufficientInventoryError , shard_counts
+
+
+class InventoryShardsTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Product.Meta.database = self.db
+        shard_counts.clear()
+        self.product = await Product(Product_Name="hat", Product_Info="", Product_Inventory=10, Product_Price=5.0).save()
+
+    async def asyncTearDown(self) -> None:
+        shard_counts.clear()
+        await self.db.aclose()
+
+    async def shards(self) -> list[int]:
+        return [int(stock) for stock in await self.db.mget(Product.shard_keys(self.product.pk, shard_counts[self.product.pk]))]
+
+    async def stock(self) -> int:
+        return int(await self.db.hget(self.product.key(), "Product_Inventory"))
+
+    async def test_subtract_takes_from_one_shard_and_syncs_in_the_background(self) -> None:
+        self.assertEqual(await Product.shard_inventory(self.product.pk, 4), 10)
+        self.assertEqual(await self.shards(), [3, 3, 2, 2])
+
+        self.assertEqual(await Product.subtract_inventory({self.product.pk: 2}), {})
+
+        self.assertEqual(sorted(await self.shards()), [0, 2, 3, 3])
+        self.assertEqual(await self.stock(), 10)
+        self.assertEqual(await Product.sync_shards(drift=10), ({self.product.pk: 8}, 0))
+        self.assertEqual(await self.stock(), 8)
+
+    async def test_short_shard_falls_back_to_the_others(self) -> None:
+        await Product.shard_inventory(self.product.pk, 2)
+        await Product.subtract_inventory({self.product.pk: 5})
+        await Product.subtract_inventory({self.product.pk: 4})
+
+        with self.assertRaises(InsufficientInventoryError) as raised:
+            await Product.subtract_inventory({self.product.pk: 2})
+
+        self.assertEqual(raised.exception.available, 1)
+        self.assertEqual(sorted(await self.shards()), [0, 1])
+
+    async def test_released_stock_returns_to_a_shard(self) -> None:
+        await Product.shard_inventory(self.product.pk, 3)
+        await Product.reserve_inventory("order", {self.product.pk: 3}, 60)
+        self.assertEqual(sum(await self.shards()), 7)
+
+        self.assertEqual(await Product.release_reservation("order"), {})
+
+        self.assertEqual(sum(await self.shards()), 10)
+
+    async def test_stale_shard_count_is_read_again(self) -> None:
+        await Product.shard_inventory(self.product.pk, 2)
+        # another instance sharded the product
+        shard_counts.clear()
+
+        await Product.commit_order("order", {self.product.pk: 3}, 60)
+
+        self.assertEqual(sum(await self.shards()), 7)
+        self.assertEqual(await self.stock(), 10)
+
+    async def test_drifting_shards_are_rebalanced(self) -> None:
+        await Product.shard_inventory(self.product.pk, 2)
+        await Product.subtract_inventory({self.product.pk: 5})
+
+        self.assertEqual(await Product.sync_shards(drift=2), ({self.product.pk: 5}, 1))
+
+        self.assertEqual(await self.shards(), [3, 2])
+
+    async def test_unsharding_gathers_the_stock(self) -> None:
+        await Product.shard_inventory(self.product.pk, 4)
+        await Product.subtract_inventory({self.product.pk: 3})
+
+        self.assertEqual(await Product.shard_inventory(self.product.pk, 1), 7)
+
+        self.assertEqual(await self.stock(), 7)
+        self.assertNotIn(self.product.pk, shard_counts)
+        self.assertEqual(await self.db.keys(Product.shard_key(self.product.pk, "*")), [])
+        self.assertEqual(await Product.subtract_inventory({self.product.pk: 2}), {self.product.pk: 5})
+
+    async def test_saved_stock_is_spread(self) -> None:
+        await Product.shard_inventory(self.product.pk, 2)
+
+        await self.product.update(Product_Inventory=21)
+
+        self.assertEqual(await self.shards(), [11, 10])
+        self.assertEqual(await Product.sync_shards(drift=10), ({}, 0))
+
+    async def test_deleted_product_drops_its_shards(self) -> None:
+        await Product.shard_inventory(self.product.pk, 2)
+
+        await Product.delete(self.product.pk)
+
+        self.assertEqual(await self.db.keys(Product.shard_key(self.product.pk, "*")), [])
+        with self.assertRaises(NotFoundError):
+            await Product.reserve_inventory("order", {self.product.pk: 1}, 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
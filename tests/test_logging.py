@@ -0,0 +1,36 @@
+import io
+import json
+import logging
+import unittest
+from unittest import mock
+from payment.app.logging_config import JsonLinesFormatter
+from payment.app.publisher import Publisher
+
+
+class JsonLinesCorrelationTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.output = io.StringIO()
+        self.handler = logging.StreamHandler(self.output)
+        self.handler.setFormatter(JsonLinesFormatter())
+        self.logger = logging.getLogger("publisher_logger")
+        self.level = self.logger.level
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.DEBUG)
+
+    async def asyncTearDown(self) -> None:
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+
+    async def test_rpc_records_carry_the_correlation_id(self) -> None:
+        publisher = Publisher(mock.MagicMock())
+
+        await publisher.on_response(mock.MagicMock(correlation_id="abc", body=b"{}", content_type="application/json"))
+
+        entries = [json.loads(line) for line in self.output.getvalue().splitlines()]
+        late = next(entry for entry in entries if "late response" in entry["message"])
+        self.assertEqual(late["correlation_id"], "abc")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from unittest import mock
+import fakeredis
+import httpx
+from fastapi import FastAPI
+from payment.schema.payment import Payment
+from payment.router.payment import payment_router
+from payment.app import admission
+from payment.app.config import Evariable
+
+
+class OrderIdempotencyTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Payment.Meta.database = self.db
+        self.inventory = mock.AsyncMock(side_effect=self.answer)
+        self.stock: dict[str, int] = {}
+        self.patches = [mock.patch("payment.router.payment.message_to_inventory", self.inventory),
+                        mock.patch("payment.app.worker.enqueue_payment", mock.AsyncMock())]
+        for patch in self.patches:
+            patch.start()
+        app = FastAPI()
+        app.include_router(payment_router, prefix="/v1")
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def asyncTearDown(self) -> None:
+        await self.client.aclose()
+        for patch in self.patches:
+            patch.stop()
+        await self.db.aclose()
+
+    async def answer(self, value: dict) -> dict | str:
+        if value["product_id"] not in self.stock:
+            raise ValueError("Product NOT found")
+        if value["method"] == "read":
+            return {"pk": value["product_id"], "Product_Inventory": self.stock[value["product_id"]], "Product_Price": 10.0}
+        return "The product reservation was successful"
+
+    async def order(self, key: str):
+        return await self.client.post("/v1/orders/", json={"Product_id": "hat", "Quantity": 1}, headers={"Idempotency-Key": key})
+
+    async def test_not_found_is_not_replayed(self) -> None:
+        self.assertEqual((await self.order("key")).status_code, 404)
+        self.stock["hat"] = 5
+
+        response = await self.order("key")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn("Idempotent-Replayed", response.headers)
+
+    async def test_insufficient_inventory_is_not_replayed(self) -> None:
+        self.stock["hat"] = 0
+        self.assertEqual((await self.order("key")).status_code, 400)
+        self.stock["hat"] = 5
+
+        self.assertEqual((await self.order("key")).status_code, 201)
+
+    async def test_replay_is_answered_before_admission(self) -> None:
+        self.stock["hat"] = 5
+        first = await self.order("key")
+
+        with mock.patch.object(Evariable, "rpc_max_in_flight", 1), mock.patch.object(admission, "orders_in_flight", 1):
+            replayed = await self.order("key")
+            rejected = await self.order("another key")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(replayed.status_code, 201)
+        self.assertEqual(replayed.json(), first.json())
+        self.assertEqual(replayed.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(rejected.status_code, 429)
+        self.assertEqual(self.inventory.await_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+import fakeredis
+from payment.schema.payment import Payment
+from payment.app import archive
+from payment.app.config import Evariable
+
+
+class PaymentArchiveSettingsTest(unittest.TestCase):
+
+    def test_archiving_is_off_by_default(self) -> None:
+        with mock.patch.object(Evariable, "payment_archive_after", 0.0), mock.patch.object(Evariable, "payment_archive_dir", ""):
+            archive.check_payment_archive()
+
+    def test_relative_directory_is_rejected(self) -> None:
+        with mock.patch.object(Evariable, "payment_archive_after", 60.0), mock.patch.object(Evariable, "payment_archive_dir", "archive"):
+            with self.assertRaises(SystemExit):
+                archive.check_payment_archive()
+
+    def test_missing_directory_is_rejected(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            missing = f"{directory}/missing"
+            with mock.patch.object(Evariable, "payment_archive_after", 60.0), mock.patch.object(Evariable, "payment_archive_dir", missing):
+                with self.assertRaises(SystemExit):
+                    archive.check_payment_archive()
+
+    def test_network_filesystem_is_rejected(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.object(Evariable, "payment_archive_after", 60.0), mock.patch.object(Evariable, "payment_archive_dir", directory), \
+                 mock.patch.object(archive, "filesystem_type", return_value="nfs4"):
+                with self.assertRaises(SystemExit):
+                    archive.check_payment_archive()
+
+    def test_existing_absolute_directory_is_accepted(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.object(Evariable, "payment_archive_after", 60.0), mock.patch.object(Evariable, "payment_archive_dir", directory):
+                archive.check_payment_archive()
+
+
+class PaymentArchiveLookupTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = archive.PaymentArchive(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.archive.close()
+        self.directory.cleanup()
+
+    def test_lookup_before_the_first_write(self) -> None:
+        self.assertIsNone(self.archive.find("order"))
+
+    def test_lookup_does_not_wait_for_the_writer(self) -> None:
+        self.archive.append([{"pk": "order", "status": "Completed"}, {"pk": "other", "status": "Failed"}])
+
+        with self.archive.lock:
+            self.assertEqual(self.archive.find("order"), {"pk": "order", "status": "Completed"})
+            self.assertIsNone(self.archive.find("missing"))
+
+
+class PaymentArchiverLockTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Payment.Meta.database = self.db
+        self.directory = tempfile.TemporaryDirectory()
+        self.patches = [mock.patch.object(Evariable, "payment_archive_after", 60.0),
+                        mock.patch.object(Evariable, "payment_archive_batch", 1),
+                        mock.patch.object(archive, "payment_archive", archive.PaymentArchive(self.directory.name))]
+        for patch in self.patches:
+            patch.start()
+        for _ in range(5):
+            await Payment(Product_id="product", Purchase_time=datetime.now() - timedelta(days=1), Quantity=1,
+                          Total_price=10.0, status="Completed").save()
+
+    async def asyncTearDown(self) -> None:
+        archive.payment_archive.close()
+        for patch in self.patches:
+            patch.stop()
+        self.directory.cleanup()
+        await self.db.aclose()
+
+    async def test_lock_is_extended_during_a_run(self) -> None:
+        archiver = archive.PaymentArchiver()
+        await self.db.set(archive.lock_key(), archiver.token, ex=archiver.lock_ttl())
+
+        self.assertEqual(await archiver.archive(), 5)
+        self.assertEqual(await self.db.get(archive.lock_key()), archiver.token)
+
+    async def test_run_stops_once_the_lock_is_lost(self) -> None:
+        archiver = archive.PaymentArchiver()
+        await self.db.set(archive.lock_key(), "another archiver", ex=archiver.lock_ttl())
+
+        self.assertLess(await archiver.archive(), 5)
+        self.assertEqual(await self.db.get(archive.lock_key()), "another archiver")
+
+
+if __name__ == "__main__":
+    unittest.main()
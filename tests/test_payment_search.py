@@ -0,0 +1,45 @@
+import unittest
+from datetime import datetime
+import fakeredis
+from payment.schema.payment import Payment
+from payment.app import search
+
+
+class PaymentIndexBuildTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Payment.Meta.database = self.db
+
+    async def asyncTearDown(self) -> None:
+        await self.db.aclose()
+
+    async def unindexed_payment(self) -> Payment:
+        payment = await Payment(Product_id="product", Purchase_time=datetime.now(), Quantity=1, Total_price=10.0,
+                                status="pending").save()
+        for index in payment.index_keys():
+            await self.db.zrem(index, payment.index_member())
+        return payment
+
+    async def test_interrupted_build_is_completed(self) -> None:
+        first, second = await self.unindexed_payment(), await self.unindexed_payment()
+        # a build that indexed one payment and stopped, or a payment written since the upgrade
+        await self.db.zadd(Payment.index_key("time"), {first.index_member(): 0})
+
+        await search.ensure_payment_indexes()
+
+        page = await search.search_payments(limit=10)
+        self.assertEqual({payment["pk"] for payment in page["payments"]}, {first.pk, second.pk})
+        self.assertTrue(await self.db.exists(search.indexes_built_key()))
+
+    async def test_completed_build_is_not_repeated(self) -> None:
+        await search.ensure_payment_indexes()
+        payment = await self.unindexed_payment()
+
+        await search.ensure_payment_indexes()
+
+        self.assertIsNone(await self.db.zscore(Payment.index_key("time"), payment.index_member()))
+
+
+if __name__ == "__main__":
+    unittest.main()
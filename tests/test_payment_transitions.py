@@ -0,0 +1,121 @@
+import unittest
+from datetime import datetime
+import fakeredis
+from aredis_om import NotFoundError
+from payment.schema.payment import Payment , InvalidTransitionError
+
+
+def new_payment(**fields) -> Payment:
+    return Payment(**{"Product_id": "product", "Purchase_time": datetime.now(), "Quantity": 1, "Total_price": 10.0,
+                      "status": "pending", **fields})
+
+
+class PaymentTransitionTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Payment.Meta.database = self.db
+
+    async def asyncTearDown(self) -> None:
+        await self.db.aclose()
+
+    async def test_transition_updates_status_version_and_fields(self) -> None:
+        payment = await new_payment().save()
+
+        await payment.transition("processing", Payment_Gateway="simulated")
+
+        stored = await self.db.hgetall(payment.key())
+        self.assertEqual(stored["status"], "processing")
+        self.assertEqual(stored["Payment_Gateway"], "simulated")
+        self.assertEqual(stored["Version"], "2")
+        self.assertEqual(payment.Version, 2)
+        self.assertIsNotNone(payment.Updated_at)
+
+    async def test_transition_is_recorded_in_the_audit_stream(self) -> None:
+        payment = await new_payment().save()
+
+        await payment.transition("processing")
+        await payment.transition("Completed")
+
+        entries = await self.db.xrange(Payment.audit_key(payment.pk))
+        self.assertEqual([(entry["from"], entry["to"]) for _, entry in entries], [("pending", "processing"), ("processing", "Completed")])
+
+    async def test_transition_moves_the_payment_between_status_indexes(self) -> None:
+        payment = await new_payment().save()
+
+        await payment.transition("processing")
+
+        self.assertEqual(await self.db.zcard(Payment.index_key("status", "pending")), 0)
+        self.assertEqual(await self.db.zrange(Payment.index_key("status", "processing"), 0, -1), [payment.index_member()])
+
+    async def test_stale_copy_cannot_repeat_a_transition(self) -> None:
+        payment = await new_payment().save()
+        duplicate = await Payment.get(payment.pk)
+        await payment.transition("processing")
+        await payment.transition("Completed")
+
+        with self.assertRaises(InvalidTransitionError) as raised:
+            await duplicate.transition("processing")
+
+        self.assertEqual(raised.exception.current, "Completed")
+        self.assertEqual(duplicate.status, "Completed")
+        self.assertEqual(await self.db.hget(payment.key(), "Version"), "3")
+
+    async def test_final_status_cannot_be_overwritten(self) -> None:
+        payment = await new_payment().save()
+        late = await Payment.get(payment.pk)
+        await payment.transition("processing")
+        late.status = "processing"
+        await payment.transition("Failed")
+
+        with self.assertRaises(InvalidTransitionError):
+            await late.transition("Completed")
+
+        self.assertEqual(await self.db.hget(payment.key(), "status"), "Failed")
+
+    async def test_unreachable_status_is_rejected(self) -> None:
+        payment = await new_payment().save()
+
+        with self.assertRaises(InvalidTransitionError):
+            await payment.transition("Completed")
+
+        self.assertEqual(await self.db.hget(payment.key(), "status"), "pending")
+
+    async def test_transition_of_a_missing_payment(self) -> None:
+        with self.assertRaises(NotFoundError):
+            await new_payment().transition("processing")
+
+
+class PaymentClaimTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Payment.Meta.database = self.db
+        self.payment = await new_payment().save()
+        await self.payment.transition("processing", Worker_id="owner")
+
+    async def asyncTearDown(self) -> None:
+        await self.db.aclose()
+
+    async def test_payment_of_a_live_owner_is_not_claimed(self) -> None:
+        await self.db.set("heartbeat:owner", 1)
+
+        self.assertFalse(await self.payment.claim("other", "heartbeat:owner"))
+        self.assertEqual(await self.db.hget(self.payment.key(), "Worker_id"), "owner")
+
+    async def test_payment_of_a_dead_owner_is_claimed_once(self) -> None:
+        stale = await Payment.get(self.payment.pk)
+
+        self.assertTrue(await self.payment.claim("first", "heartbeat:owner"))
+        self.assertFalse(await stale.claim("second", "heartbeat:owner"))
+        self.assertEqual(await self.db.hget(self.payment.key(), "Worker_id"), "first")
+
+    async def test_finished_payment_is_not_claimed(self) -> None:
+        await self.payment.transition("Completed")
+        self.payment.status = "processing"
+
+        self.assertFalse(await self.payment.claim("other", "heartbeat:owner"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,243 @@
+import asyncio
+import unittest
+from datetime import datetime
+from unittest import mock
+import fakeredis
+from payment.schema.payment import Payment
+from payment.app import worker
+from payment.app.gateways import PaymentGateway , PaymentDeclinedError , register_gateway , GATEWAYS
+from product.schema.product import Product
+from product.app.consumer import on_response
+
+
+class CountingGateway(PaymentGateway):
+
+    name = "counting"
+
+    def __init__(self) -> None:
+        self.charges: list[str] = []
+
+    async def charge(self, payment, idempotency_key: str) -> None:
+        self.charges.append(idempotency_key)
+        await asyncio.sleep(0.01)
+
+
+class DecliningGateway(PaymentGateway):
+
+    name = "declining"
+
+    async def charge(self, payment, idempotency_key: str) -> None:
+        raise PaymentDeclinedError("card declined")
+
+
+class PaymentWorkerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Payment.Meta.database = self.db
+        self.gateway = CountingGateway()
+        register_gateway(self.gateway)
+        self.inventory = mock.AsyncMock(return_value="The product update was successful")
+        self.patches = [mock.patch("payment.app.payment_gateway.message_to_inventory", self.inventory),
+                        mock.patch("payment.app.payment_gateway.publish_status", mock.AsyncMock()),
+                        mock.patch("payment.app.payment_gateway.enqueue_webhook_event", mock.AsyncMock())]
+        for patch in self.patches:
+            patch.start()
+        self.payment = await Payment(Product_id="product", Purchase_time=datetime.now(), Quantity=1, Total_price=10.0,
+                                     status="pending", Payment_Gateway="counting").save()
+
+    async def asyncTearDown(self) -> None:
+        for patch in self.patches:
+            patch.stop()
+        GATEWAYS.pop("counting", None)
+        GATEWAYS.pop("declining", None)
+        await self.db.aclose()
+
+    async def start_pool(self) -> worker.PaymentWorkerPool:
+        pool = worker.PaymentWorkerPool(concurrency=10)
+        await pool.heartbeat()
+        return pool
+
+    def subtracts(self) -> int:
+        return sum(1 for call in self.inventory.await_args_list if call.args[0]["method"] == "subtract")
+
+    async def test_payment_is_charged_and_committed(self) -> None:
+        pool = await self.start_pool()
+
+        self.assertTrue(await pool.run_job(self.payment.pk))
+
+        self.assertEqual(await self.db.hget(self.payment.key(), "status"), "Completed")
+        self.assertEqual(await self.db.hget(self.payment.key(), "Worker_id"), pool.worker_id)
+        self.assertEqual(self.gateway.charges, [self.payment.pk])
+        self.assertEqual(self.subtracts(), 1)
+
+    async def test_duplicate_jobs_in_two_pools_charge_once(self) -> None:
+        first, second = await self.start_pool(), await self.start_pool()
+
+        await asyncio.gather(first.run_job(self.payment.pk), second.run_job(self.payment.pk))
+
+        self.assertEqual(await self.db.hget(self.payment.key(), "status"), "Completed")
+        self.assertEqual(len(self.gateway.charges), 1)
+        self.assertEqual(self.subtracts(), 1)
+
+    async def test_duplicate_jobs_in_one_pool_charge_once(self) -> None:
+        pool = await self.start_pool()
+
+        await asyncio.gather(pool.run_job(self.payment.pk), pool.run_job(self.payment.pk))
+
+        self.assertEqual(len(self.gateway.charges), 1)
+        self.assertEqual(self.subtracts(), 1)
+
+    async def test_payment_processed_by_a_live_pool_is_not_resumed(self) -> None:
+        owner, other = await self.start_pool(), await self.start_pool()
+        await self.payment.transition("processing", Payment_Gateway="counting", Worker_id=owner.worker_id)
+
+        self.assertTrue(await other.run_job(self.payment.pk))
+
+        self.assertEqual(await self.db.hget(self.payment.key(), "status"), "processing")
+        self.assertEqual(await self.db.hget(self.payment.key(), "Worker_id"), owner.worker_id)
+        self.assertEqual(self.gateway.charges, [])
+        self.assertEqual(self.subtracts(), 0)
+
+    async def test_payment_of_a_dead_pool_is_resumed(self) -> None:
+        await self.payment.transition("processing", Payment_Gateway="counting", Worker_id="dead")
+        pool = await self.start_pool()
+
+        self.assertTrue(await pool.run_job(self.payment.pk))
+
+        self.assertEqual(await self.db.hget(self.payment.key(), "status"), "Completed")
+        self.assertEqual(await self.db.hget(self.payment.key(), "Worker_id"), pool.worker_id)
+        self.assertEqual(self.gateway.charges, [self.payment.pk])
+        self.assertEqual(self.subtracts(), 1)
+
+    async def test_payment_of_a_dead_pool_is_resumed_once(self) -> None:
+        await self.payment.transition("processing", Payment_Gateway="counting", Worker_id="dead")
+        first, second = await self.start_pool(), await self.start_pool()
+
+        await asyncio.gather(first.run_job(self.payment.pk), second.run_job(self.payment.pk))
+
+        self.assertEqual(len(self.gateway.charges), 1)
+        self.assertEqual(self.subtracts(), 1)
+
+    async def test_finished_payment_is_skipped(self) -> None:
+        await self.payment.transition("processing", Worker_id="dead")
+        await self.payment.transition("Completed")
+        pool = await self.start_pool()
+
+        self.assertTrue(await pool.run_job(self.payment.pk))
+
+        self.assertEqual(self.gateway.charges, [])
+        self.assertEqual(self.subtracts(), 0)
+
+    async def test_declined_payment_releases_its_stock(self) -> None:
+        Product.Meta.database = self.db
+        register_gateway(DecliningGateway())
+        product = await Product(Product_Name="hat", Product_Info="", Product_Inventory=10, Product_Price=5.0).save()
+        payment = await Payment(Product_id=product.pk, Purchase_time=datetime.now(), Quantity=3, Total_price=15.0,
+                                status="pending", Payment_Gateway="declining").save()
+        await Product.reserve_inventory(payment.pk, {product.pk: 3}, 900)
+        # the inventory service answers from the same Redis
+        async def inventory(value: dict) -> dict:
+            return await on_response(value, "correlation")
+        self.inventory.side_effect = inventory
+        pool = await self.start_pool()
+
+        with mock.patch("product.app.consumer.publish_inventory_levels", mock.AsyncMock()):
+            await pool.run_job(payment.pk)
+
+        self.assertEqual(await self.db.hget(payment.key(), "status"), "Failed")
+        self.assertEqual((await Product.get(product.pk)).Product_Inventory, 10)
+        self.assertFalse(await self.db.exists(Product.inventory_key("reservation", payment.pk)))
+
+    async def test_failed_release_leaves_the_payment_failed(self) -> None:
+        register_gateway(DecliningGateway())
+        await self.payment.update(Payment_Gateway="declining")
+        self.inventory.side_effect = TimeoutError
+        pool = await self.start_pool()
+
+        await pool.run_job(self.payment.pk)
+
+        self.assertEqual(await self.db.hget(self.payment.key(), "status"), "Failed")
+        self.inventory.assert_awaited_once_with({"method": "release", "order_id": self.payment.pk})
+
+
+class PaymentRecoveryTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Payment.Meta.database = self.db
+
+    async def asyncTearDown(self) -> None:
+        await self.db.aclose()
+
+    def new_payment(self) -> Payment:
+        return Payment(Product_id="product", Purchase_time=datetime.now(), Quantity=1, Total_price=10.0, status="pending")
+
+    async def jobs(self) -> list[str]:
+        return await self.db.lrange(worker.jobs_key(), 0, -1)
+
+    async def test_enqueued_payment_is_not_queued_again(self) -> None:
+        payment = self.new_payment()
+        await worker.enqueue_payment(payment)
+
+        await worker.PaymentWorkerPool(concurrency=1).recover()
+
+        self.assertEqual(await self.jobs(), [payment.pk])
+
+    async def test_running_payment_is_not_queued_again(self) -> None:
+        payment = self.new_payment()
+        await worker.enqueue_payment(payment)
+        live = worker.PaymentWorkerPool(concurrency=1)
+        await live.heartbeat()
+        await self.db.lmove(worker.jobs_key(), worker.processing_key(live.worker_id), "RIGHT", "LEFT")
+
+        await worker.PaymentWorkerPool(concurrency=1).recover()
+
+        self.assertEqual(await self.jobs(), [])
+
+    async def test_payment_in_no_queue_is_queued_once(self) -> None:
+        payment = await self.new_payment().save()
+
+        await asyncio.gather(worker.PaymentWorkerPool(concurrency=1).requeue_unfinished([payment.key()]),
+                             worker.PaymentWorkerPool(concurrency=1).requeue_unfinished([payment.key()]))
+
+        self.assertEqual(await self.jobs(), [payment.pk])
+
+    async def test_finished_job_is_no_longer_queued(self) -> None:
+        payment = self.new_payment()
+        await worker.enqueue_payment(payment)
+        pool = worker.PaymentWorkerPool(concurrency=1)
+        await self.db.lmove(worker.jobs_key(), worker.processing_key(pool.worker_id), "RIGHT", "LEFT")
+        await pool.semaphore.acquire()
+
+        with mock.patch.object(pool, "run_job", mock.AsyncMock(return_value=False)):
+            await pool.run(payment.pk)
+
+        self.assertFalse(await self.db.sismember(worker.queued_key(), payment.pk))
+        await pool.recover()
+        self.assertEqual(await self.jobs(), [payment.pk])
+
+
+class PaymentWorkerStatsTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Payment.Meta.database = self.db
+
+    async def asyncTearDown(self) -> None:
+        await self.db.aclose()
+
+    async def test_reading_stats_keeps_the_window(self) -> None:
+        pool = worker.PaymentWorkerPool(concurrency=1)
+        pool.record(0.5, failed=False)
+
+        first, second = await pool.stats(), await pool.stats()
+
+        self.assertEqual(first["max_latency_ms"], 500.0)
+        self.assertEqual(second["max_latency_ms"], 500.0)
+        pool.reset_window()
+        self.assertEqual((await pool.stats())["max_latency_ms"], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import json
+import unittest
+from unittest import mock
+import fakeredis
+from product.schema.product import Product
+from product.app import bulk
+from product.app.config import Evariable
+
+
+async def chunks(*lines: dict):
+    yield "".join(json.dumps(line) + "\n" for line in lines).encode()
+
+
+class ProductImportEventsTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Product.Meta.database = self.db
+        self.publish = mock.AsyncMock()
+        self.patch = mock.patch.object(bulk, "publish_product_event", self.publish)
+        self.patch.start()
+
+    async def asyncTearDown(self) -> None:
+        self.patch.stop()
+        await self.db.aclose()
+
+    async def test_events_are_published_per_saved_batch(self) -> None:
+        existing = await Product(Product_Name="hat", Product_Info="", Product_Inventory=1, Product_Price=5.0).save()
+        rows = [{"pk": existing.pk, "Product_Name": "hat", "Product_Info": "", "Product_Inventory": 7, "Product_Price": 6.0},
+                {"Product_Name": "scarf", "Product_Info": "", "Product_Inventory": 3, "Product_Price": 9.0},
+                {"Product_Name": "", "Product_Inventory": -1},
+                {"pk": "new", "Product_Name": "glove", "Product_Info": "", "Product_Inventory": 2, "Product_Price": 4.0},
+                {"pk": "new", "Product_Name": "glove", "Product_Info": "", "Product_Inventory": 5, "Product_Price": 4.0}]
+
+        with mock.patch.object(Evariable, "bulk_batch_size", 2):
+            result = await bulk.import_products(chunks(*rows), "application/x-ndjson")
+
+        self.assertEqual((result["imported"], result["failed"]), (4, 1))
+        events = [(call.args[0], call.args[1], call.args[2]["Product_Inventory"]) for call in self.publish.await_args_list]
+        self.assertEqual(events[0], ("updated", existing.pk, 7))
+        self.assertEqual(events[1][0], "created")
+        self.assertEqual(events[2:], [("created", "new", 2), ("updated", "new", 5)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import fakeredis
+from product.schema.product import Product
+from product.app import catalog
+
+
+class ProductIndexBuildTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Product.Meta.database = self.db
+
+    async def asyncTearDown(self) -> None:
+        await self.db.aclose()
+
+    async def unindexed_product(self, name: str) -> Product:
+        product = await Product(Product_Name=name, Product_Info="", Product_Inventory=1, Product_Price=5.0).save()
+        member = f"{Product.price_key(product.Product_Price)}:{product.pk}"
+        await self.db.zrem(Product.index_key("price"), member)
+        await self.db.zrem(Product.index_key("in_stock"), member)
+        await self.db.zrem(Product.index_key("name"), f"{name}:{product.pk}")
+        await self.db.hdel(Product.index_key("registry"), product.pk)
+        return product
+
+    async def test_interrupted_build_is_completed(self) -> None:
+        first, second = await self.unindexed_product("hat"), await self.unindexed_product("scarf")
+        # a build that indexed one product and stopped, or a product written since the upgrade
+        await Product.reindex(first.pk, first.Product_Price, first.Product_Name)
+
+        await catalog.ensure_product_indexes()
+
+        page = await catalog.list_products(limit=10)
+        self.assertEqual({product["pk"] for product in page["products"]}, {first.pk, second.pk})
+        self.assertTrue(await self.db.exists(catalog.indexes_built_key()))
+
+    async def test_completed_build_is_not_repeated(self) -> None:
+        await catalog.ensure_product_indexes()
+        product = await self.unindexed_product("hat")
+
+        await catalog.ensure_product_indexes()
+
+        self.assertEqual((await catalog.list_products(limit=10))["products"], [])
+        self.assertFalse(await self.db.hexists(Product.index_key("registry"), product.pk))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import asyncio
+import unittest
+from unittest import mock
+from payment.app.codec import JSON , MSGPACK , encode
+from payment.app.publisher import Publisher , InsufficientInventoryError , ReplyDecodeError
+
+
+class PublisherReplyTest(unittest.IsolatedAsyncioTestCase):
+
+    async def reply(self, body: bytes, content_type: str | None = JSON) -> asyncio.Future:
+        publisher = Publisher(mock.MagicMock())
+        future = asyncio.get_running_loop().create_future()
+        publisher.futures["request"] = future
+        await publisher.on_response(mock.MagicMock(correlation_id="request", body=body, content_type=content_type))
+        return future
+
+    async def test_result(self) -> None:
+        future = await self.reply(encode({"result": {"Product_Inventory": 3}}, MSGPACK), MSGPACK)
+        self.assertEqual(future.result(), {"Product_Inventory": 3})
+
+    async def test_error_codes(self) -> None:
+        with self.assertRaises(ValueError):
+            (await self.reply(encode({"error": "NOT_FOUND"}, JSON))).result()
+        with self.assertRaises(InsufficientInventoryError):
+            (await self.reply(encode({"error": "INSUFFICIENT_INVENTORY"}, JSON))).result()
+
+    async def test_undecodable_reply_is_not_a_value_error(self) -> None:
+        for future in (await self.reply(b"{not json"), await self.reply(b"{}", "text/plain")):
+            self.assertIsInstance(future.exception(), ReplyDecodeError)
+            self.assertNotIsInstance(future.exception(), ValueError)
+
+    async def test_reply_that_is_not_an_object(self) -> None:
+        for body in (b"[1, 2]", b'"ok"', b"{}"):
+            future = await self.reply(body)
+            self.assertIsInstance(future.exception(), ReplyDecodeError)
+
+
+if __name__ == "__main__":
+    unittest.main()
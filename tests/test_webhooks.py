@@ -0,0 +1,166 @@
+import asyncio
+import json
+import unittest
+from datetime import datetime
+from unittest import mock
+import fakeredis
+import httpx
+from fastapi import FastAPI
+from payment.schema.payment import Payment
+from payment.router.payment import payment_router
+from payment.app import webhooks
+from payment.app.config import Evariable
+
+
+class StubReceiver:
+
+    """
+    A minimal HTTP server on the loopback interface that records the JSON bodies POSTed to it.
+    """
+
+    def __init__(self) -> None:
+        self.bodies: list[dict] = []
+        self.hosts: list[str] = []
+        self.received = asyncio.Event()
+        self.server: asyncio.Server | None = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/hook"
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = next(int(line.split(b":")[1]) for line in head.split(b"\r\n") if line.lower().startswith(b"content-length"))
+        self.hosts += [line.split(b":", 1)[1].strip().decode() for line in head.split(b"\r\n") if line.lower().startswith(b"host:")]
+        self.bodies.append(json.loads(await reader.readexactly(length)))
+        writer.write(b"HTTP/1.1 204 No Content\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        writer.close()
+        self.received.set()
+
+
+class WebhookUrlTest(unittest.IsolatedAsyncioTestCase):
+
+    def test_internal_urls_are_rejected(self) -> None:
+        for url in ("ftp://example.com/hook", "http://127.0.0.1/hook", "http://localhost:8000/hook", "http://10.1.2.3/hook",
+                    "http://169.254.169.254/latest/meta-data", "http://[::1]/hook", "http://[::ffff:127.0.0.1]/hook",
+                    "http://[fe80::1]/hook", "http://0.0.0.0/hook", "http://100.64.0.1/hook"):
+            with self.subTest(url=url), self.assertRaises(ValueError):
+                webhooks.check_webhook_url(url)
+
+    def test_public_urls_are_accepted(self) -> None:
+        for url in ("https://example.com/hook", "http://93.184.216.34:8080/hook", "https://[2606:4700::1111]/hook"):
+            webhooks.check_webhook_url(url)
+
+    def test_request_is_pinned_to_the_checked_address(self) -> None:
+        target, headers, extensions = webhooks.pinned_request("https://merchant.example:8443/hook?a=1", "93.184.216.34")
+
+        self.assertEqual(str(target), "https://93.184.216.34:8443/hook?a=1")
+        self.assertEqual(headers, {"Host": "merchant.example:8443"})
+        self.assertEqual(extensions, {"sni_hostname": "merchant.example"})
+        self.assertEqual(webhooks.pinned_request("https://merchant.example/hook", None)[0], httpx.URL("https://merchant.example/hook"))
+
+    async def test_name_resolving_to_an_internal_address_is_rejected(self) -> None:
+        resolved = [(2, 1, 6, "", ("10.0.0.7", 443))]
+        with mock.patch.object(asyncio.get_running_loop(), "getaddrinfo", mock.AsyncMock(return_value=resolved)):
+            with self.assertRaises(ValueError):
+                await webhooks.check_webhook_host("https://merchant.example/hook")
+
+
+class WebhookEndpointsTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Payment.Meta.database = self.db
+        app = FastAPI()
+        app.include_router(payment_router, prefix="/v1")
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def asyncTearDown(self) -> None:
+        await self.client.aclose()
+        await self.db.aclose()
+
+    async def test_internal_endpoint_is_not_registered(self) -> None:
+        response = await self.client.post("/v1/webhooks", json={"Url": "http://169.254.169.254/latest/meta-data"})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(await self.db.smembers(webhooks.endpoints_key()), set())
+
+    async def test_cart_items_take_no_order_fields(self) -> None:
+        response = await self.client.post("/v1/cart_orders/", json={
+            "Items": [{"Product_id": "hat", "Quantity": 1, "Callback_url": "https://example.com/hook"}]})
+
+        self.assertEqual(response.status_code, 422)
+
+
+class WebhookDeliveryTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.db = fakeredis.FakeAsyncRedis(decode_responses=True)
+        Payment.Meta.database = self.db
+        self.receiver = StubReceiver()
+        self.url = await self.receiver.start()
+        self.dispatcher = None
+
+    async def asyncTearDown(self) -> None:
+        if self.dispatcher:
+            await self.dispatcher.stop()
+        await self.receiver.stop()
+        await self.db.aclose()
+
+    async def completed_payment(self) -> Payment:
+        return await Payment(Product_id="product", Purchase_time=datetime.now(), Quantity=1, Total_price=10.0,
+                             status="Completed", Callback_url=self.url).save()
+
+    async def test_event_is_delivered_to_the_callback_url(self) -> None:
+        with mock.patch.object(Evariable, "webhook_allow_private_hosts", True):
+            payment = await self.completed_payment()
+            self.dispatcher = await webhooks.WebhookDispatcher().start()
+            self.assertEqual(await webhooks.enqueue_webhook_event(payment), 1)
+            async with asyncio.timeout(5):
+                await self.receiver.received.wait()
+                while self.dispatcher.delivered < 1:
+                    await asyncio.sleep(0.01)
+
+        [event] = self.receiver.bodies[0]["events"]
+        self.assertEqual(event["id"], f"{payment.pk}:Completed")
+        self.assertEqual(event["type"], "payment.completed")
+        self.assertEqual(await self.db.hlen(webhooks.deliveries_key()), 0)
+        self.assertEqual(await self.db.zcard(webhooks.schedule_key()), 0)
+
+    async def test_delivery_connects_to_the_checked_address(self) -> None:
+        port = self.receiver.server.sockets[0].getsockname()[1]
+        self.url = f"http://merchant.example:{port}/hook"
+        payment = await self.completed_payment()
+        # the name resolves once, to the receiver; another lookup would fail
+        resolved = [(2, 1, 6, "", ("127.0.0.1", port))]
+        getaddrinfo = mock.AsyncMock(side_effect=[resolved])
+        with mock.patch.object(asyncio.get_running_loop(), "getaddrinfo", getaddrinfo), \
+             mock.patch.object(webhooks, "blocked_address", return_value=False):
+            self.dispatcher = await webhooks.WebhookDispatcher().start()
+            await webhooks.enqueue_webhook_event(payment)
+            async with asyncio.timeout(5):
+                while self.dispatcher.delivered < 1:
+                    await asyncio.sleep(0.01)
+
+        self.assertEqual(self.receiver.hosts, [f"merchant.example:{port}"])
+        self.assertEqual(getaddrinfo.await_count, 1)
+
+    async def test_delivery_to_an_internal_address_is_dead_lettered(self) -> None:
+        payment = await self.completed_payment()
+        self.dispatcher = await webhooks.WebhookDispatcher().start()
+        await webhooks.enqueue_webhook_event(payment)
+        async with asyncio.timeout(5):
+            while not await self.db.llen(webhooks.dead_letter_key()):
+                await asyncio.sleep(0.01)
+
+        self.assertEqual(self.receiver.bodies, [])
+        self.assertEqual(await self.db.hlen(webhooks.deliveries_key()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()